@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import hashlib
+import re
+
+# Spelled-out words mapped to the USPS abbreviations customers also type
+ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'road': 'rd', 'drive': 'dr',
+    'boulevard': 'blvd', 'lane': 'ln', 'court': 'ct', 'circle': 'cir',
+    'place': 'pl', 'parkway': 'pkwy', 'highway': 'hwy', 'terrace': 'ter',
+    'trail': 'trl', 'way': 'wy', 'north': 'n', 'south': 's', 'east': 'e',
+    'west': 'w', 'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se',
+    'southwest': 'sw', 'apartment': 'apt', 'suite': 'ste', 'unit': 'unit',
+    'building': 'bldg', 'florida': 'fl',
+}
+
+
+def normalize_text(text):
+    """ Returns text lowercased, with punctuation dropped, runs of
+        whitespace (including line breaks) collapsed and common street
+        words abbreviated
+    """
+    words = re.sub(r'[.,#]', ' ', text or '').lower().split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+def address_key(street_1, street_2, city, state, zip_code):
+    """ Returns the canonical key of an address, a hex SHA-1 of its
+        normalized fields
+    """
+    fields = [normalize_text(street_1), normalize_text(street_2),
+              normalize_text(city), normalize_text(state),
+              (zip_code or '').strip()[:5]]
+    return hashlib.sha1('|'.join(fields).encode('utf-8')).hexdigest()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import os
+from sqlalchemy import DateTime, extract, func, literal_column, type_coerce
+from sqlalchemy.exc import IntegrityError
+from models import MenuItem, Order, OrderItem, Address, User, DAY_NAMES
+from models import ItemCount, DayOfWeekCount, TimeOfDayCount, ZipCodeCount
+from models import AnalyticsVersion, HourlyCount
+
+TOP_LIMIT = 5  # Rows shown for top items and top zip codes
+BUCKETS = ('hour', 'day', 'week')
+# Query dimension -> hourly_count dimension it is read from
+DIMENSIONS = {'item': 'item', 'zip': 'zip', 'hour': 'order',
+              'weekday': 'order'}
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Longest date range one query may cover, so the grouping stays bounded
+ANALYTICS_MAX_DAYS = int(os.environ.get('ANALYTICS_MAX_DAYS', 366))
+# Raise when a rollup table is added, so db-upgrade fills it from the order
+# history. 2 added hourly_count
+ROLLUP_VERSION = 2
+
+
+def day_number(order_time):
+    """ Returns the day of the week with Sunday as 0, like strftime('%w')"""
+    return (order_time.weekday() + 1) % 7
+
+
+def start_of_hour(order_time):
+    return order_time.replace(minute=0, second=0, microsecond=0)
+
+
+def record_order(session, order_time, menu_item_ids, zip_code):
+    """ Add one order to the rollup tables
+        Runs inside the caller's transaction so the rollups commit together
+        with the order. Does nothing until rebuild has built them, the
+        rebuild counts the order instead.
+    """
+    if needs_rebuild(session):
+        return
+    hour = start_of_hour(order_time)
+    # Rows are always touched in the same order, so two orders cannot each
+    # hold a row the other is waiting for
+    for menu_item_id in sorted(menu_item_ids):
+        increment(session, ItemCount, menu_item_id=menu_item_id)
+        increment(session, HourlyCount, dimension='item', hour=hour,
+                  bucket_key=str(menu_item_id))
+    increment(session, DayOfWeekCount, day_number=day_number(order_time))
+    increment(session, TimeOfDayCount, time_of_day=order_time.hour)
+    increment(session, HourlyCount, dimension='order', hour=hour,
+              bucket_key='')
+    if zip_code:
+        increment(session, ZipCodeCount, zip_code=zip_code)
+        increment(session, HourlyCount, dimension='zip', hour=hour,
+                  bucket_key=zip_code)
+
+
+def increment(session, model, amount=1, **key):
+    """ Add amount to the quantity of the rollup row matching key"""
+    query = session.query(model).filter_by(**key)
+    if query.update({model.quantity: model.quantity + amount},
+                    synchronize_session=False):
+        return
+    if session.get_bind().dialect.name == 'sqlite':
+        # One writer at a time, nobody can add the row before we commit
+        session.add(model(quantity=amount, **key))
+        session.flush()
+        return
+    # Two orders may both find the row missing, the one that inserts
+    # second counts itself against the row the first one added
+    try:
+        with session.begin_nested():
+            session.add(model(quantity=amount, **key))
+    except IntegrityError:
+        query.update({model.quantity: model.quantity + amount},
+                     synchronize_session=False)
+
+
+def rebuild(session):
+    """ Recompute every rollup table from the order history"""
+    for model in (ItemCount, DayOfWeekCount, TimeOfDayCount, ZipCodeCount,
+                  HourlyCount):
+        session.query(model).delete(synchronize_session=False)
+    items = session.query(OrderItem.menu_item_id, func.count()).filter(
+        OrderItem.menu_item_id.isnot(None)).group_by(OrderItem.menu_item_id)
+    for menu_item_id, quantity in items:
+        session.add(ItemCount(menu_item_id=menu_item_id, quantity=quantity))
+    days = {}
+    hours = {}
+    for (order_time,) in session.query(Order.order_time).filter(
+            Order.order_time.isnot(None)):
+        days[day_number(order_time)] = days.get(day_number(order_time), 0) + 1
+        hours[order_time.hour] = hours.get(order_time.hour, 0) + 1
+    for key, quantity in days.items():
+        session.add(DayOfWeekCount(day_number=key, quantity=quantity))
+    for key, quantity in hours.items():
+        session.add(TimeOfDayCount(time_of_day=key, quantity=quantity))
+    # Orders are credited to the customer's current address
+    zip_codes = session.query(Address.zip_code, func.count()).select_from(
+        Order).join(User, User.id == Order.user_id).join(
+        Address, Address.id == User.address_id).filter(
+        Address.zip_code.isnot(None)).group_by(Address.zip_code)
+    for zip_code, quantity in zip_codes:
+        session.add(ZipCodeCount(zip_code=zip_code, quantity=quantity))
+    rebuild_hourly(session)
+    session.query(AnalyticsVersion).delete(synchronize_session=False)
+    session.add(AnalyticsVersion(id=1, version=ROLLUP_VERSION,
+                                 built_at=datetime.datetime.now()))
+    session.commit()
+
+
+def rebuild_hourly(session):
+    """ Fill hourly_count from the order history, in the caller's
+        transaction
+    """
+    counts = {}
+
+    def add(dimension, order_time, key):
+        bucket = (dimension, start_of_hour(order_time), key)
+        counts[bucket] = counts.get(bucket, 0) + 1
+    for order_time, zip_code in session.query(
+            Order.order_time, Address.zip_code).outerjoin(
+            User, User.id == Order.user_id).outerjoin(
+            Address, Address.id == User.address_id).filter(
+            Order.order_time.isnot(None)).yield_per(10000):
+        add('order', order_time, '')
+        if zip_code:
+            add('zip', order_time, zip_code)
+    for order_time, menu_item_id in session.query(
+            Order.order_time, OrderItem.menu_item_id).join(
+            OrderItem, OrderItem.order_id == Order.id).filter(
+            Order.order_time.isnot(None),
+            OrderItem.menu_item_id.isnot(None)).yield_per(10000):
+        add('item', order_time, str(menu_item_id))
+    session.bulk_insert_mappings(HourlyCount, [
+        {'dimension': dimension, 'hour': hour, 'bucket_key': key,
+         'quantity': quantity}
+        for (dimension, hour, key), quantity in counts.items()])
+
+
+def needs_rebuild(session):
+    """ True until rebuild has built the rollups for this ROLLUP_VERSION
+        Orders placed before then are not counted as they come in, the
+        rebuild counts them
+    """
+    version = session.query(AnalyticsVersion.version).filter_by(
+        id=1).scalar()
+    return version is None or version < ROLLUP_VERSION
+
+
+def get_top_items(session, limit=TOP_LIMIT, active_only=False):
+    """ Returns the most ordered menu items, with active_only leaving out
+        items retired from the menu
+    """
+    query = session.query(
+        ItemCount.menu_item_id, MenuItem.name, MenuItem.description,
+        MenuItem.price, ItemCount.quantity).join(
+        MenuItem, MenuItem.id == ItemCount.menu_item_id)
+    if active_only:
+        query = query.filter(MenuItem.active == 1)
+    return query.order_by(ItemCount.quantity.desc()).limit(limit).all()
+
+
+def get_days_of_week(session):
+    """ Returns order counts per day of the week, busiest first"""
+    return session.query(DayOfWeekCount).order_by(
+        DayOfWeekCount.quantity.desc()).all()
+
+
+def get_times_of_day(session):
+    """ Returns order counts per hour of the day, busiest first"""
+    return session.query(TimeOfDayCount).order_by(
+        TimeOfDayCount.quantity.desc()).all()
+
+
+def get_zip_codes(session, limit=TOP_LIMIT):
+    """ Returns the zip codes with the most orders"""
+    return session.query(ZipCodeCount).order_by(
+        ZipCodeCount.quantity.desc()).limit(limit).all()
+
+
+def bucket_start(hour, bucket):
+    """ Returns the start of the hour, day or week (from Monday) an hour
+        falls in
+    """
+    if bucket == 'hour':
+        return hour
+    day = hour.replace(hour=0)
+    if bucket == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def bucket_column(session, bucket):
+    """ Returns SQL for bucket_start of hourly_count.hour
+        Modifiers are written into the SQL rather than bound, so GROUP BY
+        and the select list hold the same expression on PostgreSQL
+    """
+    if bucket == 'hour':
+        return HourlyCount.hour
+    if session.bind.dialect.name == 'postgresql':
+        return func.date_trunc(literal_column("'%s'" % bucket),
+                               HourlyCount.hour)
+    modifiers = ["'start of day'"]
+    if bucket == 'week':
+        # The Sunday ending the week, then back to its Monday
+        modifiers = ["'weekday 0'", "'-6 days'"] + modifiers
+    return type_coerce(func.datetime(HourlyCount.hour, *[
+        literal_column(m) for m in modifiers]), DateTime)
+
+
+def key_column(dimension):
+    """ Returns SQL for the value a dimension splits the counts by"""
+    if dimension == 'hour':
+        return extract('hour', HourlyCount.hour)
+    if dimension == 'weekday':
+        # Sunday is 0, as in day_number
+        return extract('dow', HourlyCount.hour)
+    return HourlyCount.bucket_key
+
+
+def query(session, start, end, bucket, dimension, limit=PAGE_SIZE,
+          offset=0):
+    """ Returns order counts from start (inclusive) to end (exclusive)
+        summed per bucket and per value of the dimension, in bucket order
+        with the largest counts first, and one page of them at a time
+
+        Summed by the database over the hourly_count rows in range, read
+        through its primary key, so only the page comes back.
+        Raises ValueError for an unknown bucket or dimension, or a range
+        longer than ANALYTICS_MAX_DAYS.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError('bucket must be one of %s' % ', '.join(BUCKETS))
+    if dimension not in DIMENSIONS:
+        raise ValueError('dimension must be one of %s'
+                         % ', '.join(sorted(DIMENSIONS)))
+    if end - start > datetime.timedelta(days=ANALYTICS_MAX_DAYS):
+        raise ValueError('Ranges are limited to %d days' % ANALYTICS_MAX_DAYS)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    bucket_time = bucket_column(session, bucket)
+    key = key_column(dimension)
+    quantity = func.sum(HourlyCount.quantity)
+    groups = session.query(bucket_time, key, quantity).filter(
+        HourlyCount.dimension == DIMENSIONS[dimension],
+        HourlyCount.hour >= start, HourlyCount.hour < end).group_by(
+        bucket_time, key)
+    total = groups.count()
+    page = groups.order_by(bucket_time, quantity.desc(), key).limit(
+        limit).offset(offset).all()
+    names = {}
+    if dimension == 'item' and page:
+        names = dict(session.query(MenuItem.id, MenuItem.name).filter(
+            MenuItem.id.in_(set(int(k) for _, k, _ in page))))
+    results = []
+    for bucket_time, key, quantity in page:
+        result = {'bucket': bucket_time.isoformat(), 'key': key,
+                  'quantity': int(quantity)}
+        if dimension == 'item':
+            result['key'] = int(key)
+            result['name'] = names.get(int(key))
+        elif dimension == 'hour':
+            result['key'] = int(key)
+        elif dimension == 'weekday':
+            result['key'] = DAY_NAMES[int(key)]
+        results.append(result)
+    next_offset = offset + limit if offset + limit < total else None
+    return {'start': start.isoformat(), 'end': end.isoformat(),
+            'bucket': bucket, 'dimension': dimension, 'total': total,
+            'offset': offset, 'next_offset': next_offset, 'rows': results}
@@ -2,22 +2,41 @@
 # Created by Jacob Schaible
 
 from flask import Flask, render_template, request, redirect, url_for
-from flask import flash, jsonify, make_response
+from flask import flash, jsonify, make_response, abort, Markup, g
+from flask import Response, stream_with_context
 from flask import session as login_session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
-from models import Base, User, MenuItem, Order, OrderView
-from models import OrderItem, Address, Cart, TopItemView
-from models import CartView, DayOfWeekView, TimeOfDayView, ZipCodeView
+from sqlalchemy import func, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from database import DBSession, engine, make_engine
+from models import User, MenuItem, Order, OrderView
+from models import OrderItem, Address, Cart
+from addresses import address_key
 from flask_login import login_user, logout_user, current_user
 from flask_login import login_required, LoginManager
 from werkzeug.urls import url_parse
 from forms import LoginForm, RegistrationForm
+from routecache import RouteCache, ROUTE_CACHE_PERSIST, normalize_destination
+from geoindex import DeliveryArea, INSIDE, OUTSIDE
+from travel import TravelService
+from kitchen import KitchenLoad
+from menucache import MenuCache
+from httpcache import CachedPayload, conditional_response
+from writequeue import WriteQueue
+from cartstore import CartStore
+from identity import IdentityCache, UserSnapshot
+from passwords import VerifierBusy, needs_rehash
+import analytics
+import exports
+import pricing
+import metrics
+import menuimport
+import migrations
+import profiler
 from collections import OrderedDict
-import json
-import urllib2
+import click
 import datetime
+import time
 import os
 
 application = Flask(__name__)
@@ -27,38 +46,140 @@ login = LoginManager(app)
 login.login_view = 'show_login'
 
 
-DELIVERY_FEE = 2.99
 RESTAURANT_ADDRESS = '13020 Livingston Rd, Naples, FL 34105'
-APP_KEY = open('gmaps_api_key.txt', 'r').read()
+ADDRESS_FIELDS = ['street_1', 'street_2', 'city', 'state', 'zip_code']
+if os.path.exists('gmaps_api_key.txt'):
+    APP_KEY = open('gmaps_api_key.txt', 'r').read()
+else:
+    APP_KEY = os.environ.get('GMAPS_API_KEY', '')
 MAX_DELIVERY_DISTANCE = 32187  # Distance in meters, roughly equals 20 miles
+COURSES = ['Appetizer', 'Entree', 'Dessert', 'Drink']
+
+route_cache = RouteCache(engine=engine if ROUTE_CACHE_PERSIST else None)
+delivery_area = DeliveryArea(MAX_DELIVERY_DISTANCE)
+travel_service = TravelService(route_cache, delivery_area)
+metrics.instrument_engine(engine)
+metrics.add_counter('cantina_route_cache_hits_total',
+                    'Travel route lookups answered from the route cache',
+                    lambda: route_cache.hits)
+metrics.add_counter('cantina_route_cache_misses_total',
+                    'Travel route lookups that went to the Maps API',
+                    lambda: route_cache.misses)
+if metrics.METRICS_ENABLED:
+    app.jinja_env.template_class = metrics.TimedTemplate
+MATRIX_BATCH_SIZE = 25  # Destinations per Distance Matrix request
+kitchen_load = KitchenLoad(DBSession)
+menu_cache = MenuCache()
+write_queue = WriteQueue(DBSession)
+cart_store = CartStore(DBSession, write_queue)
+identity_cache = IdentityCache()
+request_profiler = profiler.Profiler()
 
 
 def connect():
-    """ Connect to database"""
-    engine = create_engine('sqlite:///cantinadesantiago.db')
-    Base.metadata.bind = engine
-    DBSession = sessionmaker(bind=engine)
-    session = DBSession()
-    return session
+    """ Returns the database session for the current request"""
+    return DBSession()
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    """ Record the request's latency and SQL under its route pattern"""
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_request(rule, request.method,
+                           g.get('response_status', 500))
+
+
+if profiler.PROFILER_ENABLED:
+    @app.before_request
+    def start_profile():
+        """ Start a cProfile if the route is armed, or if an admin flagged
+            this request with the profile header
+        """
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        flagged = (profiler.PROFILE_HEADER in request.headers and
+                   getattr(current_user, 'admin', False))
+        profile = request_profiler.start(rule, flagged)
+        if profile is not None:
+            g.profile = (profile, time.time())
+
+    @app.teardown_request
+    def finish_profile(exception=None):
+        if 'profile' in g:
+            profile, start = g.pop('profile')
+            rule = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_profiler.finish(profile, rule, request.method,
+                                    time.time() - start)
+
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """ Release the request's session and return its connection to the pool"""
+    DBSession.remove()
+
+
+# Upgrade the schema, then seed the kitchen load tracker, which reloads
+# itself from then on. Rebuilding the rollups rewrites every row, so it is
+# left to db-upgrade rather than run by each worker as it boots
+migrations.upgrade(engine)
+if analytics.needs_rebuild(connect()):
+    if connect().query(Order.id).first() is None:
+        # Nothing to count yet, so empty rollups are complete
+        try:
+            analytics.rebuild(connect())
+        except IntegrityError:
+            # Another worker built them first
+            connect().rollback()
+    else:
+        app.logger.warning('The analytics rollups have not been built, run '
+                           '"flask db-upgrade" to build them')
+kitchen_load.seed(connect())
+DBSession.remove()
 
 
 ###########################
 # JSON Endpoint Functions #
 ###########################
+def get_menu_payload(menu, key, build):
+    """ Returns the JSON payload stored under key for this menu version,
+        building it on first use
+    """
+    payload = menu.payloads.get(key)
+    if payload is None:
+        payload = CachedPayload(build().get_data())
+        menu.payloads[key] = payload
+    return payload
+
+
 @app.route('/menu/JSON')
 def restaurant_menu_json():
     """ Returns list of menu items in JSON format"""
-    session = connect()
-    items = session.query(MenuItem).all()
-    return jsonify(MenuItems=[i.serialize for i in items])
+    menu = menu_cache.get(connect())
+    payload = get_menu_payload(menu, 'menu', lambda: jsonify(
+        MenuItems=[i.serialize for i in menu.items]))
+    return conditional_response(payload, request)
 
 
 @app.route('/menu/<int:menu_id>/JSON')
 def menu_item_json(menu_id):
     """ Returns one menu item in JSON format"""
-    session = connect()
-    item = session.query(MenuItem).filter_by(id=menu_id).one()
-    return jsonify(MenuItem=item.serialize)
+    menu = menu_cache.get(connect())
+    item = menu.by_id.get(menu_id)
+    if item is None:
+        abort(404)
+    payload = get_menu_payload(menu, ('item', menu_id), lambda: jsonify(
+        MenuItem=item.serialize))
+    return conditional_response(payload, request)
 
 
 #################################
@@ -66,10 +187,27 @@ def menu_item_json(menu_id):
 #################################
 @login.user_loader
 def load_user(user_id):
-    """ Get user matching given user ID"""
+    """ Get user matching given user ID
+        Returns a read-only snapshot, memoized for the request and cached
+        across requests for a short time
+    """
+    user_id = int(user_id)
+    identities = g.setdefault('identities', {})
+    if user_id not in identities:
+        identities[user_id] = identity_cache.get(user_id, fetch_identity)
+    return identities[user_id]
+
+
+def fetch_identity(user_id):
+    """ Query a user and their address in one statement and return a
+        snapshot of them, or None
+    """
     session = connect()
-    user = session.query(User).filter_by(id=user_id).one_or_none()
-    return user
+    user = session.query(User).options(joinedload(User.address)).filter_by(
+        id=user_id).one_or_none()
+    if user is None:
+        return None
+    return UserSnapshot(user)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -80,10 +218,22 @@ def show_login():
         return redirect(url_for('show_menu'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = session.query(User).filter_by(email=form.email.data).first()
-        if user is None or not user.check_password(form.password.data):
+        user = session.query(User).filter(
+            func.lower(User.email) == form.email.data.lower()).first()
+        try:
+            valid = user is not None and user.check_password(
+                form.password.data)
+        except VerifierBusy:
+            flash('Too many people are signing in, please try again')
+            return redirect(url_for('show_login'))
+        if not valid:
             flash('Invalid email or password')
             return redirect(url_for('show_login'))
+        # Move old hashes to the configured method while the password
+        # is at hand
+        if needs_rehash(user.password_hash):
+            user.set_password(form.password.data)
+            session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
@@ -125,49 +275,50 @@ def update_address():
     """ Update the user's address"""
     session = connect()
     try:
-        user = load_user(current_user.id)
-        address = get_address(user.address_id)
+        address = current_user.address
     except AttributeError:
         return 'Error getting user data'
-    if address is None:
-        address = Address()
     if request.method == 'POST':
-        if request.form['street_1']:
-            address.street_1 = request.form['street_1']
-        if request.form['street_2']:
-            address.street_2 = request.form['street_2']
-        if request.form['city']:
-            address.city = request.form['city']
-        if request.form['state']:
-            address.state = request.form['state']
-        if request.form['zip_code']:
-            address.zip_code = request.form['zip_code']
-        address_string = get_address_string(address)
-        if validate_address(address_string) is False:
+        # Blank fields keep the current value. Address rows are shared
+        # between users and never edited, a changed address is saved as
+        # its own row
+        fields = {}
+        for name in ADDRESS_FIELDS:
+            fields[name] = (request.form[name] or
+                            getattr(address, name, None) or None)
+        new_address = Address(**fields)
+        address_string = get_address_string(new_address)
+        if validate_address(address_string, new_address.zip_code) is False:
             flash("Address is invalid or outside delivery radius!")
             return redirect(url_for('cart_edit_address'))
-        address = session.add(address)
-        user.address_id = get_address_id(address)
-        user = session.merge(user)
+        address_id = save_address(fields)
+        user = session.query(User).filter_by(id=current_user.id).one()
+        user.address_id = address_id
         flash("Address saved!")
         session.commit()
+        identity_cache.invalidate(user.id)
     return redirect(url_for('show_cart'))
 
 
-def get_address(address_id):
-    """ Returns an address object given the address id"""
-    session = connect()
-    address = session.query(Address).filter_by(id=address_id).one_or_none()
-    return address
-
-
-def get_address_id(address):
-    """ Returns an address id given an address object"""
+def save_address(fields):
+    """ Returns the id of the address row with the given fields, adding
+        the row if no equivalent address is saved yet
+    """
     session = connect()
-    address_id = session.query(Address).filter_by(street_1=address.street_1,
-        street_2=address.street_2, city=address.city, state=address.state,
-        zip_code=address.zip_code).one_or_none()
-    return address_id
+    key = address_key(*[fields[name] for name in ADDRESS_FIELDS])
+    address_id = session.query(Address.id).filter_by(
+        address_key=key).scalar()
+    if address_id is not None:
+        return address_id
+    address = Address(address_key=key, **fields)
+    session.add(address)
+    try:
+        session.flush()
+    except IntegrityError:
+        # Another request saved the same address first
+        session.rollback()
+        return session.query(Address.id).filter_by(address_key=key).scalar()
+    return address.id
 
 
 def get_address_string(address):
@@ -191,15 +342,25 @@ def get_address_string(address):
     except AttributeError:
         return None
 
-def validate_address(address_string):
+def validate_address(address_string, zip_code=None):
     """ Validates the address string
         Returns true if valid, false if not
     """
     # User has no address saved
     if address_string is None:
         return False
+    # Clearly inside or outside the radius, no routing needed
+    area = delivery_area.classify(address_string, zip_code)
+    if area == OUTSIDE:
+        return False
+    if area == INSIDE:
+        return True
+    # Maps is unavailable and the address cannot be located
+    distance = get_travel_distance(address_string, zip_code)
+    if distance is None:
+        return False
     # User is outside delivery radius
-    if get_travel_distance(address_string) > MAX_DELIVERY_DISTANCE:
+    if distance > MAX_DELIVERY_DISTANCE:
         return False
     # If none of the above cases returned false, the address is okay
     return True
@@ -214,20 +375,17 @@ def add_to_cart(menu_id):
     """ Add a menu item to the user's cart
         If item already exists in cart, increment the quantity
     """
-    session = connect()
-    item = session.query(MenuItem).filter_by(id=menu_id).one()
+    item = menu_cache.get(connect()).by_id.get(menu_id)
+    if item is None:
+        abort(404)
+    if item.price_cents is None:
+        flash("%s is not available right now" % item.name)
+        return redirect(url_for('show_menu'))
     try:
         user_id = current_user.id
     except AttributeError:
         return "Error getting user ID"
-    cart_item = Cart(user_id=user_id, menu_item_id=menu_id, quantity=1)
-    existing_item = session.query(Cart).filter_by(
-        user_id=user_id, menu_item_id=menu_id).one_or_none()
-    if existing_item:
-        existing_item.quantity += 1
-        cart_item = existing_item
-    session.add(cart_item)
-    session.commit()
+    cart_store.add(user_id, menu_id)
     flash("%s added to order!" % item.name)
     return redirect(url_for('show_menu'))
 
@@ -236,19 +394,19 @@ def add_to_cart(menu_id):
 @login_required
 def update_cart(menu_id):
     """ Update the quantity of a menu item in the user's cart"""
-    session = connect()
     try:
         user_id = current_user.id
     except AttributeError:
         return "Error getting user ID"
-    item = session.query(Cart).filter_by(
-        user_id=user_id, menu_item_id=menu_id).one()
-    if request.method == 'POST':
-        if request.form['quantity']:
-            item.quantity = request.form['quantity']
-            flash("Quantity updated")
-        session.add(item)
-        session.commit()
+    if request.method == 'POST' and request.form['quantity']:
+        try:
+            quantity = int(request.form['quantity'])
+        except ValueError:
+            flash("Quantity must be a number")
+            return redirect(url_for('show_cart'))
+        if not cart_store.set_quantity(user_id, menu_id, quantity):
+            abort(404)
+        flash("Quantity updated")
     return redirect(url_for('show_cart'))
 
 
@@ -256,17 +414,14 @@ def update_cart(menu_id):
 @login_required
 def remove_from_cart(menu_id):
     """ Remove a menu item from the user's cart"""
-    session = connect()
     try:
         user_id = current_user.id
     except AttributeError:
         return "Error getting user ID"
-    item = session.query(Cart).filter_by(
-        user_id=user_id, menu_item_id=menu_id).one()
-    menu_item = session.query(MenuItem).filter_by(id=menu_id).one()
-    session.delete(item)
-    session.commit()
-    flash("%s removed from order!" % menu_item.name)
+    if not cart_store.remove(user_id, menu_id):
+        abort(404)
+    item = menu_cache.get(connect()).by_id.get(menu_id)
+    flash("%s removed from order!" % (item.name if item else 'Item'))
     return redirect(url_for('show_cart'))
 
 
@@ -274,39 +429,7 @@ def remove_from_cart(menu_id):
 @login_required
 def show_cart():
     """ Display the contents of the user's cart"""
-    session = connect()
-    try:
-        user_id = current_user.id
-        address = get_address(current_user.address_id)
-    except AttributeError:
-        return "Error getting user data"
-    items = session.query(CartView).filter_by(user_id=user_id).all()
-    # Calculate totals
-    subtotal = 0.0
-    for item in items:
-        subtotal += float(item.price) * item.quantity
-    if subtotal > 0:
-        fee = DELIVERY_FEE
-    else:
-        fee = 0
-    tax = (subtotal + fee) * 0.07
-    total = subtotal + fee + tax
-    subtotal = "{0:.2f}".format(subtotal)
-    fee = "{0:.2f}".format(fee)
-    tax = "{0:.2f}".format(tax)
-    total = "{0:.2f}".format(total)
-    if address is None:
-        delivery_time = 'Please enter an address to '
-        delivery_time += 'calculate estimated delivery time.'
-        address_string = 'No address on file.'
-    else:
-        delivery_time = 'Your estimated delivery time is currently '
-        delivery_time += '{0:.0f}'.format(get_delivery_time()/60) + ' minutes.'
-        address_string = get_address_string(address)
-    return render_template('cart.html', items=items, subtotal=subtotal,
-        fee=fee, tax=tax, total=total, user=current_user,
-        address_string=address_string, delivery_time=delivery_time,
-        edit_address=False, title="Checkout")
+    return render_cart(edit_address=False)
 
 
 @app.route('/cart/edit_address', methods=['GET', 'POST'])
@@ -315,36 +438,34 @@ def cart_edit_address():
     """ Display the contents of the user's cart
         with editable address fields
     """
+    return render_cart(edit_address=True)
+
+
+def render_cart(edit_address):
+    """ Render the checkout page
+        The user and address come from the identity cache and the cart
+        lines from the cart store, so a warm cart page costs no SQL
+    """
     session = connect()
     try:
         user_id = current_user.id
-        address = get_address(current_user.address_id)
+        address = current_user.address
     except AttributeError:
         return "Error getting user data"
-    items = session.query(CartView).filter_by(user_id=user_id).all()
-    # Calculate totals
-    subtotal = 0.0
-    for item in items:
-        subtotal += float(item.price) * item.quantity
-    if subtotal > 0:
-        fee = DELIVERY_FEE
-    else:
-        fee = 0
-    tax = (subtotal + fee) * 0.07
-    total = subtotal + fee + tax
-    subtotal = "{0:.2f}".format(subtotal)
-    fee = "{0:.2f}".format(fee)
-    tax = "{0:.2f}".format(tax)
-    total = "{0:.2f}".format(total)
+    items = cart_store.lines(user_id, menu_cache.get(session))
+    totals = pricing.items_totals(items).formatted()
     if address is None:
         delivery_time = 'Please enter an address to '
         delivery_time += 'calculate estimated delivery time.'
+        address_string = 'No address on file.'
     else:
         delivery_time = 'Your estimated delivery time is currently '
         delivery_time += '{0:.0f}'.format(get_delivery_time()/60) + ' minutes.'
-    return render_template('cart.html', items=items, subtotal=subtotal,
-        fee=fee, tax=tax, total=total, user=current_user, address=address, 
-        delivery_time=delivery_time, edit_address=True, title="Checkout")
+        address_string = get_address_string(address)
+    return render_template('cart.html', items=items, user=current_user,
+        address=address, address_string=address_string,
+        delivery_time=delivery_time, edit_address=edit_address,
+        title="Checkout", **totals)
 
 
 @app.route('/cart/order_placed')
@@ -356,47 +477,34 @@ def place_order():
         user_id = current_user.id
     except AttributeError:
         return "Error getting user ID"
-    # Query for cart contents
-    items = session.query(Cart).filter_by(user_id=user_id).all()
     # Redirect user if no items in order
-    if not items:
+    if not cart_store.items(user_id):
         flash("No items in order!")
         return redirect(url_for('show_cart'))
     # Make sure customer's address is valid
-    address = get_address(current_user.address_id)
+    address = current_user.address
     destination = get_address_string(address)
-    if validate_address(destination) is False:
+    zip_code = getattr(address, 'zip_code', None)
+    if validate_address(destination, zip_code) is False:
         flash("Address is invalid or outside delivery radius!")
         return redirect(url_for('show_cart'))
-    # Create new entry in order table
+    # The order is built from the cart table, so it must hold every change
+    cart_store.flush(user_id)
+    # Delivery time needs Maps, so look it up before the transaction starts
     order_time = datetime.datetime.now()
     delivery_time = order_time + datetime.timedelta(0, get_delivery_time())
-    new_order = Order(user_id=user_id, order_time=order_time,
-                      delivery_time=delivery_time)
-    session.add(new_order)
-    order = session.query(Order).filter_by(order_time=order_time).one()
-    # Add each item to order_item table and remove from cart
-    for i in items:
-        order_item = OrderItem(order_id=order.id, menu_item_id=i.menu_item_id,
-                               quantity=i.quantity)
-        session.add(order_item)
-        session.delete(i)
+    ordered_items = create_order(session, user_id, order_time, delivery_time,
+                                 zip_code)
+    if ordered_items is None:
+        # Another checkout emptied the cart first
+        session.rollback()
+        cart_store.forget(user_id)
+        flash("No items in order!")
+        return redirect(url_for('show_cart'))
     session.commit()
-    ordered_items = session.query(OrderView).filter_by(order_id=order.id).all()
-    # Calculate totals
-    subtotal = 0.0
-    for item in ordered_items:
-        subtotal += float(item.price) * item.quantity
-    if subtotal > 0:
-        fee = DELIVERY_FEE
-    else:
-        fee = 0
-    tax = (subtotal + fee) * 0.07
-    total = subtotal + fee + tax
-    subtotal = "{0:.2f}".format(subtotal)
-    fee = "{0:.2f}".format(fee)
-    tax = "{0:.2f}".format(tax)
-    total = "{0:.2f}".format(total)
+    cart_store.forget(user_id)
+    kitchen_load.record_order(delivery_time)
+    totals = pricing.items_totals(ordered_items).formatted()
     # Convert delivery time to EST and format for display
     delivery_time = delivery_time - datetime.timedelta(hours=4)
     delivery_time = delivery_time.strftime('%I:%M %p')
@@ -410,9 +518,41 @@ def place_order():
     map_url += '&key='
     map_url += APP_KEY
     return render_template('orderComplete.html', delivery_time=delivery_time,
-                           items=ordered_items, subtotal=subtotal, fee=fee,
-                           tax=tax, total=total, map_url=map_url,
-                           title="Order Complete")
+                           items=ordered_items, map_url=map_url,
+                           title="Order Complete", **totals)
+
+
+def create_order(session, user_id, order_time, delivery_time, zip_code):
+    """ Move the user's cart into a new order in the session's transaction
+        Returns the order's OrderView rows, or None if there was nothing to
+        order, e.g. because another checkout of the same cart came first.
+        The caller commits or rolls back.
+    """
+    # Lock the cart so a second checkout of it, such as a double click,
+    # waits for this one and then finds it empty. SQLite has no row locks
+    # but only lets one transaction write at a time, which does the same
+    session.query(Cart.id).filter_by(user_id=user_id).with_for_update().all()
+    # Create new entry in order table, the insert returns its id
+    order = Order(user_id=user_id, order_time=order_time,
+                  delivery_time=delivery_time)
+    session.add(order)
+    session.flush()
+    # Move the whole cart into order_item in one statement, leaving out
+    # items taken off the menu or without a price since they were added
+    moved = session.execute(OrderItem.__table__.insert().from_select(
+        ['order_id', 'menu_item_id', 'quantity'],
+        select([literal(order.id), Cart.menu_item_id, Cart.quantity]).where(
+            Cart.user_id == user_id).where(
+            MenuItem.id == Cart.menu_item_id).where(MenuItem.active == 1).where(
+            MenuItem.price_cents.isnot(None))))
+    if not moved.rowcount:
+        return None
+    session.query(Cart).filter_by(user_id=user_id).delete(
+        synchronize_session=False)
+    ordered_items = session.query(OrderView).filter_by(order_id=order.id).all()
+    analytics.record_order(session, order_time,
+                           [i.menu_item_id for i in ordered_items], zip_code)
+    return ordered_items
 
 
 ######################
@@ -438,60 +578,136 @@ def get_travel_data(destination):
     """ Returns JSON travel data"""
     origin = encode_string(RESTAURANT_ADDRESS)
     destination = encode_string(destination)
-    url = 'https://maps.googleapis.com/maps/api/directions/json?origin='
+    url = '/maps/api/directions/json?origin='
     url += origin
     url += '&destination='
     url += destination
     url += '&mode=driving&key='
     url += APP_KEY
-    travel_data = json.load(urllib2.urlopen(url))
+    with metrics.timed(metrics.MAPS_SECONDS, 'directions'):
+        travel_data = travel_service.get_json(url)
     # print(url)  # Test only
     return travel_data
 
 
-def get_travel_time(destination):
+def get_distance_matrix_data(destinations):
+    """ Returns JSON travel data for several destinations at once"""
+    origin = encode_string(RESTAURANT_ADDRESS)
+    destinations = encode_string('|'.join(destinations))
+    url = '/maps/api/distancematrix/json?origins='
+    url += origin
+    url += '&destinations='
+    url += destinations
+    url += '&mode=driving&key='
+    url += APP_KEY
+    with metrics.timed(metrics.MAPS_SECONDS, 'distancematrix'):
+        return travel_service.get_json(url)
+
+
+def fetch_travel_route(destination):
+    """ Returns (travel time, travel distance) from a single
+        Directions API request
+    """
+    travel_data = get_travel_data(destination)
+    if travel_data.get('status') != 'OK' or not travel_data.get('routes'):
+        raise LookupError('Directions status %s for %s' % (
+            travel_data.get('status'), destination))
+    leg = travel_data['routes'][0]['legs'][0]
+    location = leg.get('end_location')
+    if location:
+        delivery_area.remember(destination, location['lat'], location['lng'])
+    return leg['duration']['value'], leg['distance']['value']
+
+
+def get_travel_route(destination, zip_code=None):
+    """ Returns (travel time, travel distance) between restaurant and
+        destination, fetching from the Directions API only on a cache miss
+        Falls back to an estimate if Maps fails or does not answer in time
+    """
+    # Checking the address and the delivery time both need the route, the
+    # first answer is kept so a request waits on Maps at most once
+    routes = g.setdefault('travel_routes', {})
+    key = (destination, zip_code)
+    if key not in routes:
+        route = travel_service.route(destination, fetch_travel_route,
+                                     zip_code)
+        if route is None:
+            route = travel_service.estimate(destination, zip_code)
+        routes[key] = route
+    return routes[key]
+
+
+def get_travel_time(destination, zip_code=None):
     """ Returns travel time in seconds between restaurant
         and destination for delivery
     """
-    travel_data = get_travel_data(destination)
-    return travel_data['routes'][0]['legs'][0]['duration']['value']
+    return get_travel_route(destination, zip_code)[0]
 
 
-def get_travel_distance(destination):
+def get_travel_distance(destination, zip_code=None):
     """ Returns travel distance in meters between restaurant
         and destination for delivery
     """
-    travel_data = get_travel_data(destination)
-    return travel_data['routes'][0]['legs'][0]['distance']['value']
+    return get_travel_route(destination, zip_code)[1]
 
 
-def get_prep_time():
-    """ Returns prep time based on user load"""
+def prefetch_travel_routes(destinations):
+    """ Fill the route cache for uncached destinations using batched
+        Distance Matrix requests
+    """
+    missing = OrderedDict()
+    for destination in destinations:
+        if route_cache.peek(destination) is None:
+            missing[normalize_destination(destination)] = destination
+    missing = list(missing.values())
+    for i in range(0, len(missing), MATRIX_BATCH_SIZE):
+        batch = missing[i:i + MATRIX_BATCH_SIZE]
+        travel_data = get_distance_matrix_data(batch)
+        if travel_data.get('status') != 'OK':
+            raise click.ClickException('Distance Matrix status %s' %
+                                       travel_data.get('status'))
+        elements = travel_data['rows'][0]['elements']
+        for destination, element in zip(batch, elements):
+            if element.get('status') == 'OK':
+                route_cache.put(destination, (element['duration']['value'],
+                                              element['distance']['value']))
+    return len(missing)
+
+
+@app.cli.command('warm-routes')
+def warm_routes():
+    """ Prefetch travel routes for every saved address"""
     session = connect()
-    base_time = 1200
-    prep_time = base_time
-    times_of_day = session.query(TimeOfDayView).all()
-    current_time = datetime.datetime.now().strftime('%H')
-    for row in times_of_day:
-        if current_time == row.time_of_day:
-            """ Prep time is 20% longer for every 
-            three customers served concurrently"""
-            prep_time += prep_time * (row.quantity / 3) * .2
-    return prep_time
+    destinations = [get_address_string(a) for a in session.query(Address)]
+    destinations = [d for d in destinations if d]
+    fetched = prefetch_travel_routes(destinations)
+    print('Fetched %d of %d routes' % (fetched, len(destinations)))
+
+
+def get_prep_time():
+    """ Returns prep time based on the orders currently in flight
+        Prep time is 20% longer for every three customers served
+        concurrently
+    """
+    return kitchen_load.prep_time()
 
 
 def get_delivery_time():
     """ The delivery time is the combination of
         the prep time and the travel time
     """
+    # Several parts of a request may ask, work it out once
+    if 'delivery_time' in g:
+        return g.delivery_time
     try:
-        address = get_address(current_user.address_id)
+        address = current_user.address
         address_string = get_address_string(address)
-        delivery_time = get_travel_time(address_string)
+        delivery_time = get_travel_time(address_string, address.zip_code)
         delivery_time += get_prep_time()
-        return delivery_time
     except AttributeError:
         return "Error getting user address"
+    g.delivery_time = delivery_time
+    return delivery_time
 
 
 #######################
@@ -502,21 +718,48 @@ def get_delivery_time():
 def show_menu():
     """ Display main menu page"""
     session = connect()
-    items = session.query(MenuItem).all()
-    top_items = session.query(TopItemView).all()
+    menu = menu_cache.get(session)
+    top_items = menu_cache.get_top_items(session)
     title = "Cantina De Santiago"
     # Customers and those not logged in should see publicMenu
     # while admins should see adminMenu
-    try:
-        if current_user.admin:
-            return render_template('adminMenu.html', items=items,
-                                   top_items=top_items, title=title)
+    admin = bool(getattr(current_user, 'admin', False))
+    if admin:
+        template = 'adminMenu.html'
+    else:
+        template = 'publicMenu.html'
+    return render_template(template, items=menu.items,
+                           sections=get_menu_sections(menu, admin),
+                           top_items=top_items, title=title)
+
+
+def get_menu_sections(menu, admin):
+    """ Returns the rendered cards for each course, cached per menu
+        version and per public/admin variant
+    """
+    key = ('sections', admin)
+    sections = menu.fragments.get(key)
+    if sections is None:
+        sections = {}
+        for course in COURSES:
+            cards = [get_menu_card(menu, i, admin) for i in menu.items
+                     if i.course == course]
+            sections[course] = Markup('\n'.join(cards))
+        menu.fragments[key] = sections
+    return sections
+
+
+def get_menu_card(menu, item, admin):
+    """ Returns the rendered card for one menu item"""
+    key = ('card', admin, item.id)
+    card = menu.fragments.get(key)
+    if card is None:
+        if admin:
+            card = render_template('adminMenuItemCard.html', i=item)
         else:
-            return render_template('publicMenu.html', items=items,
-                                   top_items=top_items, title=title)
-    except AttributeError:
-        return render_template('publicMenu.html', items=items,
-                               top_items=top_items, title=title)
+            card = render_template('menuItemCard.html', i=item)
+        menu.fragments[key] = card
+    return card
 
 
 @app.route('/admin/new', methods=['GET', 'POST'])
@@ -525,11 +768,17 @@ def new_menu_item():
     """ Display page to create new menu item"""
     session = connect()
     if request.method == 'POST':
+        price_cents = pricing.to_cents(request.form['price'])
+        if price_cents is None or price_cents < 0:
+            flash("'%s' is not a valid price" % request.form['price'])
+            return render_template('newMenuItem.html', title="New Menu Item")
         newItem = MenuItem(name=request.form['name'],
                            course=request.form['course'],
                            description=request.form['description'],
-                           price=request.form['price'])
+                           price=pricing.format_cents(price_cents),
+                           price_cents=price_cents)
         session.add(newItem)
+        menu_cache.bump(session)
         session.commit()
         flash("New menu item '%s' created!" % newItem.name)
         return redirect(url_for('show_menu'))
@@ -545,11 +794,18 @@ def edit_menu_item(menu_id):
     item = session.query(MenuItem).filter_by(id=menu_id).one()
     title = 'Editing ' + item.name
     if request.method == 'POST':
+        price_cents = pricing.to_cents(request.form['price'])
+        if request.form['price'] and (price_cents is None or
+                                      price_cents < 0):
+            flash("'%s' is not a valid price" % request.form['price'])
+            return render_template('editMenuItem.html', menu_id=menu_id,
+                                   item=item, title=title)
         if request.form['name']:
             item.name = request.form['name']
             flash("Item renamed to '%s'!" % item.name)
         if request.form['price']:
-            item.price = request.form['price']
+            item.price = pricing.format_cents(price_cents)
+            item.price_cents = price_cents
             flash("Item '%s' price changed to %s!" % (item.name, item.price))
         if request.form['description']:
             item.description = request.form['description']
@@ -558,6 +814,7 @@ def edit_menu_item(menu_id):
             item.course = request.form['course']
             flash("Item '%s' course changed to %s!" % (item.name, item.course))
         session.add(item)
+        menu_cache.bump(session)
         session.commit()
         return redirect(url_for('show_menu'))
     else:
@@ -573,7 +830,8 @@ def delete_menu_item(menu_id):
     item = session.query(MenuItem).filter_by(id=menu_id).one()
     title = "Delete " + item.name
     if request.method == 'POST':
-        session.delete(item)
+        menuimport.remove_items(session, [item], cart_store)
+        menu_cache.bump(session)
         session.commit()
         flash("Item '%s' deleted!" % item.name)
         return redirect(url_for('show_menu'))
@@ -601,18 +859,18 @@ def show_dashboard():
         flash("Error determining user privledges.")
         return redirect(url_for('show_menu'))
     session = connect()
-    top_items = session.query(TopItemView).all()
-    days_of_week = session.query(DayOfWeekView).all()
-    times_of_day = session.query(TimeOfDayView).all()
+    top_items = analytics.get_top_items(session)
+    days_of_week = analytics.get_days_of_week(session)
+    times_of_day = analytics.get_times_of_day(session)
     times_dict = get_formatted_time_of_day(times_of_day)
-    zip_codes = session.query(ZipCodeView).all()
+    zip_codes = analytics.get_zip_codes(session)
     return render_template('dashboard.html', top_items=top_items,
         days_of_week=days_of_week, times_of_day=times_dict,
         zip_codes=zip_codes, title="Administrative Dashboard")
 
 
 def get_formatted_time_of_day(times_of_day):
-    """ SQLite returns the times in 24-hour format
+    """ Times of day are stored as hours in 24-hour format
         Change into 12-hour AM/PM format for easy viewing
     """
     times_dict = OrderedDict()
@@ -632,6 +890,232 @@ def get_formatted_time_of_day(times_of_day):
     return times_dict
 
 
+@app.route('/admin/analytics/JSON')
+@login_required
+def analytics_json():
+    """ Order counts over a date range, bucketed by hour, day or week and
+        split by item, zip, hour or weekday, e.g.
+        ?start=2019-01-01&end=2019-02-01&bucket=day&dimension=item
+        Defaults to the last 30 days by day and item. Pages of up to
+        limit rows, follow next_offset for more
+    """
+    abort_unless_admin()
+    try:
+        end = parse_date(request.args.get('end'), datetime.datetime.now())
+        start = parse_date(request.args.get('start'),
+                           end - datetime.timedelta(days=30))
+        limit = int(request.args.get('limit', analytics.PAGE_SIZE))
+        offset = max(0, int(request.args.get('offset', 0)))
+        result = analytics.query(connect(), start, end,
+                                 request.args.get('bucket', 'day'),
+                                 request.args.get('dimension', 'item'),
+                                 limit, offset)
+    except ValueError as e:
+        return make_response(jsonify(error=str(e)), 400)
+    return jsonify(result)
+
+
+@app.route('/admin/export/orders.<export_format>')
+@login_required
+def export_orders(export_format):
+    """ Stream every ordered item as CSV or NDJSON, e.g.
+        /admin/export/orders.csv?since_id=1200 or ?since=2019-06-01
+    """
+    abort_unless_admin()
+    if export_format not in exports.FORMATS:
+        abort(404)
+    try:
+        since_id = request.args.get('since_id')
+        since_id = int(since_id) if since_id else None
+        since_time = parse_date(request.args.get('since'), None)
+    except ValueError as e:
+        return make_response(jsonify(error=str(e)), 400)
+    rows = exports.order_rows(connect(), since_id, since_time)
+    response = Response(stream_with_context(
+        exports.stream(rows, export_format)),
+        mimetype=exports.FORMATS[export_format])
+    response.headers['Content-Disposition'] = (
+        'attachment; filename=orders.%s' % export_format)
+    return response
+
+
+@app.route('/admin/menu/import', methods=['POST'])
+@login_required
+def import_menu():
+    """ Replace the menu with an uploaded CSV or JSON file in one
+        transaction, or with dry_run=1 only report what would change
+    """
+    abort_unless_admin()
+    upload = request.files.get('menu')
+    if upload is not None:
+        text = upload.read()
+        name = upload.filename or ''
+    else:
+        text = request.get_data()
+        name = ''
+    file_format = request.args.get('format') or os.path.splitext(
+        name)[1].lstrip('.').lower() or ('json' if request.is_json else 'csv')
+    session = connect()
+    try:
+        changes = menuimport.plan(session, menuimport.parse(
+            text.decode('utf-8'), file_format))
+    except (menuimport.MenuFileError, UnicodeDecodeError) as e:
+        # Messages name menu items, so they may not be ASCII
+        return make_response(jsonify(error=u'%s' % e), 400)
+    if request.args.get('dry_run') != '1':
+        menuimport.apply(session, changes, menu_cache, cart_store)
+        session.commit()
+    return jsonify(changes.serialize)
+
+
+def parse_date(value, default):
+    """ Parses YYYY-MM-DD or YYYY-MM-DDTHH:MM, raising ValueError"""
+    if not value:
+        return default
+    for date_format in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError('Dates must look like 2019-01-31 or 2019-01-31T18:00')
+
+
+@app.route('/admin/metrics')
+@login_required
+def show_metrics():
+    """ Request, SQL, Maps and template timings in Prometheus text format
+    """
+    abort_unless_admin()
+    response = make_response(metrics.render())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+@login_required
+def show_profiles():
+    """ List captured profiles, or arm profiling of the next requests to
+        a route pattern with route=/cart&requests=5
+    """
+    if not profiler.PROFILER_ENABLED:
+        abort(404)
+    abort_unless_admin()
+    if request.method == 'POST':
+        try:
+            count = int(request.form.get('requests', 1))
+        except ValueError:
+            abort(400)
+        request_profiler.arm(request.form['route'], count)
+    return jsonify(armed=dict(request_profiler.armed),
+                   captures=[c.serialize for c in
+                             request_profiler.captures()])
+
+
+@app.route('/admin/profile/<int:capture_id>')
+@login_required
+def download_profile(capture_id):
+    """ Download a captured profile as a pstats file"""
+    if not profiler.PROFILER_ENABLED:
+        abort(404)
+    abort_unless_admin()
+    capture = request_profiler.get(capture_id)
+    if capture is None:
+        abort(404)
+    response = make_response(capture.data)
+    response.mimetype = 'application/octet-stream'
+    response.headers['Content-Disposition'] = (
+        'attachment; filename=cantina-%d.pstats' % capture.id)
+    return response
+
+
+def abort_unless_admin():
+    """ Stop the request with 403 Forbidden unless the user is an admin"""
+    if not getattr(current_user, 'admin', False):
+        abort(403)
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """ Apply schema changes and indexes to an existing database, and build
+        the analytics rollups if they have never been built
+    """
+    migrations.upgrade(engine)
+    if analytics.needs_rebuild(connect()):
+        analytics.rebuild(connect())
+        print('Analytics rollups built')
+    print('Database upgraded')
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """ Show the query plan of each hot query and whether it uses an index
+    """
+    for name, plan, uses_index in migrations.explain_hot_queries(connect()):
+        print('%-24s %-5s %s' % (name, 'ok' if uses_index else 'SCAN', plan))
+
+
+@app.cli.command('copy-db')
+@click.argument('target_url')
+def copy_db(target_url):
+    """ Copy this database into an empty one at TARGET_URL"""
+    target = make_engine(target_url)
+    for table, count in migrations.copy_database(engine, target).items():
+        print('%-20s %d rows' % (table, count))
+
+
+@app.cli.command('export-orders')
+@click.option('--format', 'export_format', default='csv',
+              type=click.Choice(sorted(exports.FORMATS)))
+@click.option('--since-id', type=int, help='Only orders after this id')
+@click.option('--since', 'since_time', type=click.DateTime(),
+              help='Only orders placed at or after this time')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+def export_orders_command(export_format, since_id, since_time, output):
+    """ Write every ordered item as CSV or NDJSON, streaming so memory use
+        stays flat
+    """
+    rows = exports.order_rows(connect(), since_id, since_time)
+    for chunk in exports.stream(rows, export_format):
+        output.write(chunk)
+
+
+@app.cli.command('import-menu')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(menuimport.FORMATS),
+              help='Defaults to the file extension')
+@click.option('--dry-run', is_flag=True, help='Only show what would change')
+def import_menu_command(path, file_format, dry_run):
+    """ Replace the menu with a CSV or JSON file in one transaction"""
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, 'rb') as f:
+        text = f.read().decode('utf-8')
+    session = connect()
+    try:
+        changes = menuimport.plan(session, menuimport.parse(text, file_format))
+    except menuimport.MenuFileError as e:
+        raise click.ClickException(u'%s' % e)
+    for label, names in (('Add', [e['name'] for e in changes.inserts]),
+                         ('Update', [i.name for i, _ in changes.updates]),
+                         ('Remove', [i.name for i in changes.removals])):
+        for name in names:
+            # click.echo writes non-ASCII names on Python 2 as well
+            click.echo(u'%-7s %s' % (label, name))
+    if not dry_run:
+        menuimport.apply(session, changes, menu_cache, cart_store)
+        session.commit()
+    print('%d added, %d updated, %d removed, %d unchanged%s' % (
+        len(changes.inserts), len(changes.updates), len(changes.removals),
+        changes.unchanged, ' (dry run)' if dry_run else ''))
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics():
+    """ Recompute the dashboard rollup tables from the order history"""
+    analytics.rebuild(connect())
+    print('Analytics rollups rebuilt')
+
+
 if __name__ == '__main__':
     # app.secret_key = 'super_secret_key'
     app.debug = True
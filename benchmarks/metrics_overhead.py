@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+""" Cost of the request instrumentation in metrics.py
+
+    Runs the same simulated request, a few small SQLite queries and a
+    template render, on a plain engine and on an instrumented one with
+    request tracking, and reports the added time per request. Compare the
+    result with the p50 latencies from run_load.py.
+
+    python benchmarks/metrics_overhead.py --requests 20000 --statements 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from jinja2 import Environment
+from sqlalchemy import create_engine
+import metrics
+
+PAGE = '{% for i in items %}<li>{{ i }}</li>{% endfor %}'
+
+
+def run(engine, template, args, instrumented):
+    """ Returns seconds per simulated request"""
+    items = list(range(20))
+    with engine.connect() as conn:
+        start = time.time()
+        for _ in range(args.requests):
+            if instrumented:
+                metrics.start_request()
+            for _ in range(args.statements):
+                conn.execute('SELECT 1').fetchall()
+            template.render(items=items)
+            if instrumented:
+                metrics.finish_request('/bench', 'GET', 200)
+        return (time.time() - start) / args.requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--statements', type=int, default=5,
+                        help='SQL statements per request')
+    args = parser.parse_args()
+    metrics.METRICS_ENABLED = True
+
+    plain = create_engine('sqlite://')
+    instrumented = create_engine('sqlite://')
+    metrics.instrument_engine(instrumented)
+    plain_template = Environment().from_string(PAGE)
+    timed_env = Environment()
+    timed_env.template_class = metrics.TimedTemplate
+    timed_template = timed_env.from_string(PAGE)
+
+    # Warm up both paths before timing
+    run(plain, plain_template, argparse.Namespace(requests=500,
+        statements=args.statements), False)
+    base = run(plain, plain_template, args, False)
+    with_metrics = run(instrumented, timed_template, args, True)
+    print('without metrics  %8.1f us/request' % (base * 1e6))
+    print('with metrics     %8.1f us/request' % (with_metrics * 1e6))
+    print('overhead         %8.1f us/request (%.1f%%)' % (
+        (with_metrics - base) * 1e6, (with_metrics / base - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+""" Logins per second per core for each password hash setting
+
+    Hashes a password with each werkzeug method and times check_password
+    on one core, which is the CPU a login spends on verification. Pick
+    PASSWORD_HASH_METHOD from the result and the login peak to be served.
+
+    python benchmarks/password_hashing.py pbkdf2:sha256:150000 \\
+        pbkdf2:sha256:50000 pbkdf2:sha512:100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import passwords
+
+METHODS = ['pbkdf2:sha256:260000', 'pbkdf2:sha256:150000',
+           'pbkdf2:sha256:100000', 'pbkdf2:sha256:50000',
+           'pbkdf2:sha512:100000']
+
+
+def logins_per_second(method, seconds):
+    """ Returns how many verifications of a method's hash one core does
+        each second
+    """
+    pwhash = passwords.hash_password('correct horse battery', method=method)
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        assert passwords.verify_password(pwhash, 'correct horse battery')
+        count += 1
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('methods', nargs='*', default=METHODS)
+    parser.add_argument('--seconds', type=float, default=3,
+                        help='time spent verifying each method')
+    args = parser.parse_args()
+
+    print('%-24s %14s %12s' % ('method', 'logins/s/core', 'ms/login'))
+    for method in args.methods:
+        rate = logins_per_second(method, args.seconds)
+        current = ' (configured)' if not passwords.needs_rehash(
+            passwords.hash_password('x', method=method)) else ''
+        print('%-24s %14.1f %12.1f%s' % (method, rate, 1000 / rate, current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+""" Load test of the customer ordering funnel
+
+    Seeds a synthetic database, starts a stand-in for the Google Maps API
+    that answers after a fixed delay, serves the app from its own process
+    and drives the real routes with simulated customers: browse the menu,
+    add items, view the cart and sometimes check out. One admin client
+    keeps loading the dashboard. Per-route throughput and p50/p95/p99
+    latency are printed and written to a JSON file, and a previous file
+    can be given to flag regressions.
+
+    python benchmarks/run_load.py --clients 16 --seconds 60 \\
+        --output run.json --compare baseline.json
+"""
+
+import argparse
+import BaseHTTPServer
+import cookielib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+import seed_data
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeMapsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers Directions and Distance Matrix requests with a fixed route
+        after the configured delay
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        element = {'status': 'OK', 'duration': {'value': 900},
+                   'distance': {'value': 8000}}
+        if 'distancematrix' in self.path:
+            query = self.path.split('destinations=', 1)[1].split('&', 1)[0]
+            body = {'status': 'OK', 'rows': [
+                {'elements': [element] * (query.count('%7C') + 1)}]}
+        else:
+            body = {'status': 'OK', 'routes': [{'legs': [element]}]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMapsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_fake_maps(latency):
+    """ Start the Maps stand-in on a free port and return the port"""
+    handler = type('Handler', (FakeMapsHandler,), {'latency': latency})
+    server = FakeMapsServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server.server_address[1]
+
+
+def serve_app(workdir, port, environ):
+    """ Run the app in this process with a threaded server"""
+    os.environ.update(environ)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import application
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # Clients post the login form without fetching a CSRF token first
+    application.app.config['WTF_CSRF_ENABLED'] = False
+    make_server('127.0.0.1', port, application.app,
+                threaded=True).serve_forever()
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib2.urlopen(url, timeout=5).read()
+            return
+        except (urllib2.URLError, socket.error):
+            time.sleep(.5)
+    raise SystemExit('App did not start within %d seconds' % timeout)
+
+
+class NoRedirect(urllib2.HTTPRedirectHandler):
+    """ Report redirects instead of following them, so each route is timed
+        on its own
+    """
+
+    def redirect_request(self, *args):
+        return None
+
+
+class Client(object):
+    """ One signed-in browser session"""
+
+    def __init__(self, base_url, email, results, lock):
+        self.base_url = base_url
+        self.results = results
+        self.lock = lock
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(cookielib.CookieJar()), NoRedirect())
+        # Sign in untimed, the clock has not started yet
+        self.request(None, '/login', {'email': email,
+                                      'password': seed_data.PASSWORD})
+
+    def request(self, name, path, form=None):
+        data = urllib.urlencode(form).encode('utf-8') if form else None
+        start = time.time()
+        try:
+            response = self.opener.open(self.base_url + path, data, timeout=60)
+            response.read()
+            ok = True
+        except urllib2.HTTPError as e:
+            e.read()
+            ok = e.code < 400
+        except (urllib2.URLError, socket.error):
+            ok = False
+        elapsed = time.time() - start
+        if name is None:
+            return
+        with self.lock:
+            entry = self.results.setdefault(name, {'latencies': [],
+                                                   'errors': 0})
+            entry['latencies'].append(elapsed)
+            if not ok:
+                entry['errors'] += 1
+
+
+def customer(client, args, deadline, rng):
+    """ Browse, fill the cart and now and then check out"""
+    while time.time() < deadline:
+        client.request('/menu', '/menu')
+        client.request('/menu/JSON', '/menu/JSON')
+        for _ in range(rng.randint(1, 3)):
+            client.request('/cart/add/<id>',
+                           '/cart/add/%d' % rng.randint(1, args.menu_items))
+        client.request('/cart', '/cart')
+        if rng.random() < args.checkout_ratio:
+            client.request('/cart/order_placed', '/cart/order_placed')
+
+
+def admin(client, deadline):
+    while time.time() < deadline:
+        client.request('/admin/dashboard', '/admin/dashboard')
+        client.request('/menu', '/menu')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(results, seconds):
+    routes = {}
+    for name, entry in sorted(results.items()):
+        latencies = entry['latencies']
+        routes[name] = {
+            'requests': len(latencies),
+            'errors': entry['errors'],
+            'throughput': round(len(latencies) / seconds, 2),
+            'p50_ms': round(percentile(latencies, .5) * 1000, 1),
+            'p95_ms': round(percentile(latencies, .95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, .99) * 1000, 1),
+        }
+    return routes
+
+
+def compare(routes, baseline, tolerance):
+    """ Print the change against a previous run and return the routes
+        that got slower or handled less traffic than tolerance allows
+    """
+    regressions = []
+    print('\n%-22s %16s %18s' % ('vs baseline', 'throughput', 'p95'))
+    for name, route in sorted(routes.items()):
+        old = baseline['routes'].get(name)
+        if not old or not old['throughput'] or not old['p95_ms']:
+            continue
+        throughput = route['throughput'] / old['throughput'] - 1
+        p95 = route['p95_ms'] / old['p95_ms'] - 1
+        flag = ''
+        if throughput < -tolerance or p95 > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-22s %+15.1f%% %+17.1f%%%s' % (name, throughput * 100,
+                                               p95 * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--menu-items', type=int, default=40)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=16,
+                        help='simulated customers at once')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--maps-latency', type=float, default=.3,
+                        help='seconds the fake Maps API takes to answer')
+    parser.add_argument('--checkout-ratio', type=float, default=.05,
+                        help='chance a customer checks out after a visit')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--compare', help='results file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='allowed throughput drop or p95 rise, as a '
+                             'fraction, before --compare fails')
+    args = parser.parse_args()
+    if args.clients >= args.users:
+        parser.error('--users must be larger than --clients')
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp()
+    app = None
+    try:
+        print('Seeding %d users and %d orders...' % (args.users, args.orders))
+        seed_data.seed(os.path.join(workdir, 'cantinadesantiago.db'),
+                       args.users, args.menu_items, args.orders, rng)
+        maps_port = start_fake_maps(args.maps_latency)
+        port = free_port()
+        environ = {
+            'DATABASE_URL': 'sqlite:///' + os.path.join(
+                workdir, 'cantinadesantiago.db'),
+            'MAPS_API_HOST': '127.0.0.1:%d' % maps_port,
+            'MAPS_API_SCHEME': 'http',
+            'GMAPS_API_KEY': 'load-test',
+        }
+        app = multiprocessing.Process(target=serve_app,
+                                      args=(workdir, port, environ))
+        app.daemon = True
+        app.start()
+        base_url = 'http://127.0.0.1:%d' % port
+        wait_for(base_url + '/menu', 120)
+
+        results = {}
+        lock = threading.Lock()
+        # Customers are signed in before the clock starts
+        clients = [Client(base_url, seed_data.email(n + 1), results, lock)
+                   for n in range(args.clients)]
+        admin_client = Client(base_url, seed_data.email(0), results, lock)
+        start = time.time()
+        deadline = start + args.seconds
+        threads = [threading.Thread(target=customer, args=(
+            c, args, deadline, random.Random(rng.random()))) for c in clients]
+        threads.append(threading.Thread(target=admin,
+                                        args=(admin_client, deadline)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+    finally:
+        if app is not None:
+            app.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    routes = summarize(results, elapsed)
+    print('%-22s %9s %7s %9s %9s %9s %9s' % (
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, route in sorted(routes.items()):
+        print('%-22s %9d %7d %9.1f %9.1f %9.1f %9.1f' % (
+            name, route['requests'], route['errors'], route['throughput'],
+            route['p50_ms'], route['p95_ms'], route['p99_ms']))
+    report = {
+        'started': datetime.datetime.fromtimestamp(start).isoformat(),
+        'seconds': round(elapsed, 2),
+        'config': dict((k, v) for k, v in vars(args).items()
+                       if k not in ('output', 'compare')),
+        'routes': routes,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('\nResults written to %s' % args.output)
+    failed = any(route['errors'] for route in routes.values())
+    if args.compare:
+        with open(args.compare) as f:
+            failed = compare(routes, json.load(f), args.tolerance) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
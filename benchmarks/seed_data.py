@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+""" Build a synthetic cantinadesantiago.db for load tests
+
+    Creates a fresh database with the given number of customers, each
+    with a deliverable address, a menu, and a year of order history with
+    the analytics rollups already built. Every customer's password is
+    PASSWORD and load0@example.com is an admin.
+
+    python benchmarks/seed_data.py /tmp/load/cantinadesantiago.db \\
+        --users 2000 --orders 200000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'loadtest'
+CHUNK = 5000
+# Same as application.MAX_DELIVERY_DISTANCE, which cannot be imported
+# without starting the app
+MAX_DELIVERY_DISTANCE = 32187
+PRICES = ['1.75', '2.25', '2.50', '3.00', '3.50', '4.00', '5.00', '5.50',
+          '7.75', '8.50', '10.50', '11.75', '12.50', '14.00']
+STREETS = ['Main St', 'Livingston Rd', 'Airport Pulling Rd', 'Vanderbilt Dr',
+           'Goodlette Frank Rd', 'Immokalee Rd', 'Pine Ridge Rd',
+           'Golden Gate Pkwy']
+
+
+def email(number):
+    return 'load%d@example.com' % number
+
+
+def deliverable_zip_codes():
+    """ Returns the ZIP codes that are certainly inside the delivery
+        radius, so seeded addresses never need a Maps lookup to validate
+    """
+    from geoindex import DeliveryArea, INSIDE
+    area = DeliveryArea(MAX_DELIVERY_DISTANCE)
+    return ['%05d' % z for z in area.zip_codes
+            if area.classify(zip_code=z) == INSIDE]
+
+
+def chunks(rows):
+    for start in range(0, len(rows), CHUNK):
+        yield rows[start:start + CHUNK]
+
+
+def seed(path, users, menu_items, orders, rng):
+    """ Create and fill the database at path, which must not exist yet"""
+    if os.path.exists(path):
+        raise SystemExit('%s already exists' % path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(path)
+    sys.path.insert(0, REPO)
+    import analytics
+    import migrations
+    from addresses import address_key
+    from database import DBSession, engine
+    from models import Address, MenuItem, Order, OrderItem, User
+    from passwords import hash_password
+    from pricing import to_cents
+    migrations.upgrade(engine)
+
+    zip_codes = deliverable_zip_codes()
+    courses = ['Appetizer', 'Entree', 'Dessert', 'Drink']
+    menu = []
+    for number in range(1, menu_items + 1):
+        price = rng.choice(PRICES)
+        menu.append({'id': number, 'name': 'Item %d' % number,
+                     'course': courses[number % len(courses)],
+                     'description': 'Synthetic menu item %d' % number,
+                     'price': price, 'price_cents': to_cents(price)})
+    # One hash for everyone, hashing thousands of passwords would take
+    # minutes and tells the test nothing
+    password_hash = hash_password(PASSWORD)
+    addresses = []
+    people = []
+    for number in range(users):
+        fields = {'street_1': '%d %s' % (100 + number, rng.choice(STREETS)),
+                  'street_2': None, 'city': 'Naples', 'state': 'FL',
+                  'zip_code': rng.choice(zip_codes)}
+        fields['address_key'] = address_key(
+            fields['street_1'], None, 'Naples', 'FL', fields['zip_code'])
+        fields['id'] = number + 1
+        addresses.append(fields)
+        people.append({'id': number + 1, 'name': 'Load %d' % number,
+                       'email': email(number), 'password_hash': password_hash,
+                       'address_id': number + 1,
+                       'admin': 1 if number == 0 else 0})
+    now = datetime.datetime.now()
+    order_rows = []
+    item_rows = []
+    for number in range(1, orders + 1):
+        order_time = now - datetime.timedelta(
+            seconds=rng.randint(3600, 365 * 24 * 3600))
+        order_rows.append({
+            'id': number, 'user_id': rng.randint(1, users),
+            'order_time': order_time,
+            'delivery_time': order_time + datetime.timedelta(minutes=40)})
+        for menu_item_id in rng.sample(range(1, menu_items + 1),
+                                       rng.randint(1, min(4, menu_items))):
+            item_rows.append({'order_id': number,
+                              'menu_item_id': menu_item_id,
+                              'quantity': rng.randint(1, 3)})
+
+    with engine.begin() as conn:
+        for table, rows in [(MenuItem, menu), (Address, addresses),
+                            (User, people), (Order, order_rows),
+                            (OrderItem, item_rows)]:
+            for chunk in chunks(rows):
+                conn.execute(table.__table__.insert(), chunk)
+    session = DBSession()
+    analytics.rebuild(session)
+    session.commit()
+    DBSession.remove()
+    engine.dispose()
+    return {'users': users, 'menu_items': menu_items, 'orders': orders,
+            'order_items': len(item_rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--menu-items', type=int, default=40)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    counts = seed(args.path, args.users, args.menu_items, args.orders,
+                  random.Random(args.seed))
+    print('Seeded %(users)d users, %(menu_items)d menu items, %(orders)d '
+          'orders and %(order_items)d order items' % counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+""" Multi-process cart write load test for the SQLite tuning layer
+
+    Several processes, each with a few request threads, add items to carts
+    at a target total rate against a copy of cantinadesantiago.db and
+    report throughput, latency and any 'database is locked' errors.
+
+    python benchmarks/sqlite_write_load.py --processes 4 --rate 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(args, results):
+    """ Run one worker process's share of the writes"""
+    from sqlalchemy.exc import OperationalError
+    from database import DBSession, engine
+    from models import Cart
+    from writequeue import WriteQueue, WriteTimeout
+    # Never share the parent's pooled connections across the fork
+    engine.dispose()
+    write_queue = WriteQueue(DBSession, enabled=not args.no_queue)
+    interval = args.processes * args.threads / float(args.rate)
+    stats = {'writes': 0, 'locked': 0, 'timeouts': 0, 'latencies': []}
+    lock = threading.Lock()
+
+    def run_thread(thread_number):
+        user_id = 100000 + os.getpid() * 100 + thread_number
+        deadline = time.time() + args.seconds
+        next_write = time.time()
+        while time.time() < deadline:
+            menu_id = stats['writes'] % 20 + 1
+
+            def add(session):
+                item = session.query(Cart).filter_by(
+                    user_id=user_id, menu_item_id=menu_id).one_or_none()
+                if item:
+                    item.quantity += 1
+                else:
+                    session.add(Cart(user_id=user_id, menu_item_id=menu_id,
+                                     quantity=1))
+            start = time.time()
+            try:
+                write_queue.run(add)
+                outcome = 'writes'
+            except OperationalError:
+                outcome = 'locked'
+            except WriteTimeout:
+                outcome = 'timeouts'
+            with lock:
+                stats[outcome] += 1
+                stats['latencies'].append(time.time() - start)
+            DBSession.remove()
+            next_write += interval
+            time.sleep(max(0, next_write - time.time()))
+
+    threads = [threading.Thread(target=run_thread, args=(n,))
+               for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put(stats)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='request threads per process')
+    parser.add_argument('--rate', type=float, default=200,
+                        help='target writes per second across all processes')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--no-queue', action='store_true',
+                        help='write from request threads directly')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(REPO, 'cantinadesantiago.db'), workdir)
+    os.chdir(workdir)
+    # Create any missing tables once, before the workers start
+    sys.path.insert(0, REPO)
+    import models
+    models.engine.dispose()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(args, results))
+                 for _ in range(args.processes)]
+    for p in processes:
+        p.start()
+    totals = {'writes': 0, 'locked': 0, 'timeouts': 0, 'latencies': []}
+    for _ in processes:
+        stats = results.get()
+        for key in totals:
+            totals[key] += stats[key]
+    for p in processes:
+        p.join()
+    shutil.rmtree(workdir)
+
+    latencies = totals['latencies']
+    print('writes/sec: %.1f (target %.1f)'
+          % (totals['writes'] / args.seconds, args.rate))
+    print('lock errors: %d  timeouts: %d'
+          % (totals['locked'], totals['timeouts']))
+    print('latency p50 %.1f ms  p95 %.1f ms  p99 %.1f ms' % tuple(
+        percentile(latencies, f) * 1000 for f in (.5, .95, .99)))
+    if totals['locked'] or totals['timeouts']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
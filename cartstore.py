@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import and_
+from models import Cart
+
+log = logging.getLogger(__name__)
+
+# Keep carts in memory and write them back in batches. Each process keeps
+# its own copy, so only turn it on when one process serves each user, e.g.
+# a single worker or sticky sessions. Otherwise a worker holding an old
+# copy of a cart writes back items another worker has already ordered
+CART_WRITE_BEHIND = os.environ.get('CART_WRITE_BEHIND', '0') == '1'
+# Seconds between background flushes of changed cart rows
+CART_FLUSH_INTERVAL = float(os.environ.get('CART_FLUSH_INTERVAL', 2))
+# Changed rows that trigger a flush before the interval is up
+CART_FLUSH_BATCH = int(os.environ.get('CART_FLUSH_BATCH', 200))
+# Carts kept in memory, least recently used are dropped once written
+CART_STORE_SIZE = int(os.environ.get('CART_STORE_SIZE', 5000))
+
+
+class CartLine(object):
+    """ One cart row joined to its menu item, shaped like OrderView rows"""
+    __slots__ = ('user_id', 'menu_item_id', 'name', 'price', 'price_cents',
+                 'quantity')
+
+    def __init__(self, user_id, item, quantity):
+        self.user_id = user_id
+        self.menu_item_id = item.id
+        self.name = item.name
+        self.price = item.price
+        self.price_cents = item.price_cents
+        self.quantity = quantity
+
+    @property
+    def serialize(self):
+        # Returns object data in easily serializeable format
+        return {
+            'user_id': self.user_id,
+            'menu_item_id': self.menu_item_id,
+            'name': self.name,
+            'price': self.price,
+            'quantity': self.quantity,
+        }
+
+
+class CartStore(object):
+    """ Each active user's cart as menu item id -> quantity
+
+        Carts are read from the cart table once and then changed in memory.
+        Changed rows are written back through the write queue in batches,
+        every flush_interval seconds or once flush_batch rows are waiting.
+        The cart table is always the recovery point: after a crash, at most
+        the last flush_interval seconds of cart changes are lost, and
+        place_order flushes the user's cart before it reads the table.
+        When disabled, carts are not kept in memory: every read goes to the
+        table and every change is written straight away, without holding
+        the lock other users' carts are guarded by.
+    """
+
+    def __init__(self, session_factory, write_queue,
+                 enabled=CART_WRITE_BEHIND, flush_interval=CART_FLUSH_INTERVAL,
+                 flush_batch=CART_FLUSH_BATCH, max_users=CART_STORE_SIZE):
+        self.session_factory = session_factory
+        self.write_queue = write_queue
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_users = max_users
+        self._carts = OrderedDict()
+        # (user id, menu item id) -> quantity to write, 0 deletes the row
+        self._dirty = {}
+        self._lock = threading.RLock()
+        # Held while a batch is being written, so a flush never returns
+        # before rows taken by an earlier one are in the table
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def items(self, user_id):
+        """ Returns a copy of the user's cart as menu item id -> quantity"""
+        if not self.enabled:
+            return read_cart(self.session_factory(), user_id)
+        with self._lock:
+            return OrderedDict(self._load(user_id))
+
+    def lines(self, user_id, menu):
+        """ Returns the user's cart rows joined to the cached menu, skipping
+            items that are no longer on it or have no valid price
+        """
+        return [CartLine(user_id, menu.by_id[menu_id], quantity)
+                for menu_id, quantity in self.items(user_id).items()
+                if menu_id in menu.by_id and
+                menu.by_id[menu_id].price_cents is not None]
+
+    def add(self, user_id, menu_id, quantity=1):
+        """ Add to the quantity of an item, putting it in the cart if needed
+        """
+        if not self.enabled:
+            def added(current):
+                return (current or 0) + quantity
+            self.write_queue.run(lambda session: change_row(
+                session, user_id, menu_id, added))
+            return
+        with self._lock:
+            cart = self._load(user_id)
+            self._set(user_id, menu_id, cart.get(menu_id, 0) + quantity)
+
+    def set_quantity(self, user_id, menu_id, quantity):
+        """ Set the quantity of an item already in the cart
+            Returns False if it is not in the cart
+        """
+        if not self.enabled:
+            def changed(current):
+                return None if current is None else quantity
+            return self.write_queue.run(lambda session: change_row(
+                session, user_id, menu_id, changed))
+        with self._lock:
+            if menu_id not in self._load(user_id):
+                return False
+            self._set(user_id, menu_id, quantity)
+            return True
+
+    def remove(self, user_id, menu_id):
+        """ Take an item out of the cart
+            Returns False if it is not in the cart
+        """
+        return self.set_quantity(user_id, menu_id, 0)
+
+    def forget(self, user_id):
+        """ Drop the in-memory copy of a user's cart, e.g. once it has been
+            ordered, so the next read comes from the table
+        """
+        with self._lock:
+            self._carts.pop(user_id, None)
+            for key in [k for k in self._dirty if k[0] == user_id]:
+                del self._dirty[key]
+
+    def drop_items(self, menu_ids):
+        """ Take menu items out of every cart held in memory, and drop any
+            change to them still waiting to be written, e.g. when they are
+            removed from the menu
+        """
+        menu_ids = set(menu_ids)
+        with self._lock:
+            for cart in self._carts.values():
+                for menu_id in menu_ids.intersection(cart):
+                    del cart[menu_id]
+            for key in [k for k in self._dirty if k[1] in menu_ids]:
+                del self._dirty[key]
+
+    def flush(self, user_id=None):
+        """ Write waiting changes to the cart table now, for one user or for
+            everyone
+        """
+        with self._flush_lock:
+            with self._lock:
+                if user_id is None:
+                    batch, self._dirty = self._dirty, {}
+                else:
+                    batch = dict((k, v) for k, v in self._dirty.items()
+                                 if k[0] == user_id)
+                    for key in batch:
+                        del self._dirty[key]
+            if not batch:
+                return
+            try:
+                self.write_queue.run(
+                    lambda session: write_rows(session, batch))
+            except Exception:
+                with self._lock:
+                    # Put the rows back unless they changed again meanwhile
+                    for key, quantity in batch.items():
+                        self._dirty.setdefault(key, quantity)
+                raise
+
+    def _load(self, user_id):
+        # Called with the lock held, only with write-behind on
+        cart = self._carts.get(user_id)
+        if cart is None:
+            cart = read_cart(self.session_factory(), user_id)
+            self._carts[user_id] = cart
+            self._evict()
+        else:
+            self._carts[user_id] = self._carts.pop(user_id)
+        return cart
+
+    def _set(self, user_id, menu_id, quantity):
+        # Called with the lock held, only with write-behind on
+        cart = self._carts[user_id]
+        if quantity > 0:
+            cart[menu_id] = quantity
+        else:
+            cart.pop(menu_id, None)
+            quantity = 0
+        self._dirty[(user_id, menu_id)] = quantity
+        self._start_flusher()
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    def _evict(self):
+        # Only carts with nothing waiting to be written can be dropped
+        while len(self._carts) > self.max_users:
+            dirty_users = set(k[0] for k in self._dirty)
+            for user_id in self._carts:
+                if user_id not in dirty_users:
+                    del self._carts[user_id]
+                    break
+            else:
+                return
+
+    def _flusher(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Could not write back cart changes')
+                time.sleep(self.flush_interval)
+
+    def _start_flusher(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._flusher)
+            thread.daemon = True
+            thread.start()
+
+
+def read_cart(session, user_id):
+    """ Returns the user's cart rows as menu item id -> quantity"""
+    return OrderedDict(session.query(
+        Cart.menu_item_id, Cart.quantity).filter_by(
+        user_id=user_id).order_by(Cart.id))
+
+
+def change_row(session, user_id, menu_id, change):
+    """ Read and write one cart row in the given session, setting it to
+        change(current quantity or None)
+        Returns False, writing nothing, if change returns None
+    """
+    current = session.query(Cart.quantity).filter_by(
+        user_id=user_id, menu_item_id=menu_id).scalar()
+    quantity = change(current)
+    if quantity is None:
+        return False
+    write_rows(session, {(user_id, menu_id): quantity})
+    return True
+
+
+def write_rows(session, rows):
+    """ Apply (user id, menu item id) -> quantity to the cart table in the
+        given session, deleting rows whose quantity is 0
+    """
+    cart = Cart.__table__
+    for (user_id, menu_id), quantity in rows.items():
+        match = and_(cart.c.user_id == user_id, cart.c.menu_item_id == menu_id)
+        if quantity <= 0:
+            session.execute(cart.delete().where(match))
+        elif not session.execute(cart.update().where(match).values(
+                quantity=quantity)).rowcount:
+            session.execute(cart.insert().values(
+                user_id=user_id, menu_item_id=menu_id, quantity=quantity))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# Any SQLAlchemy URL, e.g. postgresql://cantina@localhost/cantina
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///cantinadesantiago.db')
+
+# Connection pool settings, overridable from the environment
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+# SQLite settings applied to every new connection
+SQLITE_PRAGMAS = [
+    ('journal_mode', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))),
+    ('mmap_size', int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))),
+    # Negative values are in KiB
+    ('cache_size', int(os.environ.get('SQLITE_CACHE_SIZE', -20000))),
+]
+
+
+def make_engine(url=DATABASE_URL):
+    """ Create the engine shared by the whole process"""
+    connect_args = {}
+    if url.startswith('sqlite'):
+        # Pooled connections are handed between request threads
+        connect_args['check_same_thread'] = False
+    new_engine = create_engine(url, poolclass=QueuePool, pool_size=POOL_SIZE,
+                               max_overflow=POOL_MAX_OVERFLOW,
+                               pool_pre_ping=POOL_PRE_PING,
+                               connect_args=connect_args)
+    if url.startswith('sqlite'):
+        event.listen(new_engine, 'connect', set_sqlite_pragmas)
+    return new_engine
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ Tune each new SQLite connection for concurrent workers"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+engine = make_engine()
+
+# One session per thread, removed at the end of each request
+DBSession = scoped_session(sessionmaker(bind=engine))
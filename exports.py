@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import csv
+import json
+import sys
+from models import MenuItem, Order, OrderItem
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+FIELDS = ['order_id', 'user_id', 'order_time', 'delivery_time',
+          'menu_item_id', 'name', 'quantity', 'price', 'price_cents']
+# Rows fetched from the database, and written out, per chunk
+CHUNK_SIZE = 1000
+PY2 = sys.version_info[0] == 2
+
+
+class _Buffer(object):
+    """ File-like sink for csv.writer that hands back what was written"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def drain(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        if PY2:
+            # The csv module writes UTF-8 bytes on Python 2
+            text = text.decode('utf-8')
+        return text
+
+
+def csv_cell(value):
+    """ Returns a value the csv writer accepts, on Python 2 it only takes
+        byte strings
+    """
+    if PY2 and isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def order_rows(session, since_id=None, since_time=None,
+               chunk_size=CHUNK_SIZE):
+    """ Yields one dict per ordered item, oldest order first, reading
+        chunk_size rows at a time
+        since_id exports orders after that id, since_time orders placed
+        at or after that time. Prices are the menu's current prices,
+        items taken off the menu keep their last price
+    """
+    query = session.query(
+        Order.id, Order.user_id, Order.order_time, Order.delivery_time,
+        OrderItem.menu_item_id, MenuItem.name, OrderItem.quantity,
+        MenuItem.price, MenuItem.price_cents).join(
+        OrderItem, OrderItem.order_id == Order.id).outerjoin(
+        MenuItem, MenuItem.id == OrderItem.menu_item_id)
+    if since_id is not None:
+        query = query.filter(Order.id > since_id)
+    if since_time is not None:
+        query = query.filter(Order.order_time >= since_time)
+    query = query.order_by(Order.id, OrderItem.id).yield_per(chunk_size)
+    for row in query:
+        row = dict(zip(FIELDS, row))
+        for field in ('order_time', 'delivery_time'):
+            if row[field] is not None:
+                row[field] = row[field].isoformat()
+        yield row
+
+
+def stream(rows, export_format, chunk_size=CHUNK_SIZE):
+    """ Yields the rows as CSV (with a header) or NDJSON text, chunk_size
+        rows per piece, as unicode on Python 2 as well
+    """
+    if export_format not in FORMATS:
+        raise ValueError('format must be one of %s'
+                         % ', '.join(sorted(FORMATS)))
+    buffer = _Buffer()
+    if export_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        write = lambda row: writer.writerow([csv_cell(row[f])
+                                             for f in FIELDS])
+    else:
+        write = lambda row: buffer.write(json.dumps(row) + '\n')
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.drain()
+    yield buffer.drain()
@@ -1,9 +1,9 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import ValidationError, DataRequired, Email, EqualTo
-from models import Base, User
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from models import User
+from database import DBSession
+from sqlalchemy import func
 
 
 class LoginForm(FlaskForm):
@@ -23,14 +23,11 @@ class RegistrationForm(FlaskForm):
 
     def connect(self):
         """ Connect to database"""
-        engine = create_engine('sqlite:///cantinadesantiago.db')
-        Base.metadata.bind = engine
-        DBSession = sessionmaker(bind=engine)
-        session = DBSession()
-        return session
+        return DBSession()
 
     def validate_email(self, email):
         session = self.connect()
-        user = session.query(User).filter_by(email=email.data).first()
+        user = session.query(User).filter(
+            func.lower(User.email) == email.data.lower()).first()
         if user is not None:
             raise ValidationError('Please use a different email address.')
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import bisect
+import math
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from routecache import normalize_destination
+
+ZIP_CENTROIDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'zip_centroids.csv')
+# Approximate geocode of RESTAURANT_ADDRESS
+RESTAURANT_LOCATION = (26.2720, -81.7570)
+# Driving distance is assumed to be at most this multiple of the
+# straight-line distance when deciding that an address is clearly in range
+DETOUR_FACTOR = float(os.environ.get('DELIVERY_DETOUR_FACTOR', 1.5))
+# The ZIP centroids are approximate, so an address located only by its ZIP
+# code is turned away without routing only when it is this many meters
+# past the radius on top of the ZIP's own radius
+ZIP_OUTSIDE_MARGIN = float(os.environ.get('ZIP_OUTSIDE_MARGIN', 16000))
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 4096))
+EARTH_RADIUS = 6371000  # Meters
+
+INSIDE = 'inside'
+OUTSIDE = 'outside'
+BORDERLINE = 'borderline'
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """ Returns the great-circle distance in meters between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class DeliveryArea(object):
+    """ Answers delivery radius checks without calling the Directions API
+
+        ZIP centroids are held in parallel arrays sorted by ZIP code.
+        Geocodes returned by earlier Directions requests are remembered per
+        destination and take precedence over the ZIP centroid.
+    """
+
+    def __init__(self, max_distance, origin=RESTAURANT_LOCATION,
+                 path=ZIP_CENTROIDS_FILE, detour_factor=DETOUR_FACTOR,
+                 outside_margin=ZIP_OUTSIDE_MARGIN):
+        self.max_distance = max_distance
+        self.origin = origin
+        self.detour_factor = detour_factor
+        self.outside_margin = outside_margin
+        self.zip_codes = array('i')
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.radii = array('d')
+        self._geocodes = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        """ Load ZIP centroids from a zip,lat,lng,radius CSV file"""
+        rows = []
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                zip_code, lat, lng, radius = line.split(',')
+                rows.append((int(zip_code), float(lat), float(lng),
+                             float(radius)))
+        rows.sort()
+        self.zip_codes = array('i', [r[0] for r in rows])
+        self.latitudes = array('d', [r[1] for r in rows])
+        self.longitudes = array('d', [r[2] for r in rows])
+        self.radii = array('d', [r[3] for r in rows])
+
+    def remember(self, destination, lat, lng):
+        """ Record the geocode of a routed destination"""
+        key = normalize_destination(destination)
+        with self._lock:
+            self._geocodes.pop(key, None)
+            self._geocodes[key] = (lat, lng)
+            while len(self._geocodes) > GEOCODE_CACHE_SIZE:
+                self._geocodes.popitem(last=False)
+
+    def locate(self, destination=None, zip_code=None):
+        """ Returns (lat, lng, uncertainty in meters) or None if unknown"""
+        if destination is not None:
+            with self._lock:
+                geocode = self._geocodes.get(
+                    normalize_destination(destination))
+            if geocode is not None:
+                return geocode[0], geocode[1], 0.0
+        try:
+            zip_code = int(str(zip_code).strip()[:5])
+        except (TypeError, ValueError):
+            return None
+        i = bisect.bisect_left(self.zip_codes, zip_code)
+        if i == len(self.zip_codes) or self.zip_codes[i] != zip_code:
+            return None
+        return self.latitudes[i], self.longitudes[i], self.radii[i]
+
+    def classify(self, destination=None, zip_code=None):
+        """ Returns INSIDE or OUTSIDE when the answer is certain without
+            routing, otherwise BORDERLINE
+        """
+        location = self.locate(destination, zip_code)
+        if location is None:
+            return BORDERLINE
+        lat, lng, uncertainty = location
+        distance = haversine(self.origin[0], self.origin[1], lat, lng)
+        # Only routed geocodes are exact, a ZIP centroid may be off by more
+        # than its radius
+        margin = self.outside_margin if uncertainty else 0
+        # Driving distance is never shorter than the straight line
+        if distance - uncertainty - margin > self.max_distance:
+            return OUTSIDE
+        if (distance + uncertainty) * self.detour_factor < self.max_distance:
+            return INSIDE
+        return BORDERLINE
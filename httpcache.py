@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import gzip
+import hashlib
+import io
+import os
+from flask import make_response
+
+# Cache-Control sent with cacheable JSON responses
+JSON_CACHE_CONTROL = os.environ.get('JSON_CACHE_CONTROL',
+                                    'public, max-age=0, must-revalidate')
+# Responses smaller than this many bytes are not compressed
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+
+
+class CachedPayload(object):
+    """ A response body with its strong ETag and gzip variant"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+                f.write(self.body)
+            self._gzipped = buf.getvalue()
+        return self._gzipped
+
+
+def conditional_response(payload, request, mimetype='application/json',
+                         cache_control=JSON_CACHE_CONTROL):
+    """ Returns a response for payload that answers If-None-Match with 304
+        and is gzip-compressed when the client accepts it
+    """
+    use_gzip = (len(payload.body) >= GZIP_MIN_SIZE and
+                request.accept_encodings.quality('gzip') > 0)
+    if use_gzip:
+        # Each encoding is a different representation with its own ETag
+        response = make_response(payload.gzipped)
+        response.set_etag(payload.etag + '-gz')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(payload.body)
+        response.set_etag(payload.etag)
+    response.mimetype = mimetype
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+
+# Seconds a user snapshot is reused across requests. Changes made in other
+# worker processes, such as a revoked admin flag, show up after this long
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 30))
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 4096))
+
+
+class AddressSnapshot(object):
+    """ Detached, read-only copy of an address"""
+    __slots__ = ('id', 'street_1', 'street_2', 'city', 'state', 'zip_code')
+
+    def __init__(self, address):
+        self.id = address.id
+        self.street_1 = address.street_1
+        self.street_2 = address.street_2
+        self.city = address.city
+        self.state = address.state
+        self.zip_code = address.zip_code
+
+
+class UserSnapshot(UserMixin):
+    """ Detached, read-only copy of a user and their address, safe to share
+        between requests and threads
+    """
+
+    def __init__(self, user):
+        self.id = user.id
+        self.name = user.name
+        self.email = user.email
+        self.admin = user.admin
+        self.address_id = user.address_id
+        if user.address is None:
+            self.address = None
+        else:
+            self.address = AddressSnapshot(user.address)
+
+
+class IdentityCache(object):
+    """ Bounded LRU of user snapshots by user id, each kept for ttl seconds
+    """
+
+    def __init__(self, ttl=IDENTITY_CACHE_TTL, max_entries=IDENTITY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, fetch):
+        """ Returns the snapshot for user_id
+            fetch(user_id) is only called on a miss and may return None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None and entry[0] > now:
+                self._entries[user_id] = entry
+                return entry[1]
+        snapshot = fetch(user_id)
+        if snapshot is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        """ Drop one user, or everyone when none is given"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
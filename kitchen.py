@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import heapq
+import os
+import threading
+import time
+from models import Order
+
+BASE_PREP_TIME = 1200  # Seconds
+CUSTOMERS_PER_STEP = 3  # Prep time grows for every three concurrent customers
+STEP_INCREASE = .2  # By 20% per step
+# Seconds between reloads of the in-flight orders from the database, so each
+# worker also counts the orders the other workers placed
+KITCHEN_RESEED_SECONDS = float(os.environ.get('KITCHEN_RESEED_SECONDS', 60))
+# Every order is delivered within this long of being placed, so a reload
+# only reads recent orders, through the order_time index
+MAX_DELIVERY_WINDOW = datetime.timedelta(hours=6)
+
+
+def naive(moment):
+    """ Drops the zone PostgreSQL gives timestamptz values, so they compare
+        with the naive local times the app works in
+    """
+    return moment.replace(tzinfo=None)
+
+
+class KitchenLoad(object):
+    """ Tracks kitchen load in memory so prep time estimates are O(1)
+
+        In-flight orders are kept in a heap of delivery times and expire
+        once delivered. Orders placed by this process are added as they
+        come in, and every reseed_interval seconds the heap is reloaded
+        from the database to pick up everyone else's.
+    """
+
+    def __init__(self, session_factory=None,
+                 reseed_interval=KITCHEN_RESEED_SECONDS):
+        self.session_factory = session_factory
+        self.reseed_interval = reseed_interval
+        self._in_flight = []
+        self._seeded_at = None
+        self._lock = threading.Lock()
+
+    def seed(self, session, now=None):
+        """ Load undelivered orders from the database"""
+        if now is None:
+            now = datetime.datetime.now()
+        pending = session.query(Order.delivery_time).filter(
+            Order.order_time > now - MAX_DELIVERY_WINDOW,
+            Order.delivery_time > now).all()
+        in_flight = [naive(row.delivery_time) for row in pending]
+        heapq.heapify(in_flight)
+        with self._lock:
+            self._in_flight = in_flight
+            self._seeded_at = time.time()
+
+    def record_order(self, delivery_time):
+        """ Count a newly placed order"""
+        with self._lock:
+            heapq.heappush(self._in_flight, naive(delivery_time))
+
+    def in_flight(self, now=None):
+        """ Returns the number of orders not yet delivered"""
+        if now is None:
+            now = datetime.datetime.now()
+        now = naive(now)
+        if self._stale():
+            self.seed(self.session_factory(), now)
+        with self._lock:
+            while self._in_flight and self._in_flight[0] <= now:
+                heapq.heappop(self._in_flight)
+            return len(self._in_flight)
+
+    def prep_time(self, now=None):
+        """ Returns prep time in seconds for an order placed now"""
+        steps = self.in_flight(now) // CUSTOMERS_PER_STEP
+        return BASE_PREP_TIME + BASE_PREP_TIME * steps * STEP_INCREASE
+
+    def _stale(self):
+        return (self.session_factory is not None and
+                (self._seeded_at is None or
+                 time.time() - self._seeded_at >= self.reseed_interval))
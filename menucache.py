@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+import threading
+import time
+from sqlalchemy import event
+import analytics
+from models import MenuItem, MenuVersion
+
+# Seconds between checks of the database change stamp, so that updates
+# made by other worker processes are noticed
+MENU_CACHE_CHECK_INTERVAL = float(
+    os.environ.get('MENU_CACHE_CHECK_INTERVAL', 5))
+# Seconds the top items strip is reused before it is read again
+TOP_ITEMS_TTL = float(os.environ.get('TOP_ITEMS_TTL', 60))
+
+
+class MenuEntry(object):
+    """ Detached, read-only copy of a menu item"""
+    __slots__ = ('id', 'name', 'course', 'description', 'price',
+                 'price_cents')
+
+    def __init__(self, item):
+        self.id = item.id
+        self.name = item.name
+        self.course = item.course
+        self.description = item.description
+        self.price = item.price
+        self.price_cents = item.price_cents
+
+    @property
+    def serialize(self):
+        # Returns object data in easily serializeable format
+        return {
+            'id': self.id,
+            'name': self.name,
+            'course': self.course,
+            'description': self.description,
+            'price': self.price,
+        }
+
+
+class MenuSnapshot(object):
+    """ The whole menu at one version"""
+
+    def __init__(self, version, items):
+        self.version = version
+        self.items = items
+        self.by_id = dict((i.id, i) for i in items)
+        # Rendered responses and HTML fragments for this version,
+        # filled in by the routes
+        self.payloads = {}
+        self.fragments = {}
+
+
+class MenuCache(object):
+    """ Read-through cache of the menu
+
+        The menu_version table holds a change stamp that is bumped in the
+        same transaction as every menu change. Each process re-reads the
+        stamp at most every check_interval seconds and reloads the menu only
+        when it has moved.
+    """
+
+    def __init__(self, check_interval=MENU_CACHE_CHECK_INTERVAL,
+                 top_items_ttl=TOP_ITEMS_TTL):
+        self.check_interval = check_interval
+        self.top_items_ttl = top_items_ttl
+        self._snapshot = None
+        self._checked_at = 0
+        self._top_items = None
+        self._top_items_key = None
+        self._lock = threading.Lock()
+
+    def get(self, session):
+        """ Returns the current MenuSnapshot"""
+        snapshot = self._snapshot
+        now = time.time()
+        fresh = now - self._checked_at < self.check_interval
+        if snapshot is not None and fresh:
+            return snapshot
+        with self._lock:
+            if (self._snapshot is None or
+                    now - self._checked_at >= self.check_interval):
+                version = get_version(session)
+                if self._snapshot is None or self._snapshot.version != version:
+                    items = [MenuEntry(i) for i in session.query(
+                        MenuItem).filter_by(active=1).order_by(MenuItem.id)]
+                    self._snapshot = MenuSnapshot(version, items)
+                self._checked_at = now
+            return self._snapshot
+
+    def get_top_items(self, session):
+        """ Returns the top items strip, reused for top_items_ttl seconds"""
+        version = self.get(session).version
+        now = time.time()
+        cached = self._top_items
+        if (cached is not None and self._top_items_key == version and
+                now - cached[0] < self.top_items_ttl):
+            return cached[1]
+        top_items = analytics.get_top_items(session, active_only=True)
+        with self._lock:
+            self._top_items = (now, top_items)
+            self._top_items_key = version
+        return top_items
+
+    def bump(self, session):
+        """ Move the change stamp forward inside the caller's transaction
+            This process re-checks the stamp as soon as the change commits
+        """
+        updated = session.query(MenuVersion).filter_by(id=1).update(
+            {MenuVersion.version: MenuVersion.version + 1},
+            synchronize_session=False)
+        if not updated:
+            session.add(MenuVersion(id=1, version=2))
+        # Not a once listener, SQLAlchemy skips a second one for the same
+        # method, so a session that bumps again would never invalidate
+        if not event.contains(session, 'after_commit', self.invalidate):
+            event.listen(session, 'after_commit', self.invalidate)
+
+    def invalidate(self, session=None):
+        """ Force a stamp check on the next read"""
+        with self._lock:
+            self._checked_at = 0
+
+
+def get_version(session):
+    """ Returns the menu change stamp stored in the database"""
+    row = session.query(MenuVersion.version).filter_by(id=1).first()
+    if row is None:
+        return 1
+    return row.version
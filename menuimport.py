@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import csv
+import json
+import sys
+from models import Cart, MenuItem, OrderItem
+from pricing import format_cents, to_cents
+
+FORMATS = ('csv', 'json')
+FIELDS = ('name', 'course', 'description', 'price')
+# Column sizes from the menu_item table
+MAX_LENGTHS = {'name': 80, 'course': 250, 'description': 250, 'price': 8}
+PY2 = sys.version_info[0] == 2
+
+
+class MenuFileError(ValueError):
+    pass
+
+
+class MenuChanges(object):
+    """ What applying a menu file would change
+        inserts holds field dicts, updates (item, field dict) pairs and
+        removals the items missing from the file
+    """
+
+    def __init__(self):
+        self.inserts = []
+        self.updates = []
+        self.removals = []
+        self.unchanged = 0
+
+    def __bool__(self):
+        return bool(self.inserts or self.updates or self.removals)
+    __nonzero__ = __bool__
+
+    @property
+    def serialize(self):
+        return {
+            'added': [e['name'] for e in self.inserts],
+            'updated': [item.name for item, _ in self.updates],
+            'removed': [item.name for item in self.removals],
+            'unchanged': self.unchanged,
+        }
+
+
+def parse(text, file_format):
+    """ Returns the entries of a CSV or JSON menu file as field dicts
+        CSV needs a header row, JSON is a list of items or the output of
+        /menu/JSON. An id is optional, without one items are matched by
+        name.
+    """
+    if file_format == 'csv':
+        rows = read_csv(text)
+    elif file_format == 'json':
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise MenuFileError('Invalid JSON: %s' % e)
+        if isinstance(rows, dict):
+            rows = rows.get('MenuItems')
+        if not isinstance(rows, list):
+            raise MenuFileError('Expected a list of menu items')
+    else:
+        raise MenuFileError('format must be one of %s' % ', '.join(FORMATS))
+    entries = []
+    ids = set()
+    names = set()
+    for number, row in enumerate(rows, 1):
+        entry = clean(row, number)
+        if entry.get('id') in ids or entry['name'] in names:
+            raise MenuFileError('Item %d: %s is listed twice' % (
+                number, entry['name']))
+        if 'id' in entry:
+            ids.add(entry['id'])
+        names.add(entry['name'])
+        entries.append(entry)
+    return entries
+
+
+def read_csv(text):
+    """ Returns the rows of CSV text as dicts keyed by the header row"""
+    if not PY2:
+        return list(csv.DictReader(text.splitlines()))
+    # The csv module on Python 2 only reads byte strings
+    rows = []
+    for row in csv.DictReader([line.encode('utf-8')
+                               for line in text.splitlines()]):
+        rows.append(dict((decode(key), decode(value))
+                         for key, value in row.items()))
+    return rows
+
+
+def decode(value):
+    """ Decode a CSV field, or the list of extra fields in a long row"""
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def clean(row, number):
+    """ Check one file entry and return its fields"""
+    if not isinstance(row, dict):
+        raise MenuFileError('Item %d: expected an object' % number)
+    entry = {}
+    for field in FIELDS:
+        value = row.get(field)
+        value = '' if value is None else ('%s' % value).strip()
+        if not value and field != 'description':
+            raise MenuFileError('Item %d: %s is required' % (number, field))
+        if len(value) > MAX_LENGTHS[field]:
+            raise MenuFileError('Item %d: %s is longer than %d characters' % (
+                number, field, MAX_LENGTHS[field]))
+        entry[field] = value
+    cents = to_cents(entry['price'])
+    if cents is None:
+        raise MenuFileError('Item %d: price %s is not a number' % (
+            number, entry['price']))
+    if cents < 0:
+        raise MenuFileError('Item %d: price %s is below zero' % (
+            number, entry['price']))
+    # Stored as the amount charged, so 6.5 and 6.50 are the same price
+    entry['price'] = format_cents(cents)
+    if row.get('id') not in (None, ''):
+        try:
+            entry['id'] = int(row['id'])
+        except (TypeError, ValueError):
+            raise MenuFileError('Item %d: id %s is not a number' % (
+                number, row['id']))
+    return entry
+
+
+def plan(session, entries):
+    """ Compare file entries with the menu_item table
+        Items with an id must exist, retired ones come back onto the menu.
+        Active items the file leaves out are removed.
+    """
+    items = session.query(MenuItem).order_by(MenuItem.active.desc(),
+                                             MenuItem.id).all()
+    by_id = dict((i.id, i) for i in items)
+    by_name = {}
+    for item in items:
+        by_name.setdefault(item.name, item)
+    changes = MenuChanges()
+    matched = set()
+    for entry in entries:
+        if 'id' in entry:
+            item = by_id.get(entry['id'])
+            if item is None:
+                raise MenuFileError('No menu item with id %d' % entry['id'])
+        else:
+            item = by_name.get(entry['name'])
+        if item is None or item.id in matched:
+            changes.inserts.append(entry)
+            continue
+        matched.add(item.id)
+        fields = dict((f, entry[f]) for f in FIELDS if f != 'price' and
+                      (getattr(item, f) or '') != entry[f])
+        if item.price_cents != to_cents(entry['price']):
+            fields['price'] = entry['price']
+        if not item.active:
+            fields['active'] = 1
+        if fields:
+            changes.updates.append((item, fields))
+        else:
+            changes.unchanged += 1
+    changes.removals = [i for i in items if i.active and i.id not in matched]
+    return changes
+
+
+def apply(session, changes, menu_cache, cart_store):
+    """ Make the changes in the caller's transaction, bumping the menu
+        version once
+    """
+    for entry in changes.inserts:
+        session.add(MenuItem(price_cents=to_cents(entry['price']),
+                             **dict((f, entry[f]) for f in FIELDS)))
+    for item, fields in changes.updates:
+        for field, value in fields.items():
+            setattr(item, field, value)
+        if 'price' in fields:
+            item.price_cents = to_cents(item.price)
+    remove_items(session, changes.removals, cart_store)
+    if changes:
+        menu_cache.bump(session)
+
+
+def remove_items(session, items, cart_store):
+    """ Take items off the menu in the caller's transaction, and out of
+        every cart
+        Items on past orders are retired so order history still has their
+        name and price, the rest are deleted. Returns the retired items.
+    """
+    if not items:
+        return []
+    ids = [i.id for i in items]
+    # Otherwise a cart held in memory would write the rows back
+    cart_store.drop_items(ids)
+    ordered = set(row[0] for row in session.query(
+        OrderItem.menu_item_id).filter(
+        OrderItem.menu_item_id.in_(ids)).distinct())
+    session.query(Cart).filter(Cart.menu_item_id.in_(ids)).delete(
+        synchronize_session=False)
+    retired = []
+    for item in items:
+        if item.id in ordered:
+            item.active = 0
+            retired.append(item)
+        else:
+            session.delete(item)
+    return retired
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import bisect
+import logging
+import os
+import threading
+import time
+from jinja2 import Template
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Requests slower than this many seconds are logged with their SQL,
+# 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """ Cumulative histogram per label values, rendered in the Prometheus
+        text format
+    """
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._series[label_values] = series
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, counts in series:
+            labels = ['%s="%s"' % (name, escape(value))
+                      for name, value in zip(self.labels, label_values)]
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append('%s_bucket{%s} %d' % (self.name, ','.join(
+                    labels + ['le="%s"' % bound]), total))
+            suffix = '{%s}' % ','.join(labels) if labels else ''
+            lines.append('%s_sum%s %.6f' % (self.name, suffix, counts[-1]))
+            lines.append('%s_count%s %d' % (self.name, suffix, total))
+        return lines
+
+
+class Counter(object):
+    """ A single counter whose value is read from a function when rendered,
+        for totals that another object already keeps
+    """
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return ['# HELP %s %s' % (self.name, self.help_text),
+                '# TYPE %s counter' % self.name,
+                '%s %d' % (self.name, self.read())]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+REQUEST_SECONDS = Histogram(
+    'cantina_request_seconds', 'Time to handle a request',
+    ('route', 'method', 'status'))
+REQUEST_SQL_STATEMENTS = Histogram(
+    'cantina_request_sql_statements', 'SQL statements run per request',
+    ('route',), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'cantina_request_sql_seconds', 'Time spent in SQL per request',
+    ('route',))
+MAPS_SECONDS = Histogram(
+    'cantina_maps_request_seconds', 'Time of each Google Maps API call',
+    ('api',), (.05, .1, .25, .5, 1, 1.5, 2.5, 5, 10))
+TEMPLATE_SECONDS = Histogram(
+    'cantina_template_render_seconds', 'Time to render a template',
+    ('template',))
+METRICS = [REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS,
+           MAPS_SECONDS, TEMPLATE_SECONDS]
+
+# The request being handled on this thread, if any
+_current = threading.local()
+
+
+class RequestStats(object):
+    __slots__ = ('start', 'sql_count', 'sql_seconds', 'statements')
+
+    def __init__(self):
+        self.start = time.time()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # Only kept when the slow request log is on
+        self.statements = [] if SLOW_REQUEST_SECONDS else None
+
+
+def add_counter(name, help_text, read):
+    """ Publish a total kept elsewhere, e.g. cache hits"""
+    METRICS.append(Counter(name, help_text, read))
+
+
+def render():
+    """ Returns every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def start_request():
+    if METRICS_ENABLED:
+        _current.stats = RequestStats()
+
+
+def finish_request(route, method, status):
+    """ Record the request started on this thread"""
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        return
+    _current.stats = None
+    elapsed = time.time() - stats.start
+    REQUEST_SECONDS.observe(elapsed, route, method, status)
+    REQUEST_SQL_STATEMENTS.observe(stats.sql_count, route)
+    REQUEST_SQL_SECONDS.observe(stats.sql_seconds, route)
+    if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+        log.warning('Slow request %s %s took %.3fs, %d SQL statements in '
+                    '%.3fs:\n%s', method, route, elapsed, stats.sql_count,
+                    stats.sql_seconds, '\n'.join(
+                        '  %.4fs %s' % s for s in stats.statements))
+
+
+class timed(object):
+    """ Context manager that observes its duration in a histogram"""
+
+    def __init__(self, histogram, *label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        if METRICS_ENABLED:
+            self.histogram.observe(time.time() - self.start,
+                                   *self.label_values)
+
+
+class TimedTemplate(Template):
+    """ Jinja template that records how long each top-level render takes"""
+
+    def render(self, *args, **kwargs):
+        with timed(TEMPLATE_SECONDS, self.name or 'string'):
+            return Template.render(self, *args, **kwargs)
+
+
+def instrument_engine(engine):
+    """ Count and time the SQL each request runs on this engine"""
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        if context is not None:
+            context.metrics_start = time.time()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context,
+                      executemany):
+        stats = getattr(_current, 'stats', None)
+        start = getattr(context, 'metrics_start', None)
+        if stats is not None and start is not None:
+            elapsed = time.time() - start
+            stats.sql_count += 1
+            stats.sql_seconds += elapsed
+            if stats.statements is not None:
+                stats.statements.append((elapsed, statement))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import logging
+from collections import OrderedDict
+from sqlalchemy import and_, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+from models import Base, Address, Cart, MenuItem, Order, OrderItem, User
+from pricing import to_cents
+from addresses import address_key
+
+log = logging.getLogger(__name__)
+
+
+def upgrade(engine):
+    """ Bring an existing database up to the current schema
+        Safe to run on every start, each step checks before it changes
+        anything
+    """
+    add_price_cents(engine)
+    add_menu_item_active(engine)
+    add_address_keys(engine)
+    merge_duplicate_cart_rows(engine)
+    create_missing_indexes(engine)
+
+
+def add_price_cents(engine):
+    """ Add menu_item.price_cents if it is missing and fill it in from the
+        price strings
+    """
+    menu_item = MenuItem.__table__
+    columns = [c['name'] for c in inspect(engine).get_columns('menu_item')]
+    with engine.begin() as conn:
+        if 'price_cents' not in columns:
+            conn.execute('ALTER TABLE menu_item ADD COLUMN price_cents INTEGER')
+        rows = conn.execute(select([menu_item.c.id, menu_item.c.price]).where(
+            menu_item.c.price_cents.is_(None))).fetchall()
+        for item_id, price in rows:
+            conn.execute(menu_item.update().where(
+                menu_item.c.id == item_id).values(price_cents=to_cents(price)))
+
+
+def add_menu_item_active(engine):
+    """ Add menu_item.active if it is missing, every existing item starts
+        out active
+    """
+    columns = [c['name'] for c in inspect(engine).get_columns('menu_item')]
+    if 'active' not in columns:
+        with engine.begin() as conn:
+            conn.execute('ALTER TABLE menu_item ADD COLUMN active INTEGER '
+                         'NOT NULL DEFAULT 1')
+
+
+def add_address_keys(engine):
+    """ Add address.address_key if it is missing, fill it in, and point
+        users of duplicate addresses at one row so the unique key index
+        can be built
+    """
+    address = Address.__table__
+    user = User.__table__
+    columns = [c['name'] for c in inspect(engine).get_columns('address')]
+    with engine.begin() as conn:
+        if 'address_key' not in columns:
+            conn.execute('ALTER TABLE address ADD COLUMN address_key '
+                         'VARCHAR(40)')
+        rows = conn.execute(select([
+            address.c.id, address.c.street_1, address.c.street_2,
+            address.c.city, address.c.state, address.c.zip_code]).where(
+            address.c.address_key.is_(None)).order_by(address.c.id)).fetchall()
+        if not rows:
+            return
+        keep = dict(conn.execute(select([
+            address.c.address_key, address.c.id]).where(
+            address.c.address_key.isnot(None))).fetchall())
+        for row in rows:
+            key = address_key(*row[1:])
+            if key not in keep:
+                keep[key] = row.id
+                conn.execute(address.update().where(
+                    address.c.id == row.id).values(address_key=key))
+                continue
+            conn.execute(user.update().where(
+                user.c.address_id == row.id).values(address_id=keep[key]))
+            conn.execute(address.delete().where(address.c.id == row.id))
+
+
+def merge_duplicate_cart_rows(engine):
+    """ Fold repeated (user, menu item) cart rows into one row so the
+        unique cart index can be built
+    """
+    cart = Cart.__table__
+    with engine.begin() as conn:
+        duplicates = conn.execute(select([
+            cart.c.user_id, cart.c.menu_item_id, func.min(cart.c.id),
+            func.sum(cart.c.quantity)]).group_by(
+            cart.c.user_id, cart.c.menu_item_id).having(
+            func.count() > 1)).fetchall()
+        for user_id, menu_item_id, keep_id, quantity in duplicates:
+            conn.execute(cart.update().where(cart.c.id == keep_id).values(
+                quantity=quantity))
+            conn.execute(cart.delete().where(and_(
+                cart.c.user_id == user_id,
+                cart.c.menu_item_id == menu_item_id,
+                cart.c.id != keep_id)))
+
+
+def create_missing_indexes(engine):
+    """ Create every index declared on the models that is not yet in the
+        database
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+            ddl = ddl.replace('INDEX ', 'INDEX IF NOT EXISTS ', 1)
+            try:
+                engine.execute(ddl)
+            except IntegrityError:
+                log.warning('Could not create unique index %s, the %s table '
+                            'has duplicate rows', index.name, table.name)
+
+
+def hot_queries(session):
+    """ Returns the queries on the request hot paths, by name"""
+    return [
+        ('cart by user and item', session.query(Cart.id).filter_by(
+            user_id=1, menu_item_id=1)),
+        ('user by email', session.query(User.id).filter(
+            func.lower(User.email) == 'customer@example.com')),
+        ('order by time', session.query(Order.id).filter(
+            Order.order_time == '2000-01-01 00:00:00')),
+        ('order items by order', session.query(OrderItem.id).filter_by(
+            order_id=1)),
+        ('address by key', session.query(Address.id).filter_by(
+            address_key=address_key('1 Main St', None, 'Naples', 'FL',
+                                    '34105'))),
+    ]
+
+
+def explain_hot_queries(session):
+    """ Returns (name, plan, uses index) for each hot query
+        Uses EXPLAIN QUERY PLAN on SQLite and EXPLAIN elsewhere
+    """
+    sqlite = session.bind.dialect.name == 'sqlite'
+    results = []
+    for name, query in hot_queries(session):
+        statement = query.statement.compile(
+            dialect=session.bind.dialect,
+            compile_kwargs={'literal_binds': True})
+        if sqlite:
+            rows = session.execute(
+                'EXPLAIN QUERY PLAN %s' % statement).fetchall()
+            steps = [row[-1] for row in rows]
+            uses_index = all('USING' in step and 'INDEX' in step
+                             for step in steps)
+        else:
+            # Small tables are cheaper to scan, so the planner is told to
+            # avoid scans to show whether an index can serve the query
+            session.execute('SET LOCAL enable_seqscan = off')
+            rows = session.execute('EXPLAIN %s' % statement).fetchall()
+            steps = [row[0].strip() for row in rows]
+            uses_index = not any('Seq Scan' in step for step in steps)
+        results.append((name, '; '.join(steps), uses_index))
+    return results
+
+
+def copy_database(source, target):
+    """ Copy every table from the source engine into an empty database on
+        the target engine, e.g. to move from SQLite to PostgreSQL
+        Returns the number of rows copied per table
+    """
+    Base.metadata.create_all(target)
+    upgrade(target)
+    counts = OrderedDict()
+    with source.connect() as reader, target.begin() as writer:
+        for table in Base.metadata.sorted_tables:
+            rows = [dict(row) for row in reader.execute(table.select())]
+            if rows:
+                writer.execute(table.insert(), rows)
+            counts[table.name] = len(rows)
+        if target.dialect.name == 'postgresql':
+            # Explicit ids do not advance the serial sequences
+            for table in Base.metadata.sorted_tables:
+                column = table.c.get('id')
+                if column is None or not column.autoincrement:
+                    continue
+                writer.execute(
+                    "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                    "COALESCE(MAX(id), 1)) FROM %s"
+                    % (table.name, target.dialect.identifier_preparer
+                       .format_table(table)))
+    return counts
@@ -4,15 +4,19 @@
 import sys
 import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Index
+from sqlalchemy import select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy import create_engine
 from sqlalchemy.sql import func
+from database import engine
+from passwords import hash_password, verify_password
 
 Base = declarative_base()
 
+DAY_NAMES = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday',
+             'Friday', 'Saturday']
+
 
 class Address(Base):
     __tablename__ = 'address'
@@ -22,6 +26,11 @@ class Address(Base):
     city = Column(String(250))
     state = Column(String(250))
     zip_code = Column(String(5))
+    # addresses.address_key of the fields, one row per distinct address
+    address_key = Column(String(40))
+    __table_args__ = (
+        Index('ix_address_key', 'address_key', unique=True),
+    )
 
     @property
     def serialize(self):
@@ -47,10 +56,14 @@ class User(UserMixin, Base):
     admin = Column(Integer)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+
+# Emails are matched case-insensitively, one account per address
+Index('ix_user_email_lower', func.lower(User.email), unique=True)
 
 
 class MenuItem(Base):
@@ -60,6 +73,10 @@ class MenuItem(Base):
     course = Column(String(250), nullable=False)
     description = Column(String(250))
     price = Column(String(8), nullable=False)
+    # The price in integer cents, kept in step with the display string
+    price_cents = Column(Integer)
+    # 0 once retired, items on past orders are kept rather than deleted
+    active = Column(Integer, nullable=False, default=1, server_default='1')
 
     @property
     def serialize(self):
@@ -78,7 +95,8 @@ class Order(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
-    order_time = Column(DateTime(timezone=True), server_default=func.now())
+    order_time = Column(DateTime(timezone=True), server_default=func.now(),
+                        index=True)
     delivery_time = Column(DateTime(timezone=True))
 
     @property
@@ -95,7 +113,7 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = 'order_item'
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('order.id'))
+    order_id = Column(Integer, ForeignKey('order.id'), index=True)
     order = relationship(Order, backref=backref(
                             'order_item', cascade='all, delete'))
     menu_item_id = Column(Integer, ForeignKey('menu_item.id'))
@@ -121,6 +139,10 @@ class Cart(Base):
     menu_item_id = Column(Integer, ForeignKey('menu_item.id'))
     menu_item = relationship(MenuItem)
     quantity = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('ix_cart_user_menu_item', 'user_id', 'menu_item_id',
+              unique=True),
+    )
 
     @property
     def serialize(self):
@@ -133,19 +155,23 @@ class Cart(Base):
         }
 
 
-class CartView(Base):
-    __tablename__ = 'cart_view'
-    user_id = Column(Integer)
-    menu_item_id = Column(Integer, primary_key=True)
-    name = Column(String(80))
-    price = Column(String(8))
-    quantity = Column(Integer)
+# Read-only view, defined as a portable select so that no database-specific
+# view DDL is needed. Queries against this class inline the select.
+class OrderView(Base):
+    __table__ = select([
+        OrderItem.order_id, OrderItem.menu_item_id, MenuItem.name,
+        MenuItem.price, MenuItem.price_cents, OrderItem.quantity]).select_from(
+        OrderItem.__table__.join(MenuItem.__table__,
+                                 MenuItem.id == OrderItem.menu_item_id)).alias(
+        'order_view')
+    __mapper_args__ = {'primary_key': [__table__.c.order_id,
+                                       __table__.c.menu_item_id]}
 
     @property
     def serialize(self):
         # Returns object data in easily serializeable format
         return {
-            'user_id': self.user_id,
+            'order_id': self.order_id,
             'menu_item_id': self.menu_item_id,
             'name': self.name,
             'price': self.price,
@@ -153,50 +179,48 @@ class CartView(Base):
         }
 
 
-class OrderView(Base):
-    __tablename__ = 'order_view'
-    order_id = Column(Integer)
-    menu_item_id = Column(Integer, primary_key=True)
-    name = Column(String(80))
-    price = Column(String(8))
-    quantity = Column(Integer)
+class TravelRoute(Base):
+    __tablename__ = 'travel_route'
+    destination_key = Column(String(600), primary_key=True)
+    duration = Column(Integer, nullable=False)
+    distance = Column(Integer, nullable=False)
+    expires_at = Column(Integer, nullable=False)
 
     @property
     def serialize(self):
         # Returns object data in easily serializeable format
         return {
-            'order_id': self.order_id,
-            'menu_item_id': self.menu_item_id,
-            'name': self.name,
-            'price': self.price,
-            'quantity': self.quantity,
+            'destination_key': self.destination_key,
+            'duration': self.duration,
+            'distance': self.distance,
+            'expires_at': self.expires_at,
         }
 
 
-class TopItemView(Base):
-    __tablename__ = 'top_item_view'
-    menu_item_id = Column(Integer, primary_key=True)
-    name = Column(String(80))
-    description = Column(String(250))
-    price = Column(String(8))
-    quantity = Column(Integer)
+class ItemCount(Base):
+    __tablename__ = 'item_count'
+    menu_item_id = Column(Integer, ForeignKey('menu_item.id'),
+                          primary_key=True)
+    menu_item = relationship(MenuItem)
+    quantity = Column(Integer, nullable=False, default=0)
 
     @property
     def serialize(self):
         # Returns object data in easily serializeable format
         return {
             'menu_item_id': self.menu_item_id,
-            'name': self.name,
-            'description': self.description,
-            'price': self.price,
             'quantity': self.quantity,
         }
 
 
-class DayOfWeekView(Base):
-    __tablename__ = 'day_of_week_view'
-    day_of_week = Column(String(250), primary_key=True)
-    quantity = Column(Integer)
+class DayOfWeekCount(Base):
+    __tablename__ = 'day_of_week_count'
+    day_number = Column(Integer, primary_key=True)  # 0 is Sunday
+    quantity = Column(Integer, nullable=False, default=0)
+
+    @property
+    def day_of_week(self):
+        return DAY_NAMES[self.day_number]
 
     @property
     def serialize(self):
@@ -207,10 +231,10 @@ class DayOfWeekView(Base):
         }
 
 
-class TimeOfDayView(Base):
-    __tablename__ = 'time_of_day_view'
-    time_of_day = Column(String(2), primary_key=True)
-    quantity = Column(Integer)
+class TimeOfDayCount(Base):
+    __tablename__ = 'time_of_day_count'
+    time_of_day = Column(Integer, primary_key=True)  # Hour, 0-23
+    quantity = Column(Integer, nullable=False, default=0)
 
     @property
     def serialize(self):
@@ -221,10 +245,10 @@ class TimeOfDayView(Base):
         }
 
 
-class ZipCodeView(Base):
-    __tablename__ = 'zip_code_view'
+class ZipCodeCount(Base):
+    __tablename__ = 'zip_code_count'
     zip_code = Column(String(5), primary_key=True)
-    quantity = Column(Integer)
+    quantity = Column(Integer, nullable=False, default=0)
 
     @property
     def serialize(self):
@@ -235,5 +259,56 @@ class ZipCodeView(Base):
         }
 
 
-engine = create_engine('sqlite:///cantinadesantiago.db')
+class HourlyCount(Base):
+    # Orders, items and ZIP codes counted per hour, for ranged analytics.
+    # dimension is 'order' (bucket_key ''), 'item' (menu item id) or 'zip'
+    __tablename__ = 'hourly_count'
+    dimension = Column(String(8), primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # Start of the hour
+    bucket_key = Column(String(16), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+
+    @property
+    def serialize(self):
+        # Returns object data in easily serializeable format
+        return {
+            'dimension': self.dimension,
+            'hour': self.hour.isoformat(),
+            'bucket_key': self.bucket_key,
+            'quantity': self.quantity,
+        }
+
+
+class AnalyticsVersion(Base):
+    # One row once analytics.rebuild has counted the order history into the
+    # rollup tables, holding the analytics.ROLLUP_VERSION they were built for
+    __tablename__ = 'analytics_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    built_at = Column(DateTime)
+
+    @property
+    def serialize(self):
+        # Returns object data in easily serializeable format
+        return {
+            'id': self.id,
+            'version': self.version,
+            'built_at': self.built_at,
+        }
+
+
+class MenuVersion(Base):
+    __tablename__ = 'menu_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+    @property
+    def serialize(self):
+        # Returns object data in easily serializeable format
+        return {
+            'id': self.id,
+            'version': self.version,
+        }
+
+
 Base.metadata.create_all(engine)
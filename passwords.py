@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import multiprocessing
+import os
+import threading
+import time
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+# werkzeug hash method for new and upgraded hashes, e.g. pbkdf2:sha256:50000
+PASSWORD_HASH_METHOD = os.environ.get(
+    'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:%d' % DEFAULT_PBKDF2_ITERATIONS)
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 8))
+# Password checks allowed to run at once, the rest wait their turn so a
+# burst of logins cannot take every CPU from the other requests
+PASSWORD_VERIFY_CONCURRENCY = int(os.environ.get(
+    'PASSWORD_VERIFY_CONCURRENCY', max(1, multiprocessing.cpu_count() - 1)))
+# Seconds a login waits for a turn before it is turned away
+PASSWORD_VERIFY_TIMEOUT = float(os.environ.get('PASSWORD_VERIFY_TIMEOUT', 5))
+
+_verify_slots = threading.BoundedSemaphore(PASSWORD_VERIFY_CONCURRENCY)
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+def full_method(method):
+    """ Returns a werkzeug method with the pbkdf2 iteration count spelled
+        out, so hashes can be compared with the configured method
+    """
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+
+def hash_password(password, method=None):
+    """ Returns a salted hash of password using the configured method"""
+    return generate_password_hash(password,
+                                  method=method or PASSWORD_HASH_METHOD,
+                                  salt_length=PASSWORD_SALT_LENGTH)
+
+
+def verify_password(pwhash, password):
+    """ Returns whether password matches pwhash
+        Raises VerifierBusy if no verification slot frees up in time
+    """
+    if not _acquire(PASSWORD_VERIFY_TIMEOUT):
+        raise VerifierBusy('Too many password checks in progress')
+    try:
+        # On Python 2 werkzeug hands the method from a unicode hash, as read
+        # from the database, to hashlib, which only takes byte strings
+        return check_password_hash(str(pwhash), password)
+    finally:
+        _verify_slots.release()
+
+
+def needs_rehash(pwhash):
+    """ Returns whether pwhash was made with a method or cost other than
+        the configured one
+    """
+    method = pwhash.split('$', 1)[0]
+    return full_method(method) != full_method(PASSWORD_HASH_METHOD)
+
+
+def _acquire(timeout):
+    # Python 2 semaphores take no timeout, so poll until the deadline
+    deadline = time.time() + timeout
+    while not _verify_slots.acquire(False):
+        if time.time() >= deadline:
+            return False
+        time.sleep(.01)
+    return True
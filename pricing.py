@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Money is held as integer cents everywhere except the display strings
+DELIVERY_FEE_CENTS = int(os.environ.get('DELIVERY_FEE_CENTS', 299))
+TAX_RATE = Decimal(os.environ.get('TAX_RATE', '0.07'))
+
+
+def to_cents(price):
+    """ Returns a price string such as '11.75' in cents, or None if the
+        string is not a number
+    """
+    try:
+        amount = Decimal(str(price).strip().lstrip('$'))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite():
+        return None
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    """ Formats cents for display, e.g. 1175 as '11.75'"""
+    if cents < 0:
+        return '-' + format_cents(-cents)
+    return '%d.%02d' % divmod(cents, 100)
+
+
+class Totals(object):
+    """ Subtotal, delivery fee, tax and total of one cart or order, in cents
+    """
+
+    def __init__(self, subtotal):
+        self.subtotal = int(subtotal or 0)
+        self.fee = DELIVERY_FEE_CENTS if self.subtotal > 0 else 0
+        # Tax is charged on the food and the fee, rounded half up to a cent
+        self.tax = int((TAX_RATE * (self.subtotal + self.fee)).quantize(
+            Decimal(1), rounding=ROUND_HALF_UP))
+        self.total = self.subtotal + self.fee + self.tax
+
+    def formatted(self):
+        """ Returns the amounts as display strings, keyed like the cart
+            templates expect
+        """
+        return {
+            'subtotal': format_cents(self.subtotal),
+            'fee': format_cents(self.fee),
+            'tax': format_cents(self.tax),
+            'total': format_cents(self.total),
+        }
+
+
+def items_totals(items):
+    """ Returns the Totals of cart or order view rows in one pass
+        Raises ValueError for an item without a valid price
+    """
+    subtotal = 0
+    for i in items:
+        if i.price_cents is None:
+            raise ValueError('%s has no valid price' % i.name)
+        subtotal += i.price_cents * i.quantity
+    return Totals(subtotal)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import cProfile
+import marshal
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Off by default, when off the app registers no profiling hooks at all
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+# Header an admin sends to profile that one request
+PROFILE_HEADER = 'X-Cantina-Profile'
+# Captured profiles kept in memory, oldest are dropped first
+PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP', 20))
+
+
+class Capture(object):
+    """ One profiled request"""
+
+    def __init__(self, capture_id, route, method, seconds, stats):
+        self.id = capture_id
+        self.route = route
+        self.method = method
+        self.seconds = seconds
+        self.taken = time.time()
+        # Same format pstats.Stats(filename) and snakeviz read
+        self.data = marshal.dumps(stats)
+
+    @property
+    def serialize(self):
+        return {
+            'id': self.id,
+            'route': self.route,
+            'method': self.method,
+            'seconds': round(self.seconds, 4),
+            'taken': self.taken,
+        }
+
+
+class Profiler(object):
+    """ cProfile of the next few requests to chosen routes, or of single
+        requests flagged with PROFILE_HEADER
+
+        Profiles are kept per process, so with several workers each one
+        captures its own share of the armed requests.
+    """
+
+    def __init__(self, keep=PROFILER_KEEP):
+        self.keep = keep
+        # Route pattern -> requests still to capture
+        self.armed = {}
+        self._captures = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def arm(self, route, count):
+        """ Profile the next count requests to a route pattern"""
+        with self._lock:
+            if count > 0:
+                self.armed[route] = count
+            else:
+                self.armed.pop(route, None)
+
+    def start(self, route, flagged):
+        """ Returns a running profile if this request should be captured,
+            otherwise None
+        """
+        if not flagged:
+            with self._lock:
+                remaining = self.armed.get(route)
+                if not remaining:
+                    return None
+                if remaining == 1:
+                    del self.armed[route]
+                else:
+                    self.armed[route] = remaining - 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, route, method, seconds):
+        """ Stop a profile and keep it, returns its Capture"""
+        profile.disable()
+        profile.create_stats()
+        with self._lock:
+            capture = Capture(self._next_id, route, method, seconds,
+                              profile.stats)
+            self._next_id += 1
+            self._captures[capture.id] = capture
+            while len(self._captures) > self.keep:
+                self._captures.popitem(last=False)
+        return capture
+
+    def get(self, capture_id):
+        with self._lock:
+            return self._captures.get(capture_id)
+
+    def captures(self):
+        with self._lock:
+            return list(self._captures.values())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from models import TravelRoute
+from addresses import normalize_text
+
+# Cache settings, overridable from the environment
+ROUTE_CACHE_TTL = int(os.environ.get('ROUTE_CACHE_TTL', 6 * 60 * 60))
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 1024))
+ROUTE_CACHE_PERSIST = os.environ.get('ROUTE_CACHE_PERSIST', '1') == '1'
+
+
+def normalize_destination(destination):
+    """ Returns the cache key for a destination string
+        Keyed on the same normalized form as saved addresses, so case,
+        punctuation, line breaks and spelled-out street words are ignored
+    """
+    return normalize_text(destination)
+
+
+class RouteCache(object):
+    """ Caches (duration, distance) pairs for delivery destinations
+
+        Entries are kept in a bounded in-memory LRU and, when an engine is
+        given, in the travel_route table so they survive restarts.
+    """
+
+    def __init__(self, ttl=ROUTE_CACHE_TTL, max_entries=ROUTE_CACHE_SIZE,
+                 engine=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, destination, fetch):
+        """ Returns (duration, distance) for the destination
+            fetch(destination) is only called on a cache miss
+        """
+        route = self.peek(destination)
+        if route is not None:
+            return route
+        with self._lock:
+            self.misses += 1
+        route = tuple(fetch(destination))
+        self.put(destination, route)
+        return route
+
+    def peek(self, destination):
+        """ Returns the cached (duration, distance) or None, never fetching"""
+        key = normalize_destination(destination)
+        now = time.time()
+        route = self._get_memory(key, now)
+        if route is None:
+            route = self._get_stored(key, now)
+            if route is not None:
+                self._put_memory(key, route, now)
+        if route is not None:
+            with self._lock:
+                self.hits += 1
+        return route
+
+    def put(self, destination, route):
+        """ Store a (duration, distance) pair for the destination"""
+        key = normalize_destination(destination)
+        now = time.time()
+        route = tuple(route)
+        self._put_memory(key, route, now)
+        self._put_stored(key, route, now)
+
+    def invalidate(self, destination=None):
+        """ Drop one destination, or every entry when none is given"""
+        with self._lock:
+            if destination is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(normalize_destination(destination), None)
+
+    @property
+    def stats(self):
+        """ Returns hit/miss counters and the current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+            }
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            route, expires_at = entry
+            if expires_at <= now:
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            return route
+
+    def _put_memory(self, key, route, now):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (route, now + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_stored(self, key, now):
+        if self.engine is None:
+            return None
+        table = TravelRoute.__table__
+        with self.engine.connect() as conn:
+            row = conn.execute(table.select().where(
+                table.c.destination_key == key)).first()
+        if row is None or row.expires_at <= now:
+            return None
+        return (row.duration, row.distance)
+
+    def _put_stored(self, key, route, now):
+        if self.engine is None:
+            return
+        table = TravelRoute.__table__
+        values = {'duration': route[0], 'distance': route[1],
+                  'expires_at': int(now + self.ttl)}
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(table.update().where(
+                    table.c.destination_key == key).values(**values))
+                if not updated.rowcount:
+                    conn.execute(table.insert().values(destination_key=key,
+                                                       **values))
+        except IntegrityError:
+            # Another worker stored the same destination first
+            pass
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+# The app is written for Python 2, under Python 3 its standard library
+# imports live under their new names
+if sys.version_info[0] >= 3:
+    import http.client
+    import queue
+    sys.modules.setdefault('httplib', http.client)
+    sys.modules.setdefault('Queue', queue)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+WORKDIR = tempfile.mkdtemp(prefix='cantina-tests-')
+
+# The app reads its settings at import, so they are set before any test
+# module imports it
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(WORKDIR, 'app.db'),
+    'GMAPS_API_KEY': 'test',
+    # Nothing listens here, so Maps lookups fail straight away
+    'MAPS_API_HOST': '127.0.0.1:9',
+    'MAPS_API_SCHEME': 'http',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    # Registers the profiling hooks, they do nothing until armed
+    'PROFILER_ENABLED': '1',
+})
+
+PASSWORD = 'secret'
+# Inside the delivery radius by the ZIP index alone
+ADDRESS = {'street_1': '1 Main St', 'street_2': '', 'city': 'Naples',
+           'state': 'FL', 'zip_code': '34109'}
+MENU = [('Chips and Salsa', 'Appetizer', '5.00'),
+        ('Carne Asada', 'Entree', '11.75'),
+        ('Flan', 'Dessert', '3.50')]
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import application
+    application.app.config['TESTING'] = True
+    application.app.config['WTF_CSRF_ENABLED'] = False
+    return application
+
+
+@pytest.fixture(autouse=True)
+def clean_db(app):
+    """ Every test starts from empty tables and cold caches"""
+    from models import AnalyticsVersion, Base, MenuVersion
+    # The rollups stay built, they are emptied along with the orders
+    kept = (AnalyticsVersion.__tablename__, MenuVersion.__tablename__)
+    yield
+    session = app.DBSession()
+    session.rollback()
+    for table in reversed(Base.metadata.sorted_tables):
+        if table.name not in kept:
+            session.execute(table.delete())
+    # Moving the stamp on, rather than resetting it, drops cached menus
+    app.menu_cache.bump(session)
+    session.commit()
+    app.kitchen_load.seed(session)
+    app.DBSession.remove()
+    app.identity_cache.invalidate()
+    app.route_cache.invalidate()
+    with app.cart_store._lock:
+        app.cart_store._carts.clear()
+        app.cart_store._dirty.clear()
+
+
+# Schema level tests run on each backend the app supports. PostgreSQL needs
+# an empty database to run against, e.g.
+# TEST_POSTGRES_URL=postgresql://localhost/cantina_test
+BACKENDS = ['sqlite', 'postgresql']
+
+
+@pytest.fixture(params=BACKENDS)
+def db_engine(request, app, tmpdir):
+    """ A separate, freshly upgraded database for schema level tests"""
+    import analytics
+    import migrations
+    from sqlalchemy.orm import close_all_sessions, sessionmaker
+    from database import make_engine
+    from models import Base
+    if request.param == 'sqlite':
+        url = 'sqlite:///' + str(tmpdir.join('backend.db'))
+    else:
+        url = os.environ.get('TEST_POSTGRES_URL')
+        if not url:
+            pytest.skip('TEST_POSTGRES_URL is not set')
+        pytest.importorskip('psycopg2')
+    engine = make_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    session = sessionmaker(bind=engine)()
+    analytics.rebuild(session)
+    session.close()
+    yield engine
+    # A failed test can leave a session holding locks the drop waits on
+    close_all_sessions()
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def backend_app(app, db_engine):
+    """ The app serving requests from the db_engine database"""
+    def bind(engine):
+        app.DBSession.remove()
+        app.DBSession.configure(bind=engine)
+        app.menu_cache.invalidate()
+        app.identity_cache.invalidate()
+        app.kitchen_load.seed(app.DBSession())
+        app.DBSession.remove()
+    bind(db_engine)
+    yield app
+    bind(app.engine)
+
+
+@pytest.fixture
+def session(app):
+    # Requests made by the test client share this thread's session and
+    # remove it when they finish, so it is closed here as well
+    session = app.DBSession()
+    yield session
+    session.close()
+    app.DBSession.remove()
+
+
+@pytest.fixture
+def menu(app, session):
+    """ Returns the ids of a small menu"""
+    from models import MenuItem
+    from pricing import to_cents
+    items = [MenuItem(name=name, course=course, description='', price=price,
+                      price_cents=to_cents(price))
+             for name, course, price in MENU]
+    session.add_all(items)
+    app.menu_cache.bump(session)
+    session.flush()
+    ids = [i.id for i in items]
+    session.commit()
+    return ids
+
+
+def add_user(app, session, email, admin=False, address=ADDRESS,
+             known_route=True):
+    """ Create a user with a saved address and return their id"""
+    from addresses import address_key
+    from models import Address, User
+    user = User(name=email.split('@')[0], email=email, admin=int(admin))
+    user.set_password(PASSWORD)
+    if address is not None:
+        key = address_key(*[address[f] for f in app.ADDRESS_FIELDS])
+        user.address = (session.query(Address).filter_by(
+            address_key=key).first() or Address(address_key=key, **address))
+    if address is not None and known_route:
+        # Tests never wait on Maps unless they mean to
+        app.route_cache.put(app.get_address_string(user.address),
+                            (900, 8000))
+    session.add(user)
+    session.flush()
+    user_id = user.id
+    session.commit()
+    return user_id
+
+
+def sign_in(client, email):
+    response = client.post('/login', data={'email': email,
+                                           'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def customer(app, session):
+    """ Returns a signed-in test client and its user id"""
+    user_id = add_user(app, session, 'customer@example.com')
+    return sign_in(app.app.test_client(), 'customer@example.com'), user_id
+
+
+@pytest.fixture
+def admin(app, session):
+    add_user(app, session, 'admin@example.com', admin=True)
+    return sign_in(app.app.test_client(), 'admin@example.com')
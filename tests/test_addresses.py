@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+import migrations
+from addresses import address_key
+from models import Address, User
+from tests.conftest import ADDRESS, add_user
+
+# ADDRESS as another customer types it
+RETYPED = {'street_1': '1 main street.', 'street_2': '', 'city': 'NAPLES',
+           'state': 'Florida', 'zip_code': '34109'}
+
+
+def test_equivalent_address_reuses_the_row(app, session, customer):
+    client, user_id = customer
+    address_id = session.query(User.address_id).filter_by(
+        id=user_id).scalar()
+    response = client.post('/cart/update_address', data=RETYPED)
+    assert response.status_code == 302
+    session = app.DBSession()
+    assert session.query(Address).count() == 1
+    assert session.query(User.address_id).filter_by(
+        id=user_id).scalar() == address_id
+    assert app.save_address(dict(ADDRESS, street_1='1 Main St.')) == \
+        address_id
+
+
+def test_address_saved_meanwhile_is_read_back(app, session):
+    key = address_key(*[RETYPED[f] for f in app.ADDRESS_FIELDS])
+
+    def save_first(flushing, flush_context, instances):
+        # Another request commits the same address between the lookup
+        # and the insert
+        with app.engine.begin() as conn:
+            conn.execute(Address.__table__.insert().values(
+                address_key=key, **ADDRESS))
+    request_session = app.DBSession()
+    event.listen(request_session, 'before_flush', save_first, once=True)
+    address_id = app.save_address(RETYPED)
+    app.DBSession.remove()
+    session = app.DBSession()
+    address = session.query(Address).one()
+    assert (address.id, address.street_1) == (address_id, '1 Main St')
+
+
+def test_upgrade_merges_duplicate_addresses(app, db_engine):
+    session = sessionmaker(bind=db_engine)()
+    # Saved before addresses had keys, plus one saved since
+    keyed = Address(address_key=address_key(
+        *[RETYPED[f] for f in app.ADDRESS_FIELDS]), **RETYPED)
+    rows = [Address(**ADDRESS),
+            Address(**dict(ADDRESS, street_1='1 Main St.')),
+            Address(**dict(ADDRESS, street_1='9 Bay Rd')), keyed]
+    session.add_all(rows)
+    session.flush()
+    users = [User(name='user%d' % n, email='user%d@example.com' % n,
+                  address_id=address.id) for n, address in enumerate(rows)]
+    session.add_all(users)
+    session.commit()
+    user_ids = [u.id for u in users]
+    keyed_id = keyed.id
+    migrations.upgrade(db_engine)
+    session.close()
+    session = sessionmaker(bind=db_engine)()
+    assert session.query(Address).count() == 2
+    assert session.query(Address).filter(
+        Address.address_key.is_(None)).count() == 0
+    address_ids = [session.query(User.address_id).filter_by(
+        id=user_id).scalar() for user_id in user_ids]
+    # Everyone at 1 Main St shares the row that already had its key
+    assert address_ids[0] == address_ids[1] == address_ids[3] == keyed_id
+    assert address_ids[2] != keyed_id
+    session.close()
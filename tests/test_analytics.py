@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import json
+import analytics
+from models import AnalyticsVersion, HourlyCount, ItemCount, Order, OrderItem
+from models import TimeOfDayCount
+from tests.conftest import add_user, sign_in
+
+
+def forget_rollups(session):
+    """ Make the database look like one from before the rollups existed"""
+    for model in (AnalyticsVersion, ItemCount, TimeOfDayCount, HourlyCount):
+        session.query(model).delete()
+    session.commit()
+
+
+def add_order(session, user_id, menu_item_id):
+    order_time = datetime.datetime(2019, 5, 17, 18, 30)
+    order = Order(user_id=user_id, order_time=order_time,
+                  delivery_time=order_time + datetime.timedelta(minutes=40))
+    session.add(order)
+    session.flush()
+    session.add(OrderItem(order_id=order.id, menu_item_id=menu_item_id,
+                          quantity=2))
+    session.commit()
+
+
+def record_orders(session, menu):
+    """ Rollups of four orders over two weeks, starting on a Friday"""
+    for when, items in (('2019-05-17 18:30', [menu[0], menu[1]]),
+                        ('2019-05-18 18:10', [menu[0]]),
+                        ('2019-05-19 12:00', [menu[0]]),
+                        ('2019-05-20 18:45', [menu[1]])):
+        analytics.record_order(session, datetime.datetime.strptime(
+            when, '%Y-%m-%d %H:%M'), items, '34109')
+    session.commit()
+
+
+def counts(client, query):
+    response = client.get('/admin/analytics/JSON?start=2019-05-13&'
+                          'end=2019-05-27&' + query)
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def db_upgrade(app):
+    result = app.app.test_cli_runner().invoke(args=['db-upgrade'])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_db_upgrade_builds_missing_rollups(app, session, menu):
+    user_id = add_user(app, session, 'history@example.com')
+    forget_rollups(session)
+    add_order(session, user_id, menu[0])
+    assert app.analytics.needs_rebuild(session)
+
+    assert 'Analytics rollups built' in db_upgrade(app)
+    session = app.DBSession()
+    assert session.query(TimeOfDayCount.quantity).filter_by(
+        time_of_day=18).scalar() == 1
+    assert session.query(ItemCount.quantity).filter_by(
+        menu_item_id=menu[0]).scalar() == 1
+    assert session.query(HourlyCount).count() == 3
+    assert not app.analytics.needs_rebuild(session)
+    # Built once, later upgrades leave the rollups alone
+    assert 'Analytics rollups built' not in db_upgrade(app)
+
+
+def test_order_placed_before_the_upgrade_is_counted_once(app, session,
+                                                         menu):
+    user_id = add_user(app, session, 'early@example.com')
+    forget_rollups(session)
+    add_order(session, user_id, menu[0])
+    # A customer orders before anyone has run db-upgrade
+    client = sign_in(app.app.test_client(), 'early@example.com')
+    client.get('/cart/add/%d' % menu[1])
+    assert client.get('/cart/order_placed').status_code == 200
+    session = app.DBSession()
+    assert session.query(ItemCount).count() == 0
+    assert app.analytics.needs_rebuild(session)
+    session.close()
+
+    assert 'Analytics rollups built' in db_upgrade(app)
+    session = app.DBSession()
+    assert sorted(session.query(ItemCount.menu_item_id,
+                                ItemCount.quantity)) == [(menu[0], 1),
+                                                         (menu[1], 1)]
+    assert sum(q for (q,) in session.query(HourlyCount.quantity).filter_by(
+        dimension='order')) == 2
+
+
+def test_analytics_by_week(app, session, menu, admin):
+    record_orders(session, menu)
+    result = counts(admin, 'bucket=week&dimension=item&limit=2')
+    assert [(r['bucket'], r['key'], r['name'], r['quantity'])
+            for r in result['rows']] == [
+        ('2019-05-13T00:00:00', menu[0], 'Chips and Salsa', 3),
+        ('2019-05-13T00:00:00', menu[1], 'Carne Asada', 1)]
+    assert (result['total'], result['next_offset']) == (3, 2)
+    result = counts(admin, 'bucket=week&dimension=item&limit=2&offset=2')
+    assert [(r['bucket'], r['key']) for r in result['rows']] == [
+        ('2019-05-20T00:00:00', menu[1])]
+    assert result['next_offset'] is None
+    result = counts(admin, 'bucket=day&dimension=zip')
+    assert [(r['bucket'], r['key'], r['quantity'])
+            for r in result['rows']][:2] == [
+        ('2019-05-17T00:00:00', '34109', 1),
+        ('2019-05-18T00:00:00', '34109', 1)]
+
+
+def test_analytics_by_hour_and_weekday(app, session, menu, admin):
+    record_orders(session, menu)
+    result = counts(admin, 'bucket=week&dimension=hour')
+    assert [(r['bucket'], r['key'], r['quantity'])
+            for r in result['rows']] == [
+        ('2019-05-13T00:00:00', 18, 2), ('2019-05-13T00:00:00', 12, 1),
+        ('2019-05-20T00:00:00', 18, 1)]
+    result = counts(admin, 'bucket=week&dimension=weekday')
+    assert [(r['bucket'], r['key'], r['quantity'])
+            for r in result['rows']] == [
+        ('2019-05-13T00:00:00', 'Sunday', 1),
+        ('2019-05-13T00:00:00', 'Friday', 1),
+        ('2019-05-13T00:00:00', 'Saturday', 1),
+        ('2019-05-20T00:00:00', 'Monday', 1)]
+    result = counts(admin, 'bucket=hour&dimension=hour')
+    assert result['rows'][0] == {'bucket': '2019-05-17T18:00:00', 'key': 18,
+                                 'quantity': 1}
+
+
+def test_analytics_bad_requests(app, session, customer, admin):
+    client, user_id = customer
+    assert client.get('/admin/analytics/JSON').status_code == 403
+    for query in ('bucket=month', 'dimension=color', 'start=June',
+                  'end=2019-13-01', 'limit=ten', 'offset=x',
+                  'start=2018-01-01&end=2019-06-01'):
+        response = admin.get('/admin/analytics/JSON?' + query)
+        assert response.status_code == 400, query
+        assert json.loads(response.get_data(as_text=True))['error']
+    assert admin.get('/admin/analytics/JSON').status_code == 200
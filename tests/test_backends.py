@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+import analytics
+import migrations
+from models import AnalyticsVersion, HourlyCount, ItemCount, MenuItem
+from models import DAY_NAMES
+from models import Order, User
+from tests.conftest import add_user
+from tests.test_checkout import fill_carts, run_together
+
+ORDER_TIME = datetime.datetime(2019, 5, 17, 18, 30)
+
+
+def test_recorded_rollups_match_a_rebuild(app, db_engine):
+    session = sessionmaker(bind=db_engine)()
+    for n, user_id in enumerate(fill_carts(session, 3)):
+        order_time = ORDER_TIME + datetime.timedelta(hours=n)
+        # The users have no address for a rebuild to find a ZIP code in
+        assert app.create_order(session, user_id, order_time, order_time,
+                                None)
+        session.commit()
+
+    def counts():
+        return (sorted((r.menu_item_id, r.quantity)
+                       for r in session.query(ItemCount)),
+                sorted((r.dimension, r.hour, r.bucket_key, r.quantity)
+                       for r in session.query(HourlyCount)))
+    recorded = counts()
+    analytics.rebuild(session)
+    assert counts() == recorded
+    result = analytics.query(session, ORDER_TIME.replace(hour=0),
+                             ORDER_TIME.replace(hour=23), 'day', 'item')
+    assert [row['quantity'] for row in result['rows']] == [3, 3]
+    session.close()
+
+
+def test_query_groups_like_python(app, db_engine):
+    session = sessionmaker(bind=db_engine)()
+    for n in range(40):
+        # Every few hours over two weeks and a bit
+        order_time = ORDER_TIME + datetime.timedelta(hours=n * 9, minutes=n)
+        analytics.record_order(session, order_time, [n % 3 + 1, 7],
+                               '3410%d' % (n % 4))
+    session.commit()
+    start = ORDER_TIME.replace(hour=0)
+    end = start + datetime.timedelta(days=20)
+    for bucket in analytics.BUCKETS:
+        for dimension, source in analytics.DIMENSIONS.items():
+            expected = {}
+            for row in session.query(HourlyCount).filter_by(
+                    dimension=source):
+                key = row.bucket_key
+                if dimension == 'item':
+                    key = int(key)
+                elif dimension == 'hour':
+                    key = row.hour.hour
+                elif dimension == 'weekday':
+                    key = DAY_NAMES[analytics.day_number(row.hour)]
+                group = (analytics.bucket_start(row.hour, bucket).isoformat(),
+                         key)
+                expected[group] = expected.get(group, 0) + row.quantity
+            result = analytics.query(session, start, end, bucket, dimension,
+                                     limit=1000)
+            assert result['total'] == len(expected)
+            assert dict(((r['bucket'], r['key']), r['quantity'])
+                        for r in result['rows']) == expected
+    session.close()
+
+
+def test_simultaneous_first_increments(db_engine):
+    Session = sessionmaker(bind=db_engine)
+    hour = analytics.start_of_hour(ORDER_TIME)
+
+    def increment():
+        session = Session()
+        try:
+            # Every thread finds the row missing and tries to add it
+            analytics.increment(session, HourlyCount, dimension='order',
+                                hour=hour, bucket_key='')
+            session.commit()
+        finally:
+            session.close()
+    assert run_together([increment] * 8) == []
+    session = Session()
+    assert session.query(HourlyCount.quantity).scalar() == 8
+    session.close()
+
+
+def test_copy_database(app, session, menu, db_engine):
+    add_user(app, session, 'moving@example.com')
+    # The copy goes into an empty database
+    db_engine.execute(AnalyticsVersion.__table__.delete())
+    counts = migrations.copy_database(app.engine, db_engine)
+    assert counts['menu_item'] == len(menu)
+    assert counts['user'] == 1
+    target = sessionmaker(bind=db_engine)()
+    assert sorted(i.name for i in target.query(MenuItem)) == sorted(
+        i.name for i in session.query(MenuItem))
+    # New rows are numbered after the copied ones
+    target.add(User(name='new', email='new@example.com'))
+    target.flush()
+    assert target.query(func.max(User.id)).scalar() > \
+        session.query(func.max(User.id)).scalar()
+    assert target.query(Order).count() == 0
+    target.close()
+
+
+def test_checkout_requests(backend_app, session, menu, customer):
+    app = backend_app
+    client, user_id = customer
+    # Orders already in the database are read back for the prep time
+    now = datetime.datetime.now()
+    session.add(Order(user_id=user_id, order_time=now,
+                      delivery_time=now + datetime.timedelta(hours=1)))
+    session.commit()
+    app.kitchen_load.seed(session)
+    assert app.kitchen_load.in_flight() == 1
+    client.get('/cart/add/%d' % menu[1])
+    response = client.get('/cart')
+    assert response.status_code == 200
+    assert b'Carne Asada' in response.data
+    assert client.get('/cart/order_placed').status_code == 200
+    session = app.DBSession()
+    assert session.query(Order).filter_by(user_id=user_id).count() == 2
+    assert app.kitchen_load.in_flight() == 2
+    app.kitchen_load.seed(session)
+    assert app.kitchen_load.in_flight() == 2
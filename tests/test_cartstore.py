@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import threading
+import pytest
+from cartstore import CartStore
+from models import Cart
+from tests.conftest import add_user
+
+# Long enough that the background flusher never runs during a test
+INTERVAL = 3600
+
+
+class FailingQueue(object):
+    """ A write queue whose first writes fail, like a database outage"""
+
+    def __init__(self, write_queue, failures=1):
+        self.write_queue = write_queue
+        self.failures = failures
+
+    def run(self, work):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('database unavailable')
+        return self.write_queue.run(work)
+
+
+def write_behind(app, write_queue=None):
+    return CartStore(app.DBSession, write_queue or app.write_queue,
+                     enabled=True, flush_interval=INTERVAL)
+
+
+def crash(store):
+    """ Lose what was never written, as a killed process would"""
+    with store._lock:
+        store._dirty.clear()
+
+
+def table_cart(app, user_id):
+    session = app.DBSession()
+    try:
+        return dict(session.query(Cart.menu_item_id, Cart.quantity).filter_by(
+            user_id=user_id))
+    finally:
+        session.close()
+
+
+def test_write_behind_is_off_by_default(app):
+    assert not CartStore(app.DBSession, app.write_queue).enabled
+
+
+def test_flushed_changes_survive_a_restart(app, session, menu):
+    user_id = add_user(app, session, 'restart@example.com')
+    store = write_behind(app)
+    store.add(user_id, menu[0])
+    store.add(user_id, menu[0])
+    store.add(user_id, menu[1])
+    store.flush()
+    crash(store)
+    assert write_behind(app).items(user_id) == {menu[0]: 2, menu[1]: 1}
+
+
+def test_crash_loses_only_unflushed_changes(app, session, menu):
+    user_id = add_user(app, session, 'crash@example.com')
+    store = write_behind(app)
+    store.add(user_id, menu[0])
+    store.flush()
+    store.add(user_id, menu[1])
+    store.remove(user_id, menu[0])
+    crash(store)
+    assert write_behind(app).items(user_id) == {menu[0]: 1}
+
+
+def test_failed_flush_is_retried(app, session, menu):
+    user_id = add_user(app, session, 'outage@example.com')
+    store = write_behind(app, FailingQueue(app.write_queue))
+    store.add(user_id, menu[0])
+    with pytest.raises(IOError):
+        store.flush()
+    assert table_cart(app, user_id) == {}
+    # A change made while the database was down wins over the failed one
+    store.add(user_id, menu[0])
+    store.flush()
+    assert table_cart(app, user_id) == {menu[0]: 2}
+
+
+def test_flush_for_one_user(app, session, menu):
+    first = add_user(app, session, 'first@example.com')
+    second = add_user(app, session, 'second@example.com')
+    store = write_behind(app)
+    store.add(first, menu[0])
+    store.add(second, menu[1])
+    store.flush(first)
+    assert table_cart(app, first) == {menu[0]: 1}
+    assert table_cart(app, second) == {}
+    # At exit everything left is written
+    store.flush()
+    assert table_cart(app, second) == {menu[1]: 1}
+
+
+def test_checkout_flushes_the_cart(app, session, menu, customer,
+                                   monkeypatch):
+    client, user_id = customer
+    monkeypatch.setattr(app.cart_store, 'enabled', True)
+    client.get('/cart/add/%d' % menu[1])
+    response = client.get('/cart/order_placed')
+    assert response.status_code == 200
+    assert b'Carne Asada' in response.data
+    assert table_cart(app, user_id) == {}
+
+
+def test_worker_does_not_restore_ordered_items(app, session, menu):
+    user_id = add_user(app, session, 'workers@example.com')
+    first, second = (CartStore(app.DBSession, app.write_queue)
+                     for _ in range(2))
+    first.add(user_id, menu[0])
+    assert second.items(user_id) == {menu[0]: 1}
+    # The first worker places the order, then the second takes the next
+    # request from the same customer
+    order_time = datetime.datetime(2019, 5, 17, 18, 30)
+    assert app.create_order(session, user_id, order_time, order_time,
+                            '34109')
+    session.commit()
+    second.add(user_id, menu[1])
+    assert second.items(user_id) == {menu[1]: 1}
+    assert table_cart(app, user_id) == {menu[1]: 1}
+
+
+def test_write_through_skips_the_lock(app, session, menu):
+    user_id = add_user(app, session, 'through@example.com')
+    store = CartStore(app.DBSession, app.write_queue)
+    results = []
+
+    def shop():
+        store.add(user_id, menu[0])
+        store.add(user_id, menu[0])
+        results.append(store.set_quantity(user_id, menu[1], 3))
+        store.add(user_id, menu[1])
+        results.append(store.set_quantity(user_id, menu[1], 3))
+        results.append(store.remove(user_id, menu[0]))
+        results.append(store.items(user_id))
+        app.DBSession.remove()
+    # Another request holds the lock the whole time
+    with store._lock:
+        thread = threading.Thread(target=shop)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+    assert results == [False, True, True, {menu[1]: 3}]
+    assert table_cart(app, user_id) == {menu[1]: 3}
+    assert not store._carts
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import threading
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+from models import Cart, HourlyCount, ItemCount, MenuItem, Order, OrderItem
+from models import User
+from tests.conftest import add_user, sign_in
+
+CUSTOMERS = 12
+# Simultaneous checkouts of one cart, as from a double click
+DUPLICATES = 6
+
+
+def run_together(targets):
+    """ Start every target at once and return the exceptions raised"""
+    # Python 2 has no Barrier, so every thread waits on one start signal
+    start = threading.Event()
+    errors = []
+
+    def run(target):
+        start.wait()
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join(60)
+    return errors
+
+
+def fill_carts(session, count):
+    """ Returns the ids of count users who each have two items in their cart
+    """
+    items = [MenuItem(name='Item %d' % n, course='Entree', price='4.00',
+                      price_cents=400) for n in range(2)]
+    users = [User(name='user%d' % n, email='user%d@example.com' % n)
+             for n in range(count)]
+    session.add_all(items + users)
+    session.flush()
+    for user in users:
+        session.add_all([Cart(user_id=user.id, menu_item_id=item.id,
+                              quantity=1) for item in items])
+    user_ids = [u.id for u in users]
+    session.commit()
+    return user_ids
+
+
+def test_simultaneous_checkouts(app, db_engine):
+    Session = sessionmaker(bind=db_engine)
+    session = Session()
+    user_ids = fill_carts(session, CUSTOMERS)
+    order_time = datetime.datetime(2019, 5, 17, 18, 30)
+    placed = []
+
+    def checkout(user_id):
+        session = Session()
+        try:
+            items = app.create_order(
+                session, user_id, order_time,
+                order_time + datetime.timedelta(minutes=40), '34109')
+            if items is None:
+                session.rollback()
+            else:
+                session.commit()
+                placed.append(user_id)
+        finally:
+            session.close()
+    # Every customer checks out at once, and the first one six times over
+    targets = [lambda u=u: checkout(u) for u in user_ids]
+    targets += [lambda: checkout(user_ids[0])] * (DUPLICATES - 1)
+    assert run_together(targets) == []
+
+    assert sorted(placed) == sorted(user_ids)
+    assert session.query(Order).count() == CUSTOMERS
+    assert session.query(OrderItem).count() == CUSTOMERS * 2
+    assert session.query(Cart).count() == 0
+    # The rollups count each order once
+    assert session.query(func.sum(ItemCount.quantity)).scalar() == \
+        CUSTOMERS * 2
+    assert session.query(HourlyCount.quantity).filter_by(
+        dimension='order').scalar() == CUSTOMERS
+    session.close()
+
+
+def test_simultaneous_checkout_requests(app, session, menu):
+    clients = []
+    for n in range(CUSTOMERS):
+        add_user(app, session, 'rush%d@example.com' % n)
+        client = sign_in(app.app.test_client(), 'rush%d@example.com' % n)
+        client.get('/cart/add/%d' % menu[n % len(menu)])
+        clients.append(client)
+    responses = []
+
+    def checkout(client):
+        responses.append(client.get('/cart/order_placed'))
+    assert run_together([lambda c=c: checkout(c) for c in clients]) == []
+    assert [r.status_code for r in responses] == [200] * CUSTOMERS
+    assert all(b'Total' in r.data for r in responses)
+    session = app.DBSession()
+    assert session.query(Order).count() == CUSTOMERS
+    assert session.query(Cart).count() == 0
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import io
+import json
+from menuimport import read_csv
+from models import MenuItem, Order, OrderItem
+from tests.conftest import add_user
+
+NAME = u'Jalape\xf1o Poppers'
+
+
+def place_orders(session, user_id, count):
+    """ Returns the ids of count orders, a day apart, of the poppers"""
+    item = MenuItem(name=NAME, course='Appetizer', description='',
+                    price='6.50', price_cents=650)
+    session.add(item)
+    orders = [Order(user_id=user_id,
+                    order_time=datetime.datetime(2019, 6, 1 + n, 18, 30))
+              for n in range(count)]
+    session.add_all(orders)
+    session.flush()
+    session.add_all([OrderItem(order_id=o.id, menu_item_id=item.id,
+                               quantity=2) for o in orders])
+    ids = [o.id for o in orders]
+    session.commit()
+    return ids
+
+
+def test_export_csv_and_ndjson(app, session, admin):
+    user_id = add_user(app, session, 'hungry@example.com')
+    order_ids = place_orders(session, user_id, 3)
+    response = admin.get('/admin/export/orders.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = read_csv(response.get_data(as_text=True))
+    assert [int(r['order_id']) for r in rows] == order_ids
+    assert rows[0]['name'] == NAME
+    assert rows[0]['price_cents'] == '650'
+    assert rows[0]['order_time'] == '2019-06-01T18:30:00'
+
+    response = admin.get('/admin/export/orders.ndjson?since_id=%d'
+                         % order_ids[0])
+    rows = [json.loads(line) for line
+            in response.get_data(as_text=True).splitlines()]
+    assert [r['order_id'] for r in rows] == order_ids[1:]
+    assert rows[0]['name'] == NAME
+
+
+def test_export_filters(app, session, admin):
+    user_id = add_user(app, session, 'filters@example.com')
+    order_ids = place_orders(session, user_id, 3)
+    response = admin.get('/admin/export/orders.ndjson?since=2019-06-02')
+    assert [json.loads(line)['order_id'] for line
+            in response.get_data(as_text=True).splitlines()] == order_ids[1:]
+    assert admin.get('/admin/export/orders.csv?since=June').status_code == 400
+    assert admin.get('/admin/export/orders.xml').status_code == 404
+
+
+def test_export_is_admin_only(app, customer):
+    client, user_id = customer
+    assert client.get('/admin/export/orders.csv').status_code == 403
+
+
+def test_export_command(app, session, tmpdir):
+    user_id = add_user(app, session, 'cli@example.com')
+    order_ids = place_orders(session, user_id, 2)
+    path = str(tmpdir.join('orders.csv'))
+    result = app.app.test_cli_runner().invoke(args=[
+        'export-orders', '--since', '2019-06-02', '--output', path])
+    assert result.exit_code == 0, result.output
+    with io.open(path, encoding='utf-8', newline='') as f:
+        rows = read_csv(f.read())
+    assert [int(r['order_id']) for r in rows] == order_ids[1:]
+    assert rows[0]['name'] == NAME
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+from models import MenuItem
+
+
+def page(client):
+    return client.get('/menu').get_data(as_text=True)
+
+
+def test_public_and_admin_cards_stay_separate(app, session, menu, customer,
+                                              admin):
+    client, user_id = customer
+    public = page(client)
+    admin_page = page(admin)
+    assert '/cart/add/%d' % menu[0] in public
+    assert '/admin/edit/%d' % menu[0] not in public
+    assert '/admin/edit/%d' % menu[0] in admin_page
+    assert '/cart/add/%d' % menu[0] not in admin_page
+    # Served from the fragment cache the second time round
+    assert ('card', False, menu[0]) in app.menu_cache.get(session).fragments
+    assert '/admin/edit/%d' % menu[0] not in page(client)
+    assert '/admin/edit/%d' % menu[0] not in page(app.app.test_client())
+    assert '/cart/add/%d' % menu[0] not in page(admin)
+
+
+def test_admin_edit_refreshes_cards(app, session, menu, customer, admin):
+    client, user_id = customer
+    assert 'Chips and Salsa' in page(client)
+    assert 'Chips and Salsa' in page(admin)
+    admin.post('/admin/edit/%d' % menu[0], data={
+        'name': 'Totopos', 'course': 'Appetizer', 'description': '',
+        'price': '5.50'})
+    for html in (page(client), page(admin)):
+        assert 'Totopos' in html
+        assert '5.50' in html
+        assert 'Chips and Salsa' not in html
+
+
+def test_flash_messages_render_per_request(app, session, menu, customer):
+    client, user_id = customer
+    page(client)
+    client.get('/cart/add/%d' % menu[1])
+    assert 'Carne Asada added to order!' in page(client)
+    assert 'added to order!' not in page(client)
+
+
+def test_cards_are_escaped(app, session, menu, customer):
+    client, user_id = customer
+    session.query(MenuItem).filter_by(id=menu[0]).update(
+        {MenuItem.description: '<script>alert(1)</script>'})
+    app.menu_cache.bump(session)
+    session.commit()
+    html = page(client)
+    assert '<script>alert(1)</script>' not in html
+    assert '&lt;script&gt;' in html
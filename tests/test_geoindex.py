@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+from geoindex import DeliveryArea, BORDERLINE, INSIDE, OUTSIDE
+
+MAX_DISTANCE = 32187
+
+
+def test_restaurant_zip_is_never_turned_away():
+    area = DeliveryArea(MAX_DISTANCE)
+    assert area.classify(zip_code='34105') != OUTSIDE
+
+
+def test_zip_just_past_the_radius_is_routed():
+    # Centroid 40 km out, 2 km radius: outside by the listed values, but
+    # within the margin for centroid error
+    area = DeliveryArea(MAX_DISTANCE, path=None, outside_margin=16000)
+    area.zip_codes.append(99999)
+    area.latitudes.append(area.origin[0] + 0.36)
+    area.longitudes.append(area.origin[1])
+    area.radii.append(2000)
+    assert area.classify(zip_code='99999') == BORDERLINE
+    area.outside_margin = 0
+    assert area.classify(zip_code='99999') == OUTSIDE
+
+
+def test_routed_geocode_is_trusted():
+    area = DeliveryArea(MAX_DISTANCE, path=None)
+    area.remember('1 Far Rd', area.origin[0] + 0.36, area.origin[1])
+    assert area.classify('1 Far Rd') == OUTSIDE
+    area.remember('1 Near Rd', area.origin[0] + 0.01, area.origin[1])
+    assert area.classify('1 Near Rd') == INSIDE
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import gzip
+import io
+import json
+import httpcache
+from models import MenuItem
+
+
+def test_if_none_match_gets_304(app, session, menu):
+    client = app.app.test_client()
+    response = client.get('/menu/JSON')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('"') and not etag.startswith('W/')
+    assert response.headers['Cache-Control'] == httpcache.JSON_CACHE_CONTROL
+    assert 'Accept-Encoding' in response.headers['Vary']
+    response = client.get('/menu/JSON', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    # The same for a single item
+    etag = client.get('/menu/%d/JSON' % menu[0]).headers['ETag']
+    response = client.get('/menu/%d/JSON' % menu[0],
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_gzip_variant(app, session, menu, monkeypatch):
+    monkeypatch.setattr(httpcache, 'GZIP_MIN_SIZE', 0)
+    client = app.app.test_client()
+    plain = client.get('/menu/JSON')
+    response = client.get('/menu/JSON', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gz"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.GzipFile(fileobj=io.BytesIO(response.data)).read() == \
+        plain.data
+    response = client.get('/menu/JSON', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    # Small bodies are sent as they are
+    monkeypatch.setattr(httpcache, 'GZIP_MIN_SIZE', 1 << 20)
+    response = client.get('/menu/JSON', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_menu_change_gets_a_new_etag(app, session, menu):
+    client = app.app.test_client()
+    etag = client.get('/menu/JSON').headers['ETag']
+    session.query(MenuItem).filter_by(id=menu[0]).update(
+        {MenuItem.price: '5.25', MenuItem.price_cents: 525})
+    app.menu_cache.bump(session)
+    session.commit()
+    response = client.get('/menu/JSON', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    prices = [i['price'] for i in json.loads(
+        response.get_data(as_text=True))['MenuItems']]
+    assert '5.25' in prices
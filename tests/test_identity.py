@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import identity
+from identity import IdentityCache
+from models import Address
+
+
+class Clock(object):
+    """ Stands in for the time module, moved on by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Fetcher(object):
+    """ Counts the lookups a cache makes"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, user_id):
+        self.calls.append(user_id)
+        return 'user %d' % user_id
+
+
+def test_cart_shows_the_new_address(app, session, customer):
+    client, user_id = customer
+    assert '1 Main St' in client.get('/cart').get_data(as_text=True)
+    fields = {'street_1': '200 Ocean Ave', 'street_2': '', 'city': 'Naples',
+              'state': 'FL', 'zip_code': '34108'}
+    app.route_cache.put(app.get_address_string(Address(**fields)),
+                        (900, 8000))
+    response = client.post('/cart/update_address', data=fields)
+    assert response.status_code == 302
+    page = client.get('/cart').get_data(as_text=True)
+    assert '200 Ocean Ave' in page
+    assert '1 Main St' not in page
+
+
+def test_snapshots_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(identity, 'time', clock)
+    cache = IdentityCache(ttl=30)
+    fetch = Fetcher()
+    assert cache.get(1, fetch) == 'user 1'
+    clock.now += 29
+    cache.get(1, fetch)
+    assert fetch.calls == [1]
+    clock.now += 1
+    cache.get(1, fetch)
+    assert fetch.calls == [1, 1]
+    # Users who no longer exist are not kept
+    assert cache.get(2, lambda user_id: None) is None
+    assert 2 not in cache._entries
+
+
+def test_least_recently_used_are_dropped():
+    cache = IdentityCache(ttl=3600, max_entries=2)
+    fetch = Fetcher()
+    cache.get(1, fetch)
+    cache.get(2, fetch)
+    # Using the first makes the second the oldest
+    cache.get(1, fetch)
+    cache.get(3, fetch)
+    assert list(cache._entries) == [1, 3]
+    cache.get(1, fetch)
+    cache.get(2, fetch)
+    assert fetch.calls == [1, 2, 3, 2]
+    cache.invalidate(1)
+    cache.get(1, fetch)
+    assert fetch.calls == [1, 2, 3, 2, 1]
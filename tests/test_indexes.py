@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+from sqlalchemy.orm import sessionmaker
+import migrations
+from models import Base
+
+
+def index_names(engine):
+    # Reflection skips expression indexes such as lower(email)
+    if engine.dialect.name == 'sqlite':
+        sql = "SELECT name FROM sqlite_master WHERE type = 'index'"
+    else:
+        sql = ('SELECT indexname FROM pg_indexes '
+               'WHERE schemaname = current_schema()')
+    return set(row[0] for row in engine.execute(sql))
+
+
+def test_hot_queries_use_an_index(db_engine):
+    session = sessionmaker(bind=db_engine)()
+    try:
+        plans = migrations.explain_hot_queries(session)
+    finally:
+        session.close()
+    assert len(plans) == len(migrations.hot_queries(session))
+    for name, plan, uses_index in plans:
+        assert uses_index, '%s scans: %s' % (name, plan)
+
+
+def test_upgrade_adds_indexes_to_an_existing_database(db_engine):
+    expected = set(index.name for table in Base.metadata.sorted_tables
+                   for index in table.indexes)
+    # An old database has the tables but none of the indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(db_engine)
+    assert not expected & index_names(db_engine)
+    migrations.upgrade(db_engine)
+    assert expected <= index_names(db_engine)
+    # And running it again changes nothing
+    migrations.upgrade(db_engine)
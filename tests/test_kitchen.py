@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import pytest
+from kitchen import BASE_PREP_TIME, KitchenLoad
+from models import Order
+from tests.conftest import add_user
+
+NOW = datetime.datetime(2019, 5, 17, 18, 30)
+
+
+class Utc(datetime.tzinfo):
+    # Python 2 has no datetime.timezone
+    def utcoffset(self, moment):
+        return datetime.timedelta(0)
+
+    def dst(self, moment):
+        return datetime.timedelta(0)
+
+
+UTC = Utc()
+
+
+def minutes(n):
+    return NOW + datetime.timedelta(minutes=n)
+
+
+def add_orders(session, user_id, *delivery_minutes):
+    session.add_all([Order(user_id=user_id, order_time=minutes(-30),
+                           delivery_time=minutes(n))
+                     for n in delivery_minutes])
+    session.commit()
+
+
+def test_seed_counts_undelivered_orders(app, session):
+    user_id = add_user(app, session, 'kitchen@example.com')
+    add_orders(session, user_id, -5, 10, 20, 30)
+    # Placed long ago, never marked delivered
+    session.add(Order(user_id=user_id, order_time=minutes(-60 * 24),
+                      delivery_time=minutes(15)))
+    session.commit()
+    load = KitchenLoad()
+    load.seed(session, NOW)
+    assert load.in_flight(NOW) == 3
+
+
+def test_orders_expire_once_delivered():
+    load = KitchenLoad()
+    for n in (10, 20, 30):
+        load.record_order(minutes(n))
+    assert load.in_flight(minutes(5)) == 3
+    assert load.in_flight(minutes(20)) == 1
+    assert load.in_flight(minutes(45)) == 0
+
+
+def test_zoned_times_count_as_local(app, session):
+    user_id = add_user(app, session, 'zoned@example.com')
+    add_orders(session, user_id, 10)
+    load = KitchenLoad()
+    load.seed(session, NOW)
+    # As PostgreSQL returns timestamptz values
+    load.record_order(minutes(20).replace(tzinfo=UTC))
+    assert load.in_flight(NOW.replace(tzinfo=UTC)) == 2
+    assert load.in_flight(minutes(15)) == 1
+
+
+def test_prep_time_grows_every_three_orders():
+    load = KitchenLoad()
+    assert load.prep_time(NOW) == BASE_PREP_TIME
+    for _ in range(2):
+        load.record_order(minutes(30))
+    assert load.prep_time(NOW) == BASE_PREP_TIME
+    load.record_order(minutes(30))
+    assert load.prep_time(NOW) == pytest.approx(BASE_PREP_TIME * 1.2)
+    for _ in range(3):
+        load.record_order(minutes(30))
+    assert load.prep_time(NOW) == pytest.approx(BASE_PREP_TIME * 1.4)
+
+
+def test_reseed_counts_other_workers_orders(app, session):
+    user_id = add_user(app, session, 'workers@example.com')
+    load = KitchenLoad(app.DBSession, reseed_interval=0)
+    other = KitchenLoad(app.DBSession, reseed_interval=3600)
+    load.seed(session, NOW)
+    other.seed(session, NOW)
+    # Another worker places three orders
+    add_orders(session, user_id, 10, 20, 30)
+    assert load.in_flight(NOW) == 3
+    # Until its next reload a worker only sees its own
+    assert other.in_flight(NOW) == 0
+    other.record_order(minutes(10))
+    assert other.in_flight(NOW) == 1
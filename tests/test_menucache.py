@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+from menucache import MenuCache
+from models import MenuItem
+
+
+def names(snapshot):
+    return [i.name for i in snapshot.items]
+
+
+def test_menu_is_read_once_per_version(app, session, menu):
+    cache = MenuCache(check_interval=0)
+    first = cache.get(session)
+    assert names(first) == ['Chips and Salsa', 'Carne Asada', 'Flan']
+    assert cache.get(session) is first
+    session.query(MenuItem).filter_by(id=menu[2]).update(
+        {MenuItem.name: 'Tres Leches'})
+    cache.bump(session)
+    session.commit()
+    assert names(cache.get(session))[2] == 'Tres Leches'
+
+
+def test_other_workers_notice_the_stamp(app, session, menu):
+    worker = MenuCache(check_interval=3600)
+    other = MenuCache(check_interval=3600)
+    worker.get(session)
+    other.get(session)
+    # The other worker changes the menu and bumps the shared stamp
+    session.add(MenuItem(name='Churros', course='Dessert', description='',
+                         price='4.00', price_cents=400))
+    other.bump(session)
+    session.commit()
+    assert 'Churros' in names(other.get(session))
+    # Noticed at the next stamp check
+    assert 'Churros' not in names(worker.get(session))
+    worker.check_interval = 0
+    assert 'Churros' in names(worker.get(session))
+
+
+def test_admin_changes_show_straight_away(app, session, menu, admin):
+    assert b'Churros' not in admin.get('/menu/JSON').data
+    admin.post('/admin/new', data={'name': 'Churros', 'course': 'Dessert',
+                                   'description': '', 'price': '4.00'})
+    assert b'Churros' in admin.get('/menu/JSON').data
+    admin.post('/admin/edit/%d' % menu[0], data={
+        'name': 'Totopos', 'course': 'Appetizer', 'description': '',
+        'price': ''})
+    assert b'Totopos' in admin.get('/menu/%d/JSON' % menu[0]).data
+    admin.post('/admin/delete/%d' % menu[0])
+    assert admin.get('/menu/%d/JSON' % menu[0]).status_code == 404
+    assert b'Totopos' not in admin.get('/menu/JSON').data
+
+
+def test_every_bump_invalidates(app, session, menu):
+    cache = MenuCache(check_interval=3600)
+    for name in ('Totopos', 'Nachos'):
+        cache.get(session)
+        session.query(MenuItem).filter_by(id=menu[0]).update(
+            {MenuItem.name: name})
+        cache.bump(session)
+        session.commit()
+        assert names(cache.get(session))[0] == name
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import datetime
+import io
+import json
+from models import Cart, MenuItem, MenuVersion, Order, OrderItem
+from tests.conftest import MENU
+
+HEADER = u'name,course,description,price\n'
+POPPERS = u'Jalape\xf1o Poppers,Appetizer,Con queso,6.50\n'
+# The conftest menu as it is already saved
+CURRENT = u''.join(u'%s,%s,,%s\n' % item for item in MENU)
+
+
+def menu_csv(*lines):
+    return (HEADER + u''.join(lines)).encode('utf-8')
+
+
+def upload(client, data, query=''):
+    return client.post('/admin/menu/import' + query, data={
+        'menu': (io.BytesIO(data), 'menu.csv')},
+        content_type='multipart/form-data')
+
+
+def test_import_non_ascii_csv(app, session, menu, admin):
+    data = menu_csv(CURRENT, POPPERS)
+    response = upload(admin, data, '?dry_run=1')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == {
+        'added': [u'Jalape\xf1o Poppers'], 'updated': [], 'removed': [],
+        'unchanged': len(MENU)}
+    assert session.query(MenuItem).count() == len(MENU)
+
+    assert upload(admin, data).status_code == 200
+    session = app.DBSession()
+    item = session.query(MenuItem).filter_by(
+        name=u'Jalape\xf1o Poppers').one()
+    assert (item.price_cents, item.active) == (650, 1)
+    menu_page = admin.get('/menu').get_data(as_text=True)
+    assert u'Jalape\xf1o Poppers' in menu_page
+
+
+def test_import_rejects_bad_files(app, session, menu, admin):
+    for data in (menu_csv(u'Churros,Dessert,,"12,50"\n'),
+                 menu_csv(u'Churros,Dessert,,-4.00\n'),
+                 menu_csv(POPPERS, POPPERS),
+                 b'name,course,description,price\n\xff,Entree,,1\n'):
+        assert upload(admin, data).status_code == 400
+    response = admin.post('/admin/menu/import?format=json', data='[{',
+                          content_type='application/json')
+    assert response.status_code == 400
+    assert session.query(MenuItem).count() == len(MENU)
+
+
+def test_numeric_json_prices_are_unchanged(app, session, menu, admin):
+    version = session.query(MenuVersion).one().version
+    # 5 and 3.5 are the saved 5.00 and 3.50
+    data = json.dumps([{'name': name, 'course': course, 'description': '',
+                        'price': number}
+                       for (name, course, price), number
+                       in zip(MENU, (5, 11.75, 3.5))])
+    response = admin.post('/admin/menu/import?format=json', data=data,
+                          content_type='application/json')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == {
+        'added': [], 'updated': [], 'removed': [], 'unchanged': len(MENU)}
+    session = app.DBSession()
+    assert session.query(MenuVersion).one().version == version
+    assert [i.price for i in session.query(MenuItem).order_by(MenuItem.id)] \
+        == [price for name, course, price in MENU]
+
+
+def test_removed_items_leave_carts(app, session, menu, customer, admin,
+                                   monkeypatch):
+    client, user_id = customer
+    monkeypatch.setattr(app.cart_store, 'enabled', True)
+    order = Order(user_id=user_id, order_time=datetime.datetime.now())
+    session.add(order)
+    session.flush()
+    session.add(OrderItem(order_id=order.id, menu_item_id=menu[0],
+                          quantity=1))
+    session.commit()
+    for menu_id in menu:
+        client.get('/cart/add/%d' % menu_id)
+    # Keep only the dessert
+    name, course, price = MENU[2]
+    response = upload(admin, menu_csv(u'%s,%s,,%s\n' % (name, course, price)))
+    assert json.loads(response.get_data(as_text=True))['removed'] == [
+        MENU[0][0], MENU[1][0]]
+    session = app.DBSession()
+    # The ordered item is kept for the order history, the other is deleted
+    assert session.query(MenuItem.active).filter_by(
+        id=menu[0]).scalar() == 0
+    assert session.query(MenuItem).filter_by(id=menu[1]).count() == 0
+    assert app.cart_store.items(user_id) == {menu[2]: 1}
+    app.cart_store.flush()
+    assert [row.menu_item_id for row in session.query(Cart)] == [menu[2]]
+
+
+def test_import_command(app, session, menu, tmpdir):
+    path = tmpdir.join('menu.csv')
+    path.write_binary(menu_csv(CURRENT, POPPERS))
+    runner = app.app.test_cli_runner()
+    result = runner.invoke(args=['import-menu', str(path), '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert u'Jalape\xf1o Poppers' in result.output
+    assert session.query(MenuItem).count() == len(MENU)
+    result = runner.invoke(args=['import-menu', str(path)])
+    assert result.exit_code == 0, result.output
+    assert app.DBSession().query(MenuItem).count() == len(MENU) + 1
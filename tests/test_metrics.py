@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import time
+import metrics
+
+ROUNDS = 5
+REQUESTS = 50
+# Generous, shared test machines are noisy
+MAX_OVERHEAD = 1.25
+
+
+def test_metrics_endpoint(app, customer, admin, menu):
+    client, user_id = customer
+    client.get('/cart/add/%d' % menu[0])
+    client.get('/cart')
+    assert client.get('/admin/metrics').status_code == 403
+    response = admin.get('/admin/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert 'cantina_request_seconds_bucket{route="/cart",method="GET",' \
+        'status="200",le="+Inf"}' in text
+    assert 'cantina_request_sql_statements_count{route="/cart"}' in text
+    assert 'cantina_template_render_seconds_count{template="cart.html"}' \
+        in text
+    assert 'cantina_route_cache_hits_total' in text
+
+
+def test_histogram_is_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Test', ('route',),
+                                  (.1, 1))
+    for value in (.05, .5, .5, 5):
+        histogram.observe(value, '/')
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/",le="0.1"} 1',
+        'test_seconds_bucket{route="/",le="1"} 3',
+        'test_seconds_bucket{route="/",le="+Inf"} 4',
+        'test_seconds_sum{route="/"} 6.050000',
+        'test_seconds_count{route="/"} 4']
+
+
+def test_overhead_is_small(app, customer, menu, monkeypatch):
+    client, user_id = customer
+    client.get('/cart/add/%d' % menu[0])
+
+    def seconds_per_request(enabled):
+        monkeypatch.setattr(metrics, 'METRICS_ENABLED', enabled)
+        start = time.time()
+        for _ in range(REQUESTS):
+            client.get('/cart')
+        return (time.time() - start) / REQUESTS
+    seconds_per_request(True)
+    # Best of several alternating runs, so a pause hurts neither side
+    without, with_metrics = zip(*[
+        (seconds_per_request(False), seconds_per_request(True))
+        for _ in range(ROUNDS)])
+    assert min(with_metrics) < min(without) * MAX_OVERHEAD
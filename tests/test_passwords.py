@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import pytest
+import passwords
+from models import User
+from tests.conftest import PASSWORD, add_user, sign_in
+
+
+def hold_every_slot():
+    """ Returns how many verification slots were taken"""
+    held = 0
+    while passwords._verify_slots.acquire(False):
+        held += 1
+    return held
+
+
+def release(held):
+    for _ in range(held):
+        passwords._verify_slots.release()
+
+
+def test_needs_rehash():
+    assert passwords.needs_rehash(passwords.hash_password(PASSWORD)) is False
+    old = passwords.hash_password(PASSWORD, 'pbkdf2:sha256:2000')
+    assert passwords.needs_rehash(old)
+    assert passwords.full_method('pbkdf2:sha256') == \
+        'pbkdf2:sha256:%d' % passwords.DEFAULT_PBKDF2_ITERATIONS
+
+
+def test_login_moves_old_hashes_to_the_configured_method(app, session):
+    user_id = add_user(app, session, 'old@example.com')
+    user = session.query(User).filter_by(id=user_id).one()
+    user.password_hash = passwords.hash_password(PASSWORD,
+                                                 'pbkdf2:sha256:2000')
+    session.commit()
+    sign_in(app.app.test_client(), 'old@example.com')
+    session = app.DBSession()
+    pwhash = session.query(User).filter_by(id=user_id).one().password_hash
+    assert pwhash.startswith(passwords.PASSWORD_HASH_METHOD + '$')
+    assert passwords.verify_password(pwhash, PASSWORD)
+    # Hashes already on the configured method are left alone
+    sign_in(app.app.test_client(), 'old@example.com')
+    session = app.DBSession()
+    assert session.query(User).filter_by(id=user_id).one().password_hash \
+        == pwhash
+
+
+def test_busy_verifier(app, session, monkeypatch):
+    add_user(app, session, 'busy@example.com')
+    monkeypatch.setattr(passwords, 'PASSWORD_VERIFY_TIMEOUT', 0)
+    held = hold_every_slot()
+    try:
+        assert held == passwords.PASSWORD_VERIFY_CONCURRENCY
+        with pytest.raises(passwords.VerifierBusy):
+            passwords.verify_password(passwords.hash_password(PASSWORD),
+                                      PASSWORD)
+        client = app.app.test_client()
+        response = client.post('/login', data={'email': 'busy@example.com',
+                                                'password': PASSWORD})
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/login')
+        page = client.get('/login').get_data(as_text=True)
+        assert 'Too many people are signing in' in page
+        # Not signed in
+        assert client.get('/cart').status_code == 302
+    finally:
+        release(held)
+    sign_in(app.app.test_client(), 'busy@example.com')
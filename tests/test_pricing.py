@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import random
+from decimal import Decimal
+import pytest
+import pricing
+from models import MenuItem
+
+PRICES = ['5.00', '8.50', '11.75', '5.50', '14.00', '12.50', '10.50', '3.50',
+          '4.00', '7.75', '2.50', '3.00', '2.25', '1.75', '0.99', '19.95']
+
+
+class Item(object):
+    def __init__(self, price, quantity):
+        self.price = price
+        self.price_cents = pricing.to_cents(price)
+        self.quantity = quantity
+
+
+def float_totals(items):
+    """ The totals as the cart pages computed them before integer cents"""
+    subtotal = 0.0
+    for item in items:
+        subtotal += float(item.price) * item.quantity
+    if subtotal > 0:
+        fee = 2.99
+    else:
+        fee = 0
+    tax = (subtotal + fee) * 0.07
+    total = subtotal + fee + tax
+    return {
+        'subtotal': "{0:.2f}".format(subtotal),
+        'fee': "{0:.2f}".format(fee),
+        'tax': "{0:.2f}".format(tax),
+        'total': "{0:.2f}".format(total),
+    }
+
+
+def test_invalid_price_is_not_saved(app, session, menu, admin):
+    for price in ('12,50', '-4.00'):
+        response = admin.post('/admin/new', data={
+            'name': 'Churros', 'course': 'Dessert', 'description': '',
+            'price': price})
+        assert response.status_code == 200
+        assert b'is not a valid price' in response.data
+    response = admin.post('/admin/edit/%d' % menu[0], data={
+        'name': 'Free Chips', 'course': 'Appetizer', 'description': '',
+        'price': '-5'})
+    assert response.status_code == 200
+    response = admin.post('/admin/edit/%d' % menu[0], data={
+        'name': 'Free Chips', 'course': 'Appetizer', 'description': '',
+        'price': 'abc'})
+    assert response.status_code == 200
+    session = app.DBSession()
+    assert session.query(MenuItem).filter_by(name='Churros').count() == 0
+    item = session.query(MenuItem).filter_by(id=menu[0]).one()
+    assert (item.name, item.price_cents) == ('Chips and Salsa', 500)
+
+
+def test_item_without_a_price_is_not_sold(app, session, menu, customer):
+    client, user_id = customer
+    session.query(MenuItem).filter_by(id=menu[0]).update(
+        {MenuItem.price_cents: None})
+    app.menu_cache.bump(session)
+    session.commit()
+    client.get('/cart/add/%d' % menu[0])
+    assert app.cart_store.items(user_id) == {}
+    # Added before the price was lost
+    app.cart_store.add(user_id, menu[0])
+    app.cart_store.add(user_id, menu[1])
+    assert b'11.75' in client.get('/cart').data
+    response = client.get('/cart/order_placed')
+    assert response.status_code == 200
+    assert b'Chips and Salsa' not in response.data
+    assert b'Carne Asada' in response.data
+
+
+def test_totals_reject_a_missing_price():
+    line = MenuItem(name='Flan', price='', price_cents=None)
+    line.quantity = 1
+    with pytest.raises(ValueError):
+        pricing.items_totals([line])
+
+
+def test_prices_are_saved_as_charged(app, session, menu, admin):
+    admin.post('/admin/new', data={'name': 'Churros', 'course': 'Dessert',
+                                   'description': '', 'price': '$4.5'})
+    admin.post('/admin/edit/%d' % menu[0], data={
+        'name': '', 'course': 'Appetizer', 'description': '',
+        'price': '5.255'})
+    session = app.DBSession()
+    item = session.query(MenuItem).filter_by(name='Churros').one()
+    assert (item.price, item.price_cents) == ('4.50', 450)
+    item = session.query(MenuItem).filter_by(id=menu[0]).one()
+    assert (item.price, item.price_cents) == ('5.26', 526)
+
+
+def test_cents_match_the_float_totals_but_at_half_cents():
+    rng = random.Random(0)
+    differences = 0
+    for _ in range(20000):
+        items = [Item(rng.choice(PRICES), rng.randint(1, 12))
+                 for _ in range(rng.randint(0, 8))]
+        old = float_totals(items)
+        totals = pricing.items_totals(items)
+        new = totals.formatted()
+        # Subtotals and fees are exact sums, they never differ
+        assert (old['subtotal'], old['fee']) == (new['subtotal'], new['fee'])
+        if old != new:
+            differences += 1
+            # Only where the exact tax ends in half a cent, which floats
+            # can land just under and round down
+            exact = pricing.TAX_RATE * (totals.subtotal + totals.fee)
+            assert exact % 1 == Decimal('0.5')
+            for key in ('tax', 'total'):
+                assert pricing.to_cents(new[key]) - \
+                    pricing.to_cents(old[key]) in (0, 1)
+    assert differences
+
+
+def test_half_cent_tax_rounds_up():
+    items = [Item('19.95', 9), Item('12.50', 12), Item('0.99', 4),
+             Item('8.50', 12), Item('3.00', 7)]
+    # 7% of 459.50 is 32.165, which the float code showed as 32.16
+    assert float_totals(items)['tax'] == '32.16'
+    assert pricing.items_totals(items).formatted() == {
+        'subtotal': '456.51', 'fee': '2.99', 'tax': '32.17',
+        'total': '491.67'}
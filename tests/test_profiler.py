@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import json
+import pstats
+import pytest
+import profiler
+
+
+@pytest.fixture
+def request_profiler(app, monkeypatch):
+    fresh = profiler.Profiler(keep=3)
+    monkeypatch.setattr(app, 'request_profiler', fresh)
+    return fresh
+
+
+def listing(client):
+    response = client.get('/admin/profile')
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def test_armed_route_is_captured(app, menu, admin, request_profiler):
+    response = admin.post('/admin/profile', data={'route': '/menu',
+                                                  'requests': '2'})
+    assert json.loads(response.get_data(as_text=True))['armed'] == {
+        '/menu': 2}
+    for _ in range(3):
+        admin.get('/menu')
+    admin.get('/menu/JSON')
+    body = listing(admin)
+    assert body['armed'] == {}
+    assert [(c['route'], c['method']) for c in body['captures']] == [
+        ('/menu', 'GET')] * 2
+    # Disarmed with a count of 0
+    admin.post('/admin/profile', data={'route': '/cart', 'requests': '3'})
+    admin.post('/admin/profile', data={'route': '/cart', 'requests': '0'})
+    assert listing(admin)['armed'] == {}
+    assert admin.post('/admin/profile', data={
+        'route': '/cart', 'requests': 'many'}).status_code == 400
+
+
+def test_header_profiles_admin_requests(app, menu, customer, admin,
+                                        request_profiler):
+    client, user_id = customer
+    client.get('/menu', headers={profiler.PROFILE_HEADER: '1'})
+    assert request_profiler.captures() == []
+    admin.get('/menu', headers={profiler.PROFILE_HEADER: '1'})
+    assert [c.route for c in request_profiler.captures()] == ['/menu']
+
+
+def test_only_the_newest_are_kept(app, menu, admin, request_profiler):
+    admin.post('/admin/profile', data={'route': '/menu/JSON',
+                                       'requests': '5'})
+    for _ in range(5):
+        admin.get('/menu/JSON')
+    assert [c['id'] for c in listing(admin)['captures']] == [3, 4, 5]
+
+
+def test_download_reads_as_pstats(app, menu, admin, request_profiler,
+                                  tmpdir):
+    admin.get('/menu', headers={profiler.PROFILE_HEADER: '1'})
+    capture_id = request_profiler.captures()[0].id
+    response = admin.get('/admin/profile/%d' % capture_id)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert 'cantina-%d.pstats' % capture_id in \
+        response.headers['Content-Disposition']
+    path = tmpdir.join('menu.pstats')
+    path.write_binary(response.data)
+    stats = pstats.Stats(str(path))
+    assert 'show_menu' in [name for filename, line, name in stats.stats]
+    assert admin.get('/admin/profile/%d' % (capture_id + 1)).status_code \
+        == 404
+
+
+def test_profiles_are_admin_only(app, customer, request_profiler):
+    client, user_id = customer
+    assert client.get('/admin/profile').status_code == 403
+    assert client.post('/admin/profile', data={
+        'route': '/menu'}).status_code == 403
+    assert request_profiler.armed == {}
+    assert client.get('/admin/profile/1').status_code == 403
+
+
+def test_disabled_profiler_is_not_found(app, admin, request_profiler,
+                                        monkeypatch):
+    monkeypatch.setattr(profiler, 'PROFILER_ENABLED', False)
+    assert admin.get('/admin/profile').status_code == 404
+    assert admin.get('/admin/profile/1').status_code == 404
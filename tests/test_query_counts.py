@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import pytest
+from sqlalchemy import event
+
+# SQL statements per page with warm caches and with cold ones. The cart is
+# read on every request since write-behind is off by default
+ROUTES = [
+    # User and address in one join, the menu version, the cart
+    ('/cart', 1, 3),
+    ('/cart/edit_address', 1, 3),
+    # The menu version, then the user and address
+    ('/menu', 0, 2),
+    ('/menu/JSON', 0, 1),
+    # The user, then one query per rollup table
+    ('/admin/dashboard', 4, 5),
+]
+
+
+@pytest.fixture
+def statements(app):
+    """ Collects the SQL the app runs"""
+    executed = []
+
+    def on_execute(conn, cursor, statement, parameters, context, many):
+        executed.append(statement)
+    event.listen(app.engine, 'before_cursor_execute', on_execute)
+    yield executed
+    event.remove(app.engine, 'before_cursor_execute', on_execute)
+
+
+@pytest.mark.parametrize('path,warm,cold', ROUTES)
+def test_route_query_count(app, customer, admin, menu, statements, path,
+                           warm, cold):
+    client, user_id = customer
+    client.get('/cart/add/%d' % menu[0])
+    if path.startswith('/admin'):
+        client = admin
+    assert client.get(path).status_code == 200
+    del statements[:]
+    assert client.get(path).status_code == 200
+    assert len(statements) == warm, statements
+    app.identity_cache.invalidate()
+    app.menu_cache.invalidate()
+    del statements[:]
+    assert client.get(path).status_code == 200
+    assert len(statements) == cold, statements
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def usage(app):
+    """ Counts pool checkouts and the sessions that start a transaction"""
+    counts = {'connections': 0, 'sessions': set()}
+
+    def on_checkout(dbapi_connection, record, proxy):
+        counts['connections'] += 1
+
+    def on_begin(session, transaction, connection):
+        counts['sessions'].add(id(session))
+    event.listen(app.engine, 'checkout', on_checkout)
+    event.listen(Session, 'after_begin', on_begin)
+    yield counts
+    event.remove(app.engine, 'checkout', on_checkout)
+    event.remove(Session, 'after_begin', on_begin)
+
+
+def test_engine_and_session_factory_are_shared(app):
+    import database
+    import forms
+    assert app.engine is database.engine
+    assert app.DBSession is database.DBSession
+    assert forms.DBSession is database.DBSession
+
+
+@pytest.mark.parametrize('path', ['/cart', '/cart/edit_address', '/menu'])
+def test_request_uses_one_session_and_one_connection(app, customer, menu,
+                                                     usage, path):
+    client, user_id = customer
+    client.get('/cart/add/%d' % menu[0])
+    assert client.get(path).status_code == 200
+    # Cold caches, so the user and the menu are read from the database
+    app.identity_cache.invalidate()
+    app.menu_cache.invalidate()
+    usage['connections'] = 0
+    usage['sessions'].clear()
+    assert client.get(path).status_code == 200
+    assert usage['connections'] == 1
+    assert len(usage['sessions']) == 1
+
+
+def test_session_is_released_after_each_request(app, customer):
+    client, user_id = customer
+    client.get('/cart')
+    assert app.engine.pool.checkedout() == 0
+    assert not app.DBSession.registry.has()
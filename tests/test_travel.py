@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import time
+from tests.conftest import ADDRESS, add_user, sign_in
+
+# Borderline for the ZIP index, the estimate puts it inside the radius
+BORDERLINE_ADDRESS = dict(ADDRESS, street_1='9 Oil Well Rd', zip_code='34120')
+
+
+def borderline_customer(app, session, menu):
+    add_user(app, session, 'far@example.com', address=BORDERLINE_ADDRESS,
+             known_route=False)
+    client = sign_in(app.app.test_client(), 'far@example.com')
+    client.get('/cart/add/%d' % menu[0])
+    return client
+
+
+def test_maps_down_falls_back_to_estimate(app, session, menu):
+    # MAPS_API_HOST points at a closed port for the whole suite
+    client = borderline_customer(app, session, menu)
+    failures = app.travel_service.failures
+    assert client.get('/cart').status_code == 200
+    response = client.post('/cart/update_address', data=BORDERLINE_ADDRESS)
+    assert response.status_code == 302
+    response = client.get('/cart/order_placed')
+    assert response.status_code == 200
+    assert b'Total' in response.data
+    assert app.travel_service.failures > failures
+
+
+def test_directions_error_status_falls_back_to_estimate(app, session, menu,
+                                                        monkeypatch):
+    client = borderline_customer(app, session, menu)
+    monkeypatch.setattr(app.travel_service, 'get_json', lambda path: {
+        'status': 'ZERO_RESULTS', 'routes': []})
+    assert client.get('/cart').status_code == 200
+    assert client.get('/cart/order_placed').status_code == 200
+
+
+def test_request_waits_on_maps_once(app, session, menu, monkeypatch):
+    client = borderline_customer(app, session, menu)
+
+    def slow_get_json(path):
+        time.sleep(.5)
+        return {'status': 'OK', 'routes': [{'legs': [{
+            'duration': {'value': 900}, 'distance': {'value': 8000}}]}]}
+    monkeypatch.setattr(app.travel_service, 'get_json', slow_get_json)
+    monkeypatch.setattr(app.travel_service, 'budget', .1)
+    lookups = []
+    route = app.travel_service.route
+
+    def counted_route(*args, **kwargs):
+        lookups.append(args[0])
+        return route(*args, **kwargs)
+    monkeypatch.setattr(app.travel_service, 'route', counted_route)
+    # Checking the address and working out the delivery time share one
+    # lookup, so the request waits on Maps for one budget at most
+    assert client.get('/cart/order_placed').status_code == 200
+    assert len(lookups) == 1
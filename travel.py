@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import httplib
+import json
+import logging
+import os
+import socket
+import threading
+from multiprocessing.pool import ThreadPool, TimeoutError
+from geoindex import haversine
+from routecache import normalize_destination
+
+log = logging.getLogger(__name__)
+
+MAPS_API_HOST = os.environ.get('MAPS_API_HOST', 'maps.googleapis.com')
+# http is only meant for a local stand-in server, e.g. under load tests
+MAPS_API_SCHEME = os.environ.get('MAPS_API_SCHEME', 'https')
+# Worker threads, and so keep-alive connections, per process
+MAPS_POOL_SIZE = int(os.environ.get('MAPS_POOL_SIZE', 4))
+# Seconds a request waits for Maps before using an estimate
+MAPS_LATENCY_BUDGET = float(os.environ.get('MAPS_LATENCY_BUDGET', 1.5))
+# Socket timeout for the Maps request itself
+MAPS_HTTP_TIMEOUT = float(os.environ.get('MAPS_HTTP_TIMEOUT', 10))
+AVERAGE_SPEED = 13.4  # Meters per second, roughly equals 30 mph
+DEFAULT_TRAVEL_TIME = 1200  # Seconds, used when nothing is known
+
+
+class TravelService(object):
+    """ Looks up delivery routes on a small pool of worker threads
+
+        Each worker keeps its own keep-alive connection to the Maps API.
+        Callers wait at most the latency budget; a lookup that takes longer
+        keeps running and fills the route cache for the next request, while
+        the caller falls back to estimate(). So does a lookup that fails.
+    """
+
+    def __init__(self, route_cache, delivery_area,
+                 pool_size=MAPS_POOL_SIZE, budget=MAPS_LATENCY_BUDGET):
+        self.route_cache = route_cache
+        self.delivery_area = delivery_area
+        self.pool_size = pool_size
+        self.budget = budget
+        self.timeouts = 0
+        self.failures = 0
+        self._pool = None
+        self._pid = None
+        self._pending = {}
+        self._zip_times = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get_json(self, path):
+        """ GET a Maps API path over this thread's keep-alive connection"""
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                if MAPS_API_SCHEME == 'http':
+                    conn_class = httplib.HTTPConnection
+                else:
+                    conn_class = httplib.HTTPSConnection
+                conn = conn_class(MAPS_API_HOST, timeout=MAPS_HTTP_TIMEOUT)
+                self._local.conn = conn
+            try:
+                conn.request('GET', path)
+                return json.loads(conn.getresponse().read())
+            except (httplib.HTTPException, socket.error):
+                # Stale keep-alive connection, reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def route(self, destination, fetch, zip_code=None):
+        """ Returns (duration, distance) for the destination, or None if
+            the lookup failed or did not finish within the latency budget
+        """
+        route = self.route_cache.peek(destination)
+        if route is not None:
+            return route
+        key = normalize_destination(destination)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._get_pool().apply_async(
+                    self._lookup, (key, destination, fetch, zip_code))
+                self._pending[key] = pending
+        try:
+            return pending.get(self.budget)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            return None
+        except Exception:
+            # Maps refused, dropped the connection or had no route
+            log.warning('Maps lookup for %s failed', key, exc_info=True)
+            with self._lock:
+                self.failures += 1
+            return None
+
+    def estimate(self, destination, zip_code=None):
+        """ Returns an estimated (duration, distance) without calling Maps
+            distance is None when the destination cannot be located
+        """
+        distance = None
+        location = self.delivery_area.locate(destination, zip_code)
+        if location is not None:
+            origin = self.delivery_area.origin
+            distance = haversine(origin[0], origin[1],
+                                 location[0], location[1])
+            distance *= self.delivery_area.detour_factor
+        duration = self._zip_times.get(zip_code)
+        if duration is None and distance is not None:
+            duration = distance / AVERAGE_SPEED
+        if duration is None:
+            duration = DEFAULT_TRAVEL_TIME
+        return duration, distance
+
+    def _lookup(self, key, destination, fetch, zip_code):
+        try:
+            route = self.route_cache.get(destination, fetch)
+            if zip_code:
+                # Last known travel time for the ZIP, used by estimate()
+                self._zip_times[zip_code] = route[0]
+            return route
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _get_pool(self):
+        # Threads do not survive a fork, so each worker process builds its own
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ThreadPool(self.pool_size)
+            self._pid = os.getpid()
+            self._pending = {}
+        return self._pool
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Created by Jacob Schaible
+
+import os
+import Queue
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+
+WRITE_QUEUE_ENABLED = os.environ.get('WRITE_QUEUE_ENABLED', '1') == '1'
+# Seconds a request waits for its write before giving up
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', 10))
+LOCK_RETRIES = 3
+
+
+class WriteTimeout(Exception):
+    pass
+
+
+class WriteQueue(object):
+    """ Runs short write transactions one at a time on a dedicated thread
+
+        Serializing writes inside the process means request threads never
+        compete with each other for the SQLite write lock; competing with
+        other processes is left to busy_timeout. When disabled, work runs
+        directly on the caller's session.
+    """
+
+    def __init__(self, session_factory, enabled=WRITE_QUEUE_ENABLED,
+                 timeout=WRITE_QUEUE_TIMEOUT):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.timeout = timeout
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run(self, work):
+        """ Run work(session) in its own transaction and return its result
+            work should return plain values, not ORM objects
+        """
+        if not self.enabled:
+            return self._execute(work)
+        done = threading.Event()
+        job = {'work': work, 'done': done}
+        self._get_queue().put(job)
+        if not done.wait(self.timeout):
+            raise WriteTimeout('Write not applied within %s seconds'
+                               % self.timeout)
+        if 'error' in job:
+            raise job['error']
+        return job.get('result')
+
+    def _execute(self, work):
+        for attempt in range(LOCK_RETRIES):
+            session = self.session_factory()
+            try:
+                result = work(session)
+                session.commit()
+                return result
+            except OperationalError as e:
+                session.rollback()
+                # Another process held the lock past busy_timeout
+                if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                    raise
+                time.sleep(.05 * (attempt + 1))
+            except Exception:
+                session.rollback()
+                raise
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job['result'] = self._execute(job['work'])
+            except Exception as e:
+                job['error'] = e
+            finally:
+                self.session_factory.remove()
+                job['done'].set()
+
+    def _get_queue(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._queue is None or self._pid != os.getpid():
+            with self._lock:
+                if self._queue is None or self._pid != os.getpid():
+                    self._queue = Queue.Queue()
+                    thread = threading.Thread(target=self._worker)
+                    thread.daemon = True
+                    thread.start()
+                    self._pid = os.getpid()
+        return self._queue